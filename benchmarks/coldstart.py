@@ -0,0 +1,163 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+from benchmarks.run import git_commit  # noqa: E402
+from benchmarks.synthetic import generate_org  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+LIB_DIRNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib")
+# mirrors the probe variables read by lib/app.py
+STARTUP_PROBE_ENV = "COFFEE_CHAT_STARTUP_PROBE"
+PROBE_PARTICIPANTS_ENV = "COFFEE_CHAT_PROBE_PARTICIPANTS"
+PROBE_RESULTS_ENV = "COFFEE_CHAT_PROBE_RESULTS"
+APP_BINARY = os.path.join("Contents", "MacOS", "CoffeeChatPairing")
+POLL_SECONDS = 0.005
+LAUNCH_TIMEOUT_SECONDS = 300
+
+
+def time_import(module: str) -> float:
+    """
+    Times a fresh interpreter importing `module` from lib/, minus the bare interpreter start.
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=LIB_DIRNAME, check=True)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return elapsed - (time.perf_counter() - start)
+
+
+def time_cli(root: str, participants_filename: str, results_name: str) -> float:
+    """
+    Times lib/main.py from launch until the results file exists, then accepts it.
+    """
+    results_filename = os.path.join(root, "pairings", results_name)
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(LIB_DIRNAME, "main.py"), participants_filename, results_name],
+        cwd=root,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    try:
+        while not os.path.exists(results_filename):
+            if time.perf_counter() - start > LAUNCH_TIMEOUT_SECONDS:
+                raise RuntimeError(f"main.py didn't write {results_filename} within {LAUNCH_TIMEOUT_SECONDS}s")
+            if proc.poll() is not None:
+                raise RuntimeError(f"main.py exited with {proc.returncode} before writing {results_filename}")
+            time.sleep(POLL_SECONDS)
+        elapsed = time.perf_counter() - start
+        proc.communicate("Y\n", timeout=60)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+    os.remove(results_filename)
+    return elapsed
+
+
+def time_app(command: List[str], root: str, participants_filename: Optional[str]) -> Dict[str, float]:
+    """
+    Launches the GUI with the startup probe set, and reads back its timings.
+    """
+    env = dict(os.environ)
+    env[STARTUP_PROBE_ENV] = repr(time.time())
+    if participants_filename is not None:
+        env[PROBE_PARTICIPANTS_ENV] = participants_filename
+        env[PROBE_RESULTS_ENV] = "coldstart-probe"
+    proc = subprocess.run(command, cwd=root, env=env, capture_output=True, text=True, timeout=LAUNCH_TIMEOUT_SECONDS)
+    timings = {}
+    for line in proc.stdout.splitlines():
+        key, _, value = line.partition(" ")
+        if key == "failed":
+            raise RuntimeError(f"The app failed to generate pairings: {value}")
+        if key in ("time_to_window", "time_to_first_result"):
+            timings[key] = float(value)
+    if "time_to_window" not in timings:
+        raise RuntimeError(f"The app exited with {proc.returncode} without reporting: {proc.stderr[-2000:]}")
+    results_filename = os.path.join(root, "pairings", "coldstart-probe.csv")
+    if os.path.exists(results_filename):
+        os.remove(results_filename)
+    return timings
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    return {"median": statistics.median(samples), "min": min(samples), "samples": samples}
+
+
+def main(args: argparse.Namespace) -> None:
+    results: Dict[str, Any] = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "participants": args.participants,
+        "runs": args.runs,
+        "measurements": {},
+    }
+    measurements = results["measurements"]
+
+    for module in ("core", "app") if args.app else ("core",):
+        measurements[f"import_{module}"] = summarize([time_import(module) for _ in range(args.runs)])
+
+    with tempfile.TemporaryDirectory() as root:
+        org = generate_org(root, args.participants, args.months, seed=args.seed)
+        # the first run also builds the history index and ID registry, report it on its own
+        first = time_cli(root, org.participants_filename, "coldstart.csv")
+        measurements["cli_time_to_first_result_unindexed"] = first
+        measurements["cli_time_to_first_result"] = summarize(
+            [time_cli(root, org.participants_filename, "coldstart.csv") for _ in range(args.runs)]
+        )
+
+        if args.app:
+            if args.app.rstrip(os.sep).endswith(".app"):
+                # the frozen app works next to its bundle, so give it the synthetic org
+                bundle = os.path.join(root, os.path.basename(args.app.rstrip(os.sep)))
+                shutil.copytree(args.app, bundle, symlinks=True)
+                command = [os.path.join(bundle, APP_BINARY)]
+            else:
+                command = [sys.executable, os.path.abspath(args.app)]
+            windows = [time_app(command, root, None) for _ in range(args.runs)]
+            measurements["app_time_to_window"] = summarize([t["time_to_window"] for t in windows])
+            firsts = [time_app(command, root, org.participants_filename) for _ in range(args.runs)]
+            measurements["app_time_to_first_result"] = summarize([t["time_to_first_result"] for t in firsts])
+
+    for name, stats in measurements.items():
+        seconds = stats["median"] if isinstance(stats, dict) else stats
+        logger.info(f"{name}: {seconds * 1000:.0f}ms")
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Cold start results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how long the CLI and the app take to start up.")
+    parser.add_argument("--participants", type=int, default=200)
+    parser.add_argument("--months", type=int, default=12, help="Months of pairing history to generate.")
+    parser.add_argument("--runs", type=int, default=5, help="Launches per measurement.")
+    parser.add_argument(
+        "--app",
+        default=None,
+        help="lib/app.py or a built CoffeeChatPairing.app to also time the window and first result of.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="coldstart-results.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main(args)
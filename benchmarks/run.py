@@ -0,0 +1,179 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+from benchmarks.synthetic import generate_org  # noqa: E402
+from core import CoffeeChatCore  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+SWEEP_SIZES = [100, 500, 1000, 2000, 5000, 10000, 20000, 50000]
+# the networkx backend is O(n^3) in pure Python, past this size a run takes far too long
+NETWORKX_MAX_PARTICIPANTS = 2000
+
+
+def measure(fn: Callable[[], Any], trace_memory: bool) -> Tuple[Any, Dict[str, float]]:
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        res = fn()
+        elapsed = time.perf_counter() - start
+        stats = {"seconds": elapsed}
+        if trace_memory:
+            stats["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return res, stats
+
+
+def run_benchmark(
+    participants: int,
+    months: int,
+    constraint_density: float,
+    odd: bool,
+    backend: str,
+    trace_memory: bool = True,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Generates a synthetic organization in a temporary directory and times every
+    CoffeeChatCore stage on it, each with its own peak memory.
+    """
+    run: Dict[str, Any] = {
+        "participants": participants,
+        "months": months,
+        "constraint_density": constraint_density,
+        "odd": odd,
+        "backend": backend,
+        "stages": {},
+    }
+    stages = run["stages"]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        org = generate_org(root, participants, months, constraint_density, odd, seed=seed)
+        os.chdir(root)
+        try:
+            core = CoffeeChatCore(org.participants_filename, "benchmark.csv")
+            core.backend = backend
+            loaded_data, stages["load_data_cold"] = measure(core.load_data, trace_memory)
+            # a second core sees an up-to-date history index and ID registry
+            warm_core = CoffeeChatCore(org.participants_filename, "benchmark.csv")
+            _, stages["load_data_warm"] = measure(warm_core.load_data, trace_memory)
+
+            participant_names = loaded_data.participant_names
+            constraints_ids = loaded_data.constraints_ids
+            run["roster_size"] = len(participant_names)
+            run["constraint_edges"] = len(constraints_ids)
+            run["history_files"] = len(core.history.filenames)
+
+            pair_names, stages["matchmake"] = measure(
+                lambda: core.run_matchmaking(participant_names, constraints_ids),
+                trace_memory,
+            )
+            run["pairs"] = len(pair_names)
+            valid, stages["sanity_check_matches"] = measure(
+                lambda: core.sanity_check_matches(pair_names, participant_names),
+                trace_memory,
+            )
+            run["valid"] = valid
+            _, stages["write_pairings"] = measure(
+                lambda: core.finalize_matches(pair_names), trace_memory
+            )
+        finally:
+            os.chdir(cwd)
+    logger.info(
+        f"{participants} participants ({backend}): "
+        + ", ".join(f"{stage} {stats['seconds']:.3f}s" for stage, stats in stages.items())
+    )
+    return run
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args: argparse.Namespace) -> None:
+    sizes = SWEEP_SIZES if args.sweep else [args.participants]
+    backends = ["implicit", "networkx"] if args.backend == "both" else [args.backend]
+    runs: List[Dict[str, Any]] = []
+    for size in sizes:
+        for backend in backends:
+            if backend == "networkx" and size > args.networkx_max:
+                runs.append(
+                    {
+                        "participants": size,
+                        "backend": backend,
+                        "skipped": f"networkx is only run up to {args.networkx_max} participants",
+                    }
+                )
+                continue
+            runs.append(
+                run_benchmark(
+                    size,
+                    args.months,
+                    args.constraint_density,
+                    args.odd,
+                    backend,
+                    trace_memory=not args.no_memory,
+                    seed=args.seed,
+                )
+            )
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "memory_traced": not args.no_memory,
+        "runs": runs,
+    }
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Benchmark results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the coffee chat pipeline on synthetic organizations.")
+    parser.add_argument("--participants", type=int, default=1000)
+    parser.add_argument("--months", type=int, default=12, help="Months of pairing history to generate.")
+    parser.add_argument("--constraint-density", type=float, default=0.01, help="CONSTRAINTS.csv rows per participant.")
+    parser.add_argument("--odd", action="store_true", help="Use an odd-sized roster.")
+    parser.add_argument("--backend", choices=["implicit", "networkx", "both"], default="implicit")
+    parser.add_argument("--sweep", action="store_true", help=f"Run every size in {SWEEP_SIZES}.")
+    parser.add_argument("--networkx-max", type=int, default=NETWORKX_MAX_PARTICIPANTS)
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Skip tracemalloc, which slows every stage down but records peak memory.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark-results.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # keep the pipeline's own logging out of the way, except for real failures
+    for name in ("core", "matching", "implicit_matching", "history_index", "id_registry", "weights"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    main(args)
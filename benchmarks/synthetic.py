@@ -0,0 +1,85 @@
+import csv
+import os
+import random
+import sys
+from dataclasses import dataclass
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+from weights import MONTHS  # noqa: E402
+
+
+@dataclass
+class SyntheticOrg:
+    root: str
+    participants_filename: str
+    names: List[str]
+    history_files: List[str]
+
+
+def generate_org(
+    root: str,
+    participants: int,
+    months: int = 12,
+    constraint_density: float = 0.01,
+    odd: bool = False,
+    attendance: float = 0.9,
+    seed: int = 0,
+) -> SyntheticOrg:
+    """
+    Writes a synthetic organization under `root` in the same layout as the repo:
+    pairings/ with `months` past months plus CONSTRAINTS.csv, an empty ids/ folder, and
+    participants/roster.csv for this month.
+    Inputs:
+        root: str, the directory to write into.
+        participants: int, the size of the organization.
+        months: int, how many months of pairing history to generate.
+        constraint_density: float, CONSTRAINTS.csv rows per participant.
+        odd: bool, whether this month's roster should have an odd number of people.
+        attendance: float, the fraction of the organization taking part each month.
+        seed: int, seed for everything random.
+    Returns:
+        org: SyntheticOrg, the generated paths and names.
+    """
+    rng = random.Random(seed)
+    names = [f"Person {i:06d}" for i in range(participants)]
+    pairings_dirname = os.path.join(root, "pairings")
+    os.makedirs(pairings_dirname, exist_ok=True)
+    os.makedirs(os.path.join(root, "ids"), exist_ok=True)
+    os.makedirs(os.path.join(root, "participants"), exist_ok=True)
+
+    constraints = set()
+    for _ in range(int(constraint_density * participants)):
+        a, b = rng.sample(range(participants), 2)
+        constraints.add((min(a, b), max(a, b)))
+    with open(os.path.join(pairings_dirname, "CONSTRAINTS.csv"), "w") as f:
+        writer = csv.writer(f)
+        for a, b in sorted(constraints):
+            writer.writerow([names[a], names[b]])
+
+    # every month pairs up a random permutation of the org, with a random subset
+    # attending. A repeat across months is rare and fine, history has those too
+    history_files = []
+    people = list(range(participants))
+    for month in range(months):
+        rng.shuffle(people)
+        year, month_of_year = divmod(month, 12)
+        filename = os.path.join(pairings_dirname, f"{MONTHS[month_of_year]}{10 + year:02d}.csv")
+        with open(filename, "w") as f:
+            writer = csv.writer(f)
+            for a, b in zip(people[::2], people[1::2]):
+                if (min(a, b), max(a, b)) not in constraints and rng.random() < attendance:
+                    writer.writerow([names[a], names[b]])
+        history_files.append(filename)
+
+    roster = [name for name in names if rng.random() < attendance]
+    if (len(roster) % 2 == 1) != odd:
+        roster = roster[:-1] if roster else names[:1]
+    participants_filename = os.path.join(root, "participants", "roster.csv")
+    with open(participants_filename, "w") as f:
+        writer = csv.writer(f)
+        for name in roster:
+            writer.writerow([name])
+
+    return SyntheticOrg(root, participants_filename, roster, history_files)
@@ -3,9 +3,17 @@ import PyInstaller.__main__
 PyInstaller.__main__.run([
     "lib/app.py",
     "--noconsole",
-    "-F",
-    "--distpath .",
+    # a one-file build unpacks the whole bundle into a temporary folder on every
+    # launch, a one-folder .app starts straight from its own files
+    "--onedir",
+    "--distpath", ".",
     "-y",
-    "-n CoffeeChatPairing",
-    "--target-arch universal2",
+    "-n", "CoffeeChatPairing",
+    "--target-arch", "universal2",
+    # the app only uses PyQt6, keep everything else that might be installed out of the bundle
+    "--exclude-module", "PyQt5",
+    "--exclude-module", "tkinter",
+    "--exclude-module", "matplotlib",
+    "--exclude-module", "scipy",
+    "--exclude-module", "pandas",
 ])
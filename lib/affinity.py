@@ -0,0 +1,298 @@
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from weights import MAX_LISTED_PAIRS, SparseWeights
+
+logger = logging.getLogger(__name__)
+
+# the optional roster columns, in the order they're read from a roster without a header
+ROSTER_COLUMNS = ("team", "office", "timezone", "seniority")
+# bonus a matching rule adds to a pair's weight unless the rule sets its own, next to
+# the WEIGHT_SCALE a never-met pair is worth
+DEFAULT_AFFINITY_WEIGHT = 100
+# pairs evaluated at once, bounding the temporaries to a few MB
+AFFINITY_BLOCK_CELLS = 1 << 20
+# code of a missing value
+UNKNOWN = -1
+
+
+@dataclass
+class ParticipantAttributes:
+    """
+    The optional roster columns of every participant, as compact arrays. Every column is
+    dictionary-encoded: codes[column][i] indexes vocab[column] for the i-th name, or is
+    UNKNOWN when the cell was empty.
+    """
+
+    names: List[str]
+    codes: Dict[str, np.ndarray] = field(default_factory=dict)
+    vocab: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.codes)
+
+    def numeric(self, column: str) -> Optional[np.ndarray]:
+        """
+        Returns the column as floats (NaN where unknown), or None if some value isn't a number.
+        """
+        try:
+            values = np.array([float(value) for value in self.vocab[column]] + [math.nan])
+        except ValueError:
+            return None
+        # UNKNOWN indexes the trailing NaN
+        return values[self.codes[column]]
+
+    def select(self, names: Sequence[str]) -> "ParticipantAttributes":
+        """
+        Returns the attributes of `names` in that order. Names that aren't on the roster,
+        e.g. someone added later, get unknown values.
+        """
+        row_of = {name: i for i, name in enumerate(self.names)}
+        rows = np.array([row_of.get(name, -1) for name in names], dtype=np.int64)
+        codes = {}
+        for column, column_codes in self.codes.items():
+            padded = np.append(column_codes, np.int32(UNKNOWN))
+            codes[column] = padded[rows]
+        return ParticipantAttributes(list(names), codes, self.vocab)
+
+
+class AttributeReader:
+    """
+    Builds ParticipantAttributes one roster row at a time, so a roster is encoded in
+    the same pass that reads it.
+    """
+
+    def __init__(self, columns: Sequence[str]):
+        self.names: List[str] = []
+        self.columns = list(columns)
+        self.codes: List[List[int]] = [[] for _ in self.columns]
+        self.lookup: List[Dict[str, int]] = [{} for _ in self.columns]
+
+    def add(self, name: str, values: Sequence[str]) -> None:
+        self.names.append(name)
+        for i, lookup in enumerate(self.lookup):
+            value = values[i].strip() if i < len(values) else ""
+            if not value:
+                self.codes[i].append(UNKNOWN)
+            else:
+                self.codes[i].append(lookup.setdefault(value, len(lookup)))
+
+    def finish(self) -> ParticipantAttributes:
+        # a column nobody filled in, e.g. of a plain list of names, isn't kept
+        kept = [i for i, lookup in enumerate(self.lookup) if lookup]
+        return ParticipantAttributes(
+            self.names,
+            {self.columns[i]: np.array(self.codes[i], dtype=np.int32) for i in kept},
+            {self.columns[i]: list(self.lookup[i]) for i in kept},
+        )
+
+
+def _same(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a == b).astype(np.float64)
+
+
+def _cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a != b).astype(np.float64)
+
+
+def _near(a: np.ndarray, b: np.ndarray, spread: float) -> np.ndarray:
+    return 1 - np.abs(a - b) / spread
+
+
+def _far(a: np.ndarray, b: np.ndarray, spread: float) -> np.ndarray:
+    return np.abs(a - b) / spread
+
+
+# relation -> score of every pair in [0, 1], given a block of rows and all columns
+CATEGORICAL_RELATIONS: Dict[str, Callable[[np.ndarray, np.ndarray], np.ndarray]] = {
+    "same": _same,
+    "cross": _cross,
+}
+NUMERIC_RELATIONS: Dict[str, Callable[[np.ndarray, np.ndarray, float], np.ndarray]] = {
+    "near": _near,
+    "far": _far,
+}
+
+
+@dataclass(frozen=True)
+class AffinityRule:
+    """
+    One term of the affinity function, e.g. "prefer people from different teams".
+    A hard rule forbids the pairs it doesn't hold for instead of weighting them.
+    """
+
+    relation: str
+    column: str
+    weight: int = DEFAULT_AFFINITY_WEIGHT
+    hard: bool = False
+
+    def __str__(self) -> str:
+        return f"{'require' if self.hard else 'prefer'} {self.relation}:{self.column}" + (
+            "" if self.hard else f"={self.weight}"
+        )
+
+
+def parse_rule(spec: str, hard: bool = False) -> AffinityRule:
+    """
+    Parses a rule written as "relation:column[=weight]", e.g. "cross:team",
+    "same:timezone" or "near:seniority=300".
+    """
+    rule, _, weight = spec.partition("=")
+    relation, _, column = rule.partition(":")
+    relation, column = relation.strip().lower(), column.strip().lower()
+    if relation not in CATEGORICAL_RELATIONS and relation not in NUMERIC_RELATIONS:
+        raise ValueError(
+            f"Unknown relation {relation!r} in {spec!r}, expected one of "
+            f"{sorted(CATEGORICAL_RELATIONS) + sorted(NUMERIC_RELATIONS)}"
+        )
+    if not column:
+        raise ValueError(f"Missing column in {spec!r}, expected relation:column")
+    if hard and relation not in CATEGORICAL_RELATIONS:
+        raise ValueError(f"Only {sorted(CATEGORICAL_RELATIONS)} can be required, not {relation!r}")
+    if hard and weight:
+        raise ValueError(f"A required rule has no weight: {spec!r}")
+    # a preference adds to a pair's weight, and can't take away from one
+    if weight and not weight.strip().isdigit():
+        raise ValueError(f"The weight in {spec!r} must be a whole number, at least 0")
+    return AffinityRule(relation, column, int(weight) if weight else DEFAULT_AFFINITY_WEIGHT, hard)
+
+
+def _rule_operands(
+    attributes: ParticipantAttributes,
+    rule: AffinityRule,
+) -> Tuple[np.ndarray, np.ndarray, Callable[[np.ndarray, np.ndarray], np.ndarray]]:
+    """
+    Returns the values a rule compares, which of them are known, and the comparison.
+    """
+    if rule.column not in attributes.codes:
+        raise ValueError(f"The roster has no {rule.column!r} column, it has {attributes.columns}")
+    if rule.relation in CATEGORICAL_RELATIONS:
+        values = attributes.codes[rule.column]
+        return values, values != UNKNOWN, CATEGORICAL_RELATIONS[rule.relation]
+
+    values = attributes.numeric(rule.column)
+    if values is None:
+        raise ValueError(f"{rule.relation!r} needs a numeric column, {rule.column!r} isn't one")
+    known = ~np.isnan(values)
+    spread = float(np.ptp(values[known])) if known.any() else 0.0
+    relation = NUMERIC_RELATIONS[rule.relation]
+    # with a single value everyone is equally near (or far)
+    return values, known, lambda a, b: relation(a, b, spread or 1.0)
+
+
+def _blocks(n: int) -> Iterator[Tuple[int, int]]:
+    rows = max(1, AFFINITY_BLOCK_CELLS // max(n, 1))
+    for start in range(0, n, rows):
+        yield start, min(start + rows, n)
+
+
+def _block_weights(
+    weights: SparseWeights,
+    operands: List[tuple],
+    start: int,
+    stop: int,
+) -> np.ndarray:
+    # rows start..stop against columns start..n, so the upper triangle of the block
+    # (col > row) holds every pair of these rows with a later participant
+    block = np.full((stop - start, weights.n - start), weights.default, dtype=np.int64)
+    lo, hi = np.searchsorted(weights.rows, [start, stop])
+    block[weights.rows[lo:hi] - start, weights.cols[lo:hi] - start] = weights.values[lo:hi]
+    allowed = block > 0
+    bonus = np.zeros(block.shape, dtype=np.float64)
+    for rule, values, known, relation in operands:
+        score = relation(values[start:stop, None], values[None, start:])
+        both_known = known[start:stop, None] & known[None, start:]
+        if rule.hard:
+            allowed &= (score > 0) | ~both_known
+        else:
+            bonus += rule.weight * np.where(both_known, score, 0)
+    return np.where(allowed, block + np.rint(bonus).astype(np.int64), 0)
+
+
+def apply_affinity(
+    weights: SparseWeights,
+    attributes: ParticipantAttributes,
+    rules: Sequence[AffinityRule],
+) -> SparseWeights:
+    """
+    Adds the affinity of every pair to the edge weights. A pair gets each preference's
+    weight times how well it holds (0 to 1), and a pair breaking a required rule gets
+    weight 0, i.e. no edge. Pairs that already weigh 0 stay forbidden.
+    Rules are evaluated on blocks of rows, one NumPy pass per block, twice: first to
+    find the weight most pairs end up with, which becomes the new default, then to list
+    every pair that weighs anything else. The pairs breaking a required rule are listed
+    with weight 0, which the implicit matcher treats as forbidden.
+    Inputs:
+        weights: SparseWeights, edge weights of the participants in attributes.
+        attributes: ParticipantAttributes, the participants' roster columns, in the
+            same order as weights.
+        rules: Sequence[AffinityRule], the terms of the affinity function. A missing
+            value never earns a bonus, and never breaks a required rule.
+    Returns:
+        weights: SparseWeights, the weights with the affinity added.
+    Raises:
+        ValueError: if more than MAX_LISTED_PAIRS pairs would weigh something other than
+            the new default.
+    """
+    n = weights.n
+    operands = [(rule, *_rule_operands(attributes, rule)) for rule in rules]
+    counts = np.zeros(1, dtype=np.int64)
+    for start, stop in _blocks(n):
+        block = _block_weights(weights, operands, start, stop)
+        # count the whole block, less its corner on or below the diagonal
+        corner = block[:, : stop - start][np.tril(np.ones((stop - start, stop - start), dtype=bool))]
+        block_counts = np.bincount(block.ravel()) - np.bincount(corner, minlength=block.max() + 1)
+        counts = np.pad(counts, (0, max(len(block_counts) - len(counts), 0)))
+        counts[: len(block_counts)] += block_counts
+    # an unlisted pair is allowed, so forbidden pairs are always listed however many
+    default = int(np.argmax(counts[1:])) + 1 if counts[1:].any() else weights.default
+    listed = n * (n - 1) // 2 - (int(counts[default]) if default < len(counts) else 0)
+    if listed > MAX_LISTED_PAIRS:
+        raise ValueError(
+            f"The affinity rules give {listed} pairs their own weight, more than the "
+            f"{MAX_LISTED_PAIRS} that fit in memory. Split the roster with --shard-by "
+            f"instead of requiring the same value, or prefer fewer columns."
+        )
+
+    rows, cols, values = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for start, stop in _blocks(n):
+        block = _block_weights(weights, operands, start, stop)
+        block_rows, block_cols = np.nonzero(np.triu(block != default, 1))
+        rows.append(block_rows + start)
+        cols.append(block_cols + start)
+        values.append(block[block_rows, block_cols])
+    logger.debug(
+        f"Applied {len(rules)} affinity rules to {n} participants, "
+        f"{listed} pairs weigh other than {default}"
+    )
+    # the blocks are visited in order, so the pairs come out sorted
+    return SparseWeights(n, np.concatenate(rows), np.concatenate(cols), np.concatenate(values), default)
+
+
+def forbidden_pairs(
+    attributes: ParticipantAttributes,
+    rules: Sequence[AffinityRule],
+) -> List[Tuple[int, int]]:
+    """
+    Returns every pair of positions in attributes that breaks a required rule.
+    """
+    hard = [rule for rule in rules if rule.hard]
+    n = len(attributes.names)
+    if not hard:
+        return []
+    operands = [_rule_operands(attributes, rule) for rule in hard]
+    pairs: List[Tuple[int, int]] = []
+    for start, stop in _blocks(n):
+        broken = np.zeros((stop - start, n - start), dtype=bool)
+        for values, known, relation in operands:
+            score = relation(values[start:stop, None], values[None, start:])
+            broken |= (score <= 0) & known[start:stop, None] & known[None, start:]
+        # only the upper triangle, so every pair is listed once
+        rows, cols = np.nonzero(np.triu(broken, 1))
+        pairs.extend(zip((rows + start).tolist(), (cols + start).tolist()))
+    return pairs
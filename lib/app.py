@@ -1,8 +1,10 @@
 import time
 import logging
+import multiprocessing
 import os
 import sys
-from typing import cast
+from typing import TYPE_CHECKING, Any, Callable, Optional, Tuple, cast
+from PyQt6.QtCore import QObject, Qt, QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QScreen
 from PyQt6.QtWidgets import (
     QApplication,
@@ -10,23 +12,75 @@ from PyQt6.QtWidgets import (
     QGroupBox,
     QLabel,
     QLineEdit,
-    QMessageBox,
+    QProgressBar,
     QPushButton,
+    QSpinBox,
     QVBoxLayout,
     QWidget,
 )
 
-from core import init_logging, CoffeeChatCore
+from implicit_matching import MatchingCancelled, ProgressCallback
+from log_utils import init_logging
+
+if TYPE_CHECKING:
+    from core import CoffeeChatCore
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+# benchmarks/coldstart.py sets this to the launch time (seconds since the epoch), and
+# the app prints how long it took to show its window
+STARTUP_PROBE_ENV = "COFFEE_CHAT_STARTUP_PROBE"
+# with these also set, the app generates pairings right away and prints how long the
+# first result took, then quits
+PROBE_PARTICIPANTS_ENV = "COFFEE_CHAT_PROBE_PARTICIPANTS"
+PROBE_RESULTS_ENV = "COFFEE_CHAT_PROBE_RESULTS"
+
+
+class PipelineWorker(QObject):
+    """
+    Runs one step of the pipeline off the UI thread. The step gets a progress callback
+    that forwards (stage, fraction) to the UI, and raises MatchingCancelled once the
+    user has pressed cancel.
+    """
+
+    progress = pyqtSignal(str, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, step: Callable[[ProgressCallback], Any]):
+        super().__init__()
+        self.step = step
+        self.cancelled = False
+
+    def run(self):
+        try:
+            result = self.step(self.report)
+        except MatchingCancelled:
+            self.failed.emit("Cancelled.")
+        except Exception as e:
+            logger.exception("Pipeline step failed")
+            self.failed.emit(f"Error: {e}")
+        else:
+            self.finished.emit(result)
+
+    def report(self, stage: str, fraction: float):
+        if self.cancelled:
+            raise MatchingCancelled()
+        self.progress.emit(stage, int(fraction * 100))
+
 
 class CoffeeChatWidget(QWidget):
     def __init__(self):
         super().__init__()
+        self.core = None
+        self.participant_names = None
+        self.thread: Optional[QThread] = None
+        self.worker: Optional[PipelineWorker] = None
+        self.onWorkerDone: Optional[Callable[[Any], None]] = None
+        # the finished step's result, handed on once its thread has stopped
+        self.workerResult: Optional[Tuple[Any]] = None
+        self.probeLaunchTime: Optional[float] = None
         self.initUI()
-        self.sit_mode = "out"
-        self.maybe_solo_participant = None
 
     def initUI(self):
         # create the window
@@ -51,9 +105,23 @@ class CoffeeChatWidget(QWidget):
         self.message.setStyleSheet("color: red")
         startButtonLayout.addWidget(self.message)
 
-        startButton = QPushButton("Generate this month's coffee chat pairings!")
-        startButton.clicked.connect(self.onButtonClicked)
-        startButtonLayout.addWidget(startButton)
+        self.startButton = QPushButton("Generate this month's coffee chat pairings!")
+        self.startButton.clicked.connect(self.onButtonClicked)
+        startButtonLayout.addWidget(self.startButton)
+
+        self.progressLabel = QLabel()
+        startButtonLayout.addWidget(self.progressLabel)
+        self.progressBar = QProgressBar()
+        self.progressBar.setRange(0, 100)
+        startButtonLayout.addWidget(self.progressBar)
+        self.cancelButton = QPushButton("Cancel")
+        self.cancelButton.clicked.connect(self.onCancelClicked)
+        startButtonLayout.addWidget(self.cancelButton)
+
+        self.rerollButton = QPushButton("Not happy with these? Re-roll the pairings")
+        self.rerollButton.clicked.connect(self.onRerollClicked)
+        startButtonLayout.addWidget(self.rerollButton)
+        self.setRunning(False)
 
         startButtonBox.setLayout(startButtonLayout)
         return startButtonBox
@@ -77,45 +145,170 @@ class CoffeeChatWidget(QWidget):
             if not res_filename.endswith(".csv"):
                 res_filename += ".csv"
 
+            if self.core is not None:
+                self.core.close_candidate_pool()
+            # core pulls in numpy and the history index, which would otherwise delay
+            # the window showing up
+            from core import CoffeeChatCore
+
             core = CoffeeChatCore(participants_file_path, res_filename)
-            loaded_data = core.load_data()
-
-            participant_names = loaded_data.participant_names
-            constraints_names = loaded_data.constraints_names
-
-            if len(participant_names) % 2 == 1:
-                if "Eliette Seo" in participant_names and "Michael Youn" in participant_names:
-                    self.sit_mode = "out"
-                    ret = self.createOddOneOutBox().exec()
-                    if ret == 0:
-                        participant_names.remove("Eliette Seo")
-                    elif ret == 1:
-                        participant_names.remove("Michael Youn")
-                elif "Eliette Seo" in participant_names:
-                    self.maybe_solo_participant = "Eliette"
-                    self.createNotifyRemoveOneBox().exec()
-                    participant_names.remove("Eliette Seo")
-                elif "Michael Youn" in participant_names:
-                    self.maybe_solo_participant = "Michael"
-                    self.createNotifyRemoveOneBox().exec()
-                    participant_names.remove("Michael Youn")
-                else:
-                    self.sit_mode = "in"
-                    ret = self.createOddOneOutBox().exec()
-                    if ret == 0:
-                        participant_names.append("Eliette Seo")
-                    elif ret == 1:
-                        participant_names.append("Michael Youn")
-
-            # generate pairing
-            pair_names = core.run_matchmaking(participant_names, constraints_names)
-            core.sanity_check_matches(
-                pair_names,
-                participant_names,
-            )
+            core.group_size = self.group_size_box.value()
+
+            def load(report: ProgressCallback):
+                return core.load_data(progress=report)
+
+            self.startWorker(load, lambda loaded_data: self.onDataLoaded(core, loaded_data))
+
+    def onDataLoaded(self, core: "CoffeeChatCore", loaded_data):
+        participant_names = loaded_data.participant_names
+        constraints_ids = loaded_data.constraints_ids
+
+        def generate(report: ProgressCallback):
+            feasibility = None
+            if core.group_size == 2:
+                report("Checking that everyone can be paired", 0.0)
+                feasibility = core.check_feasibility(participant_names, constraints_ids)
+            pair_names = core.run_matchmaking(participant_names, constraints_ids, progress=report)
+            report("Checking pairings", 1.0)
+            core.sanity_check_matches(pair_names, participant_names)
+            report("Saving pairings", 1.0)
             core.finalize_matches(pair_names)
+            # keep a pool of alternatives around for re-rolls
+            report("Preparing re-rolls", 1.0)
+            core.start_candidate_pool(participant_names, constraints_ids)
+            return feasibility
+
+        self.startWorker(
+            generate,
+            lambda feasibility: self.onPairingsGenerated(core, participant_names, feasibility),
+        )
+
+    def onPairingsGenerated(self, core: "CoffeeChatCore", participant_names, feasibility):
+        logger.info(core.metrics.summary())
+        self.core = core
+        self.participant_names = participant_names
+        self.rerollButton.setEnabled(True)
+        if feasibility is None or feasibility.feasible:
             self.message.setStyleSheet("color: green")
             self.message.setText(f"Pairings generated! Check {core.results_filename}")
+        else:
+            self.message.setStyleSheet("color: red")
+            self.message.setText(
+                f"Pairings generated in {core.results_filename}, but not everyone could be paired.\n"
+                + feasibility.describe(core.registry.names_of)
+            )
+        if self.probeLaunchTime is not None:
+            print(f"time_to_first_result {time.time() - self.probeLaunchTime:.3f}", flush=True)
+            self.close()
+
+    def runStartupProbe(self):
+        print(f"time_to_window {time.time() - self.probeLaunchTime:.3f}", flush=True)
+        participants_file_path = os.environ.get(PROBE_PARTICIPANTS_ENV)
+        if participants_file_path is None:
+            self.close()
+            return
+        self.file_path_label.setText(participants_file_path)
+        self.text_box.setText(os.environ.get(PROBE_RESULTS_ENV, "startup-probe"))
+        self.onButtonClicked()
+
+    def startWorker(self, step: Callable[[ProgressCallback], Any], on_finished: Callable[[Any], None]):
+        # only called once the previous step's thread has stopped, see onThreadFinished
+        self.thread = QThread()
+        self.worker = PipelineWorker(step)
+        self.worker.moveToThread(self.thread)
+        self.onWorkerDone = on_finished
+        self.workerResult = None
+        self.thread.started.connect(self.worker.run)
+        # quit right away from the worker thread, a queued quit would wait behind the UI slots
+        self.worker.finished.connect(self.thread.quit, Qt.ConnectionType.DirectConnection)
+        self.worker.failed.connect(self.thread.quit, Qt.ConnectionType.DirectConnection)
+        # connecting to this widget's methods queues the signals onto the UI thread
+        self.worker.progress.connect(self.onProgress)
+        self.worker.finished.connect(self.onWorkerFinished)
+        self.worker.failed.connect(self.onWorkerFailed)
+        self.thread.finished.connect(self.onThreadFinished)
+        self.setRunning(True)
+        self.thread.start()
+
+    def onWorkerFinished(self, result):
+        self.workerResult = (result,)
+
+    def onThreadFinished(self):
+        # the next step starts from here, once nothing runs on the old thread anymore.
+        # finished is emitted as the thread exits, so this wait is over right away
+        if self.thread is not None:
+            self.thread.wait()
+        self.thread = None
+        self.worker = None
+        on_finished, result = self.onWorkerDone, self.workerResult
+        self.onWorkerDone = None
+        self.workerResult = None
+        if on_finished is not None and result is not None:
+            on_finished(result[0])
+        if self.thread is None:
+            self.setRunning(False)
+
+    def onProgress(self, stage: str, percent: int):
+        self.progressLabel.setText(stage)
+        self.progressBar.setValue(percent)
+
+    def onWorkerFailed(self, message: str):
+        self.onWorkerDone = None
+        self.message.setStyleSheet("color: red")
+        self.message.setText(message)
+        if self.probeLaunchTime is not None:
+            print(f"failed {message}", flush=True)
+            self.close()
+
+    def onCancelClicked(self):
+        if self.worker is not None:
+            self.worker.cancelled = True
+            self.progressLabel.setText("Cancelling...")
+
+    def setRunning(self, running: bool):
+        self.startButton.setEnabled(not running)
+        self.rerollButton.setEnabled(not running and self.core is not None)
+        self.cancelButton.setVisible(running)
+        self.progressBar.setVisible(running)
+        self.progressLabel.setVisible(running)
+        if running:
+            self.progressBar.setValue(0)
+
+    def onRerollClicked(self):
+        if self.core is None:
+            return
+        if os.path.exists(self.core.results_filename):
+            os.remove(self.core.results_filename)
+        self.writeNextCandidate()
+
+    def writeNextCandidate(self):
+        core = self.core
+        participant_names = self.participant_names
+
+        def reroll(report: ProgressCallback):
+            # the next candidate may still be solving
+            report("Waiting for the next pairings", 0.0)
+            pair_names = core.next_candidate()
+            report("Checking pairings", 1.0)
+            core.sanity_check_matches(pair_names, participant_names)
+            report("Saving pairings", 1.0)
+            core.finalize_matches(pair_names)
+
+        self.startWorker(reroll, lambda _: self.onRerolled(core))
+
+    def onRerolled(self, core: "CoffeeChatCore"):
+        self.message.setStyleSheet("color: green")
+        self.message.setText(f"Pairings generated! Check {core.results_filename}")
+
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.cancelled = True
+        if self.thread is not None:
+            self.thread.quit()
+            self.thread.wait()
+        if self.core is not None:
+            self.core.close_candidate_pool()
+        super().closeEvent(event)
 
     def createInputsBox(self) -> QGroupBox:
         inputFilesGroupBox = QGroupBox("Select participants")
@@ -139,30 +332,18 @@ class CoffeeChatWidget(QWidget):
         group_box_layout.addWidget(filename_label)
         group_box_layout.addWidget(self.text_box)
 
+        # people per chat, leftovers join the last chats (e.g. one trio for an odd roster)
+        group_size_label = QLabel("People per coffee chat")
+        self.group_size_box = QSpinBox()
+        self.group_size_box.setRange(2, 10)
+        self.group_size_box.setValue(2)
+        group_box_layout.addWidget(group_size_label)
+        group_box_layout.addWidget(self.group_size_box)
+
         inputFilesGroupBox.setLayout(group_box_layout)
 
         return inputFilesGroupBox
 
-    def createOddOneOutBox(self) -> QMessageBox:
-        michael_button = QPushButton("Michael")
-        eliette_button = QPushButton("Eliette")
-
-        box = QMessageBox(self)
-        box.setWindowTitle("Odd number of participants this time!")
-        box.setText(f"Who's volunteering to sit {self.sit_mode}?")
-        box.addButton(eliette_button, QMessageBox.ButtonRole.NoRole)  # returns 0
-        box.addButton(michael_button, QMessageBox.ButtonRole.YesRole)  # returns 1
-
-        return box
-
-    def createNotifyRemoveOneBox(self) -> QMessageBox:
-        box = QMessageBox(self)
-        box.setWindowTitle("Odd number of participants this time!")
-        box.setText(f"Only {self.maybe_solo_participant} is participating this time. Removing them from this month's participants.")
-        box.setStandardButtons(QMessageBox.StandardButton.Ok)
-
-        return box
-
     def select_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
             self, "Select File", ".", "CSV Files (*.csv)"
@@ -182,17 +363,25 @@ def main():
     ex = CoffeeChatWidget()
     ex.center()
     ex.show()
+    probe_launch_time = os.environ.get(STARTUP_PROBE_ENV)
+    if probe_launch_time is not None:
+        ex.probeLaunchTime = float(probe_launch_time)
+        # fires once the event loop is running, i.e. after the window is up
+        QTimer.singleShot(0, ex.runStartupProbe)
     sys.exit(app.exec())
 
 
 if __name__ == "__main__":
+    # the candidate pool solves in worker processes, which the frozen app has to support
+    multiprocessing.freeze_support()
     try:
         if "CoffeeChatPairing.app/Contents/MacOS/CoffeeChatPairing" in sys.executable:
             # we're running in windowed mode, go to app location and go up a few
             os.chdir(os.path.dirname(sys.executable))
             os.chdir("../../..")
-        else:
-            os.chdir(os.path.dirname(sys.executable))
+        elif getattr(sys, "frozen", False):
+            # a one-folder build keeps the executable in CoffeeChatPairing/, go up to the repo
+            os.chdir(os.path.dirname(os.path.dirname(sys.executable)))
 
         init_logging(verbose=True)
         main()
@@ -0,0 +1,339 @@
+import argparse
+import csv
+import itertools
+import logging
+import os
+import random
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core import IDS_LOCATION, PAIRINGS_LOCATION, CoffeeChatCore
+from csv_utils import read_roster, write_all_pairings
+from history_index import pair_keys
+from id_registry import IdRegistry
+from log_utils import init_logging
+from matching import matchmake
+from partner_index import PartnerIndex
+from weights import key_positions
+
+logger = logging.getLogger(__name__)
+
+# what to do with a cohort whose roster can't be split into pairs evenly
+ODD_POLICIES = ("trio", "sit-out", "skip")
+DEFAULT_RESULTS_TEMPLATE = "{cohort}.csv"
+
+
+@dataclass
+class Cohort:
+    """
+    One roster of a batch, with where its pairings are read from and written to.
+    """
+
+    name: str
+    participants_filename: str
+    results_filename: str
+    pairings_dirname: str = PAIRINGS_LOCATION
+    participant_names: List[str] = field(default_factory=list)
+    # set when the cohort isn't solved, e.g. "skipped" or "failed: ..."
+    outcome: Optional[str] = None
+
+    @property
+    def results_path(self) -> str:
+        return os.path.join(self.pairings_dirname, self.results_filename)
+
+
+def cohorts_from_directory(
+    dirname: str,
+    results_template: str = DEFAULT_RESULTS_TEMPLATE,
+    pairings_dirname: str = PAIRINGS_LOCATION,
+) -> List[Cohort]:
+    """
+    Makes a cohort of every participants CSV in a directory, named after the file.
+    """
+    cohorts = []
+    for filename in sorted(os.listdir(dirname)):
+        cohort, extension = os.path.splitext(filename)
+        if extension.lower() != ".csv":
+            continue
+        cohorts.append(
+            Cohort(
+                cohort,
+                os.path.join(dirname, filename),
+                results_template.format(cohort=cohort),
+                pairings_dirname,
+            )
+        )
+    return cohorts
+
+
+def cohorts_from_manifest(
+    manifest_filename: str,
+    results_template: str = DEFAULT_RESULTS_TEMPLATE,
+    pairings_dirname: str = PAIRINGS_LOCATION,
+) -> List[Cohort]:
+    """
+    Reads cohorts from a manifest CSV with a header row and the columns participants,
+    and optionally results and pairings (the cohort's own history directory). Relative
+    paths are relative to the manifest.
+    """
+    base = os.path.dirname(manifest_filename)
+    cohorts = []
+    with open(manifest_filename) as csv_file:
+        for line, row in enumerate(csv.DictReader(csv_file), start=2):
+            row = {column.strip().lower(): (value or "").strip() for column, value in row.items() if column}
+            if not row.get("participants"):
+                raise ValueError(f"{manifest_filename}:{line} has no participants file")
+            participants_filename = os.path.join(base, row["participants"])
+            cohort = os.path.splitext(os.path.basename(participants_filename))[0]
+            history = row.get("pairings")
+            cohorts.append(
+                Cohort(
+                    cohort,
+                    participants_filename,
+                    row.get("results") or results_template.format(cohort=cohort),
+                    os.path.join(base, history) if history else pairings_dirname,
+                )
+            )
+    return cohorts
+
+
+@dataclass
+class CohortTask:
+    """
+    What a worker process needs to solve one cohort, as registry IDs.
+    """
+
+    name: str
+    ids: List[int]
+    constraints: List[Tuple[int, int]]
+    group_size: int
+    seed: int
+
+
+def _solve_cohort(task: CohortTask) -> List[Tuple[int, ...]]:
+    return matchmake(task.ids, task.constraints, seed=task.seed, group_size=task.group_size)
+
+
+def run_batch(
+    cohorts: List[Cohort],
+    ids_filename: str = os.path.join(IDS_LOCATION, "ids.csv"),
+    group_size: int = 2,
+    odd_policy: str = "trio",
+    allow_incomplete: bool = False,
+    overwrite: bool = False,
+    seed: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> List[Cohort]:
+    """
+    Matches several cohorts in one go without asking anything. The ID registry and each
+    history directory are loaded once for all the cohorts using them, the cohorts are
+    solved in parallel worker processes, and the results are written together once
+    every solve is done.
+    Inputs:
+        cohorts: List[Cohort], the rosters to match.
+        ids_filename: str, the ID registry shared by all the cohorts.
+        group_size: int, people per chat.
+        odd_policy: str, for pairs, what to do with an odd roster: "trio" to make one
+            chat a trio, "sit-out" to leave out whoever has the fewest fresh partners,
+            or "skip" to not match that cohort.
+        allow_incomplete: bool, write a cohort's results even if someone couldn't be
+            paired or a past pairing repeats, instead of failing the cohort.
+        overwrite: bool, re-match cohorts whose results file already exists.
+        seed: Optional[int], seed for the matchings.
+        max_workers: Optional[int], processes to solve in (default: one per CPU).
+    Returns:
+        cohorts: List[Cohort], the same cohorts with their outcomes set.
+    """
+    if odd_policy not in ODD_POLICIES:
+        raise ValueError(f"Unknown odd roster policy {odd_policy}, expected one of {ODD_POLICIES}")
+    results_paths = [os.path.normpath(cohort.results_path) for cohort in cohorts]
+    if len(set(results_paths)) < len(results_paths):
+        raise ValueError("Several cohorts would write the same results file, give them distinct results names")
+    rng = random.Random(seed)
+    pending = []
+    for cohort in cohorts:
+        if os.path.exists(cohort.results_path) and not overwrite:
+            logger.info(f"Skipping {cohort.name}, {cohort.results_path} already exists")
+            cohort.outcome = "skipped: results exist"
+            continue
+        cohort.participant_names = list(dict.fromkeys(read_roster(cohort.participants_filename)[0]))
+        if group_size == 2 and len(cohort.participant_names) % 2 == 1 and odd_policy == "skip":
+            logger.warning(f"Skipping {cohort.name}, it has an odd number of participants")
+            cohort.outcome = "skipped: odd roster"
+            continue
+        pending.append(cohort)
+
+    registry = IdRegistry(ids_filename)
+    try:
+        # one history load per directory, for all the cohorts sharing it
+        histories = {}
+        for pairings_dirname, group in itertools.groupby(
+            sorted(pending, key=lambda cohort: cohort.pairings_dirname), key=lambda cohort: cohort.pairings_dirname
+        ):
+            core = CoffeeChatCore(participants_filename="", results_filename="")
+            core.registry = registry
+            names = list(itertools.chain.from_iterable(cohort.participant_names for cohort in group))
+            histories[pairings_dirname] = core.load_history(names, pairings_dirname, ids_filename)
+        # the registry is shared, so any core's lookups see every cohort's names
+        names_to_ids = registry.register(
+            list(itertools.chain.from_iterable(cohort.participant_names for cohort in pending))
+        )
+
+        tasks = []
+        history_keys = {}
+        for cohort in pending:
+            # an overwritten results file isn't history
+            history = histories[cohort.pairings_dirname]
+            mask = history.file_mask([os.path.basename(cohort.results_filename)])
+            history_keys[cohort.results_path] = keys = np.unique(history.occurrence_keys[mask])
+            ids = [names_to_ids[name] for name in cohort.participant_names]
+            if group_size == 2 and len(ids) % 2 == 1 and odd_policy == "sit-out":
+                # the person with the fewest fresh partners is the hardest to pair
+                fresh = PartnerIndex.from_keys(ids, keys).fresh_counts()
+                sitting_out = ids.pop(int(np.argmin(fresh)))
+                logger.info(f"{registry.name_of(sitting_out)} sits out {cohort.name} this time")
+            rows, cols, _ = key_positions(ids, keys)
+            constraints = [(ids[u], ids[v]) for u, v in zip(rows.tolist(), cols.tolist())]
+            tasks.append((cohort, CohortTask(cohort.name, ids, constraints, group_size, rng.getrandbits(32))))
+
+        solved = _solve_all(tasks, max_workers)
+
+        outputs = {}
+        for cohort, task in tasks:
+            groups = solved.get(cohort.results_path)
+            if groups is None:
+                continue
+            problems = _check_groups(task.ids, groups, history_keys[cohort.results_path])
+            if problems and not allow_incomplete:
+                logger.error(f"Not writing {cohort.name}: {problems}")
+                cohort.outcome = f"failed: {problems}"
+                continue
+            if problems:
+                logger.warning(f"Writing {cohort.name} anyway: {problems}")
+            outputs[cohort.results_path] = [tuple(registry.names_of(group)) for group in groups]
+            paired = sum(len(group) for group in groups)
+            cohort.outcome = f"matched {paired} of {len(task.ids)} people into {len(groups)} chats"
+    finally:
+        registry.close()
+
+    write_all_pairings(outputs)
+    for cohort in cohorts:
+        logger.info(f"{cohort.name}: {cohort.outcome}")
+    return cohorts
+
+
+def _solve_all(
+    tasks: List[Tuple[Cohort, CohortTask]],
+    max_workers: Optional[int],
+) -> Dict[str, List[Tuple[int, ...]]]:
+    # keyed by results path, which unlike the cohort name is unique
+    solved = {}
+    if len(tasks) <= 1 or max_workers == 1:
+        for cohort, task in tasks:
+            try:
+                solved[cohort.results_path] = _solve_cohort(task)
+            except Exception as e:
+                logger.exception(f"Matching {cohort.name} failed")
+                cohort.outcome = f"failed: {e}"
+        return solved
+
+    # multiprocessing is slow to import, only pay for it with several cohorts
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    logger.info(f"Solving {len(tasks)} cohorts in parallel")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # the biggest cohorts first, so that they don't finish last
+        futures = {
+            executor.submit(_solve_cohort, task): cohort
+            for cohort, task in sorted(tasks, key=lambda item: len(item[1].ids), reverse=True)
+        }
+        for future in as_completed(futures):
+            cohort = futures[future]
+            try:
+                solved[cohort.results_path] = future.result()
+            except Exception as e:
+                # one broken cohort shouldn't keep the others' results from being written
+                logger.exception(f"Matching {cohort.name} failed")
+                cohort.outcome = f"failed: {e}"
+    return solved
+
+
+def _check_groups(ids: List[int], groups: List[Tuple[int, ...]], history_keys: np.ndarray) -> str:
+    """
+    Describes who the groups leave out and which past pairings they repeat, if any.
+    """
+    problems = []
+    unpaired = set(ids) - set(itertools.chain.from_iterable(groups))
+    if unpaired:
+        problems.append(f"{len(unpaired)} people left unpaired")
+    pairs = np.array(
+        [pair for group in groups for pair in itertools.combinations(group, 2)], dtype=np.int64
+    ).reshape(-1, 2)
+    repeats = int(np.isin(pair_keys(pairs[:, 0], pairs[:, 1]), history_keys).sum())
+    if repeats:
+        problems.append(f"{repeats} past pairings repeated")
+    return ", ".join(problems)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Match several cohorts at once, without prompting (e.g. from cron)."
+    )
+    parser.add_argument(
+        "cohorts",
+        help="A directory of participant CSVs, one cohort each, or a manifest CSV with the columns "
+        "participants, results and pairings (the last two optional).",
+    )
+    parser.add_argument(
+        "--results-name",
+        default=DEFAULT_RESULTS_TEMPLATE,
+        metavar="TEMPLATE",
+        help="Results filename of cohorts without one, {cohort} being the participants file's name "
+        f"(default {DEFAULT_RESULTS_TEMPLATE}).",
+    )
+    parser.add_argument(
+        "--pairings",
+        default=PAIRINGS_LOCATION,
+        metavar="DIR",
+        help=f"History directory of cohorts without one, where results are written too (default {PAIRINGS_LOCATION}).",
+    )
+    parser.add_argument(
+        "--odd",
+        choices=ODD_POLICIES,
+        default="trio",
+        help="For an odd roster, make one trio, have the person with the fewest fresh partners sit out, "
+        "or skip the cohort (default trio).",
+    )
+    parser.add_argument(
+        "--allow-incomplete",
+        action="store_true",
+        help="Write a cohort even if someone couldn't be paired or a past pairing repeats.",
+    )
+    parser.add_argument("--overwrite", action="store_true", help="Re-match cohorts whose results file exists.")
+    parser.add_argument("--group-size", type=int, default=2, metavar="K", help="Number of people per chat (default 2).")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="Processes to solve in (default: one per CPU).")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.group_size < 2:
+        parser.error("--group-size must be at least 2")
+
+    init_logging(args.verbose)
+    if os.path.isdir(args.cohorts):
+        cohorts = cohorts_from_directory(args.cohorts, args.results_name, args.pairings)
+    else:
+        cohorts = cohorts_from_manifest(args.cohorts, args.results_name, args.pairings)
+    run_batch(
+        cohorts,
+        group_size=args.group_size,
+        odd_policy=args.odd,
+        allow_incomplete=args.allow_incomplete,
+        overwrite=args.overwrite,
+        seed=args.seed,
+        max_workers=args.workers,
+    )
+    # cron mails on a non-zero exit, so a failed cohort gets noticed
+    sys.exit(int(any(cohort.outcome.startswith("failed") for cohort in cohorts)))
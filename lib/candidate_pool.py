@@ -0,0 +1,143 @@
+import itertools
+import logging
+import random
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import TYPE_CHECKING, List, Optional, Set, Tuple
+
+from matching import matchmake
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from weights import SparseWeights
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 8
+# a small roster has few matchings, after this many repeats in a row one is served again
+MAX_REPEATS = 32
+
+
+def _solve_candidate(
+    ids: List[int],
+    constraints: List[Tuple[int, int]],
+    seed: int,
+    weights: Optional["SparseWeights"],
+    group_size: int,
+    conflicts: Optional["np.ndarray"],
+) -> List[Tuple[int, ...]]:
+    return matchmake(
+        ids, constraints, seed=seed, weights=weights, group_size=group_size, conflicts=conflicts
+    )
+
+
+def _matching(pairs: List[Tuple[int, ...]]) -> frozenset:
+    return frozenset(frozenset(pair) for pair in pairs)
+
+
+class CandidatePool:
+    """
+    Keeps a pool of distinct candidate matchings solved ahead of time in worker
+    processes, so that asking for another matching doesn't have to wait for a solve.
+    Every served candidate is replaced by a new one in the background.
+    """
+
+    def __init__(
+        self,
+        ids: List[int],
+        constraints: List[Tuple[int, int]],
+        size: int = DEFAULT_POOL_SIZE,
+        max_workers: Optional[int] = None,
+        weights: Optional["SparseWeights"] = None,
+        group_size: int = 2,
+        conflicts: Optional["np.ndarray"] = None,
+    ):
+        self.ids = ids
+        self.constraints = constraints
+        self.weights = weights
+        self.group_size = group_size
+        self.conflicts = conflicts
+        self.size = size
+        # multiprocessing is slow to import, only pay for it once a pool is started
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.pending: Set[Future] = set()
+        self.ready: List[List[Tuple[int, ...]]] = []
+        # the pairs, and the whole matchings, that were served already
+        self.served: Set[frozenset] = set()
+        self.served_matchings: Set[frozenset] = set()
+        self.repeats = 0
+        self.rng = random.Random()
+        for _ in range(size):
+            self._refill()
+
+    def next(self) -> List[Tuple[int, ...]]:
+        """
+        Returns the best candidate not served yet, preferring matchings that match
+        the most people, and then the ones sharing the fewest pairs with earlier candidates.
+        """
+        while not self.ready:
+            self._collect(block=True)
+        best = max(self.ready, key=self._score)
+        self.ready.remove(best)
+        self.served.update(frozenset(pair) for pair in best)
+        self.served_matchings.add(_matching(best))
+        self._refill()
+        return best
+
+    def close(self) -> None:
+        for future in self.pending:
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+    def _score(self, pairs: List[Tuple[int, ...]]) -> Tuple[int, int, float]:
+        matched = sum(len(group) for group in pairs)
+        if not pairs:
+            return matched, 0, 0.0
+        freshness = 0
+        if self.weights is not None:
+            # with recency weights, pairs that met longer ago are more novel
+            position = {idx: i for i, idx in enumerate(dict.fromkeys(self.ids))}
+            edges = [(position[u], position[v]) for group in pairs for u, v in itertools.combinations(group, 2)]
+            freshness = int(self.weights.lookup(*zip(*edges)).sum())
+        diversity = sum(frozenset(pair) not in self.served for pair in pairs) / len(pairs)
+        return matched, freshness, diversity
+
+    def _refill(self) -> None:
+        seed = self.rng.getrandbits(32)
+        self.pending.add(
+            self.executor.submit(
+                _solve_candidate,
+                self.ids,
+                self.constraints,
+                seed,
+                self.weights,
+                self.group_size,
+                self.conflicts,
+            )
+        )
+
+    def _collect(self, block: bool) -> None:
+        if block:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+        else:
+            done = {future for future in self.pending if future.done()}
+        for future in done:
+            self.pending.discard(future)
+            pairs = future.result()
+            matching = _matching(pairs)
+            if any(matching == _matching(candidate) for candidate in self.ready):
+                logger.debug("Dropping a duplicate candidate matching")
+                self._refill()
+                continue
+            if matching in self.served_matchings and self.repeats < MAX_REPEATS:
+                logger.debug("Dropping a candidate matching that was served already")
+                self.repeats += 1
+                self._refill()
+                continue
+            if matching in self.served_matchings:
+                logger.warning("No new matchings found, serving one that was served already")
+            self.repeats = 0
+            self.ready.append(pairs)
+        logger.debug(f"{len(self.ready)} candidate matchings ready, {len(self.pending)} solving")
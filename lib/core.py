@@ -1,51 +1,51 @@
-import sys
 import logging
 import os
 import itertools
-from csv_utils import read_all_pairings, generate_ids, read_participants, write_pairings
-from matching import matchmake, get_all_pairing_history
+import random
+import time
+import cProfile
+from concurrent.futures import ThreadPoolExecutor
+from affinity import AffinityRule, ParticipantAttributes, apply_affinity, forbidden_pairs
+from candidate_pool import CandidatePool, DEFAULT_POOL_SIZE
+from coverage import CoverageReport, analyze_coverage
+from csv_utils import read_all_pairings, read_roster, write_pairings
+from feasibility import FeasibilityReport, analyze_feasibility
+from groups import conflict_matrix
+from id_registry import IdRegistry
+from implicit_matching import ProgressCallback
+from history_index import KEY_STRIDE, PairingHistory, PairingHistoryIndex, pair_key, pair_keys, split_key
+from matching import attach_leftovers, matchmake, repair, schedule
+from lookahead import DEFAULT_TIME_BUDGET, lookahead_matchmake
+from metrics import Metrics
+from name_index import DuplicateName
+from partner_index import PartnerIndex
+from solve_cache import SolveCache, settings_key, solve_key
+from sharding import ShardTask, solve_shards, split_shards
+from weights import (
+    SparseWeights,
+    file_month,
+    fresh_weights,
+    key_positions,
+    latest_meetings,
+    month_index,
+    recency_weights,
+)
 import datetime
-from typing import Dict, List, Tuple
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
 from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
 
 PAIRINGS_LOCATION = "pairings"
 IDS_LOCATION = "ids"
-LOGS_LOCATION = "logs"
-
-log_file = os.path.join(LOGS_LOCATION, f"coffee-chat-debug-logs-{datetime.datetime.now()}.txt")
-
-
-def init_logging(verbose=False) -> None:
-    root_logger = logging.getLogger()
-        
-    if getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS"):
-        if not os.path.exists(LOGS_LOCATION):
-            os.mkdir(LOGS_LOCATION)
-        log_handler = logging.FileHandler(log_file)
-    else:
-        log_handler = logging.StreamHandler(sys.stderr)
-
-    log_handler.setFormatter(
-        logging.Formatter(
-            "[%(asctime)0s.%(msecs)03d %(filename)s:%(lineno)s] %(levelname)s: %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-    )
-
-    root_logger.addHandler(log_handler)
-    if verbose:
-        root_logger.setLevel(logging.DEBUG)
-        root_logger.debug("Verbose logging enabled")
-    else:
-        root_logger.setLevel(logging.INFO)
+HISTORY_LOADER_THREADS = 8
 
 
 @dataclass
 class CoffeeChatLoadData:
     participant_names: List[str]
-    constraints_names: List[Tuple[str, str]]
+    constraints_ids: List[Tuple[int, int]]
 
 
 class CoffeeChatCore:
@@ -54,117 +54,866 @@ class CoffeeChatCore:
         self.participants_filename = participants_filename
         self.results_filename = os.path.join(PAIRINGS_LOCATION, results_filename)
         self.names_to_ids: Dict[str, int] = {}
+        self.registry: Optional[IdRegistry] = None
+        self.constraints_basename = "CONSTRAINTS.csv"
+        self.history: Optional[PairingHistory] = None
+        self.candidate_pool: Optional[CandidatePool] = None
+        self.backend = "implicit"
+        # when set, past pairings become soft constraints that fade with this half-life (months)
+        self.recency_half_life: Optional[float] = None
+        # people per chat, an odd roster in pairs gets one trio
+        self.group_size = 2
+        # the roster's optional columns, and the rules that turn them into edge weights
+        self.attributes: Optional[ParticipantAttributes] = None
+        self.affinity_rules: List[AffinityRule] = []
+        # when set, each value of this roster column is matched on its own, in parallel
+        self.shard_key: Optional[str] = None
+        self.shard_workers: Optional[int] = None
+        # reuse solves of the same inputs, and repair the closest cached one for similar inputs
+        self.cache_solves = True
+        # when set, the matching that keeps the most future months matchable is picked,
+        # by simulating this many months ahead within lookahead_budget seconds
+        self.lookahead_months: Optional[int] = None
+        self.lookahead_budget = DEFAULT_TIME_BUDGET
+        self._pool_cache_key: Optional[Tuple[str, str, List[int]]] = None
+        # roster names that look like another registered name, and whether they're the
+        # same person, merged into the registered ID for good (default: just warn)
+        self.duplicate_names: List[DuplicateName] = []
+        self.confirm_merge: Optional[Callable[[DuplicateName], bool]] = None
+        self.metrics = Metrics()
+        # when set, the solve is run under cProfile and its stats are saved to this path
+        self.profile_filename: Optional[str] = None
         self.verbose = False
 
     def load_data(
         self,
         constraints_filename: str = os.path.join(PAIRINGS_LOCATION, "CONSTRAINTS.csv"),
         ids_filename: str = os.path.join(IDS_LOCATION, "ids.csv"),
+        progress: Optional[ProgressCallback] = None,
     ) -> CoffeeChatLoadData:
-        logger.info(f"Loading participants from {self.participants_filename}")
-        participant_names = read_participants(self.participants_filename)
+        with self.metrics.span("load_data") as counts:
+            logger.info(f"Loading participants from {self.participants_filename}")
+            if progress is not None:
+                progress("Loading participants", 0.0)
+            participant_names, self.attributes = read_roster(self.participants_filename)
+            participant_names = self._merge_duplicate_names(participant_names, ids_filename)
 
-        constraints_dirname = os.path.join(os.getcwd(), PAIRINGS_LOCATION)
-        logger.info(f"Loading constraints from directory {constraints_dirname}")
-        constraints_names = []
-        for filename in os.listdir(constraints_dirname):
-            constraints_filename = os.path.join(constraints_dirname, filename)
-            constraints_names.extend(read_all_pairings(constraints_filename))
+            self.constraints_basename = os.path.basename(constraints_filename)
+            history = self.load_history(
+                participant_names, os.path.dirname(constraints_filename), ids_filename, progress
+            )
+            if self.confirm_merge is not None:
+                # reading the history may have registered another spelling of someone on
+                # the roster, ask about those too and re-read it if any were merged
+                aliases = self.registry.aliases
+                participant_names = self._merge_duplicate_names(participant_names, ids_filename)
+                if self.registry.aliases != aliases:
+                    history = self.load_history(
+                        participant_names, os.path.dirname(constraints_filename), ids_filename, progress
+                    )
+            id_a, id_b = np.divmod(history.keys, KEY_STRIDE)
+            constraints_ids = list(zip(id_a.tolist(), id_b.tolist()))
+            counts.update(
+                participants=len(participant_names),
+                constraint_edges=len(constraints_ids),
+                history_files=len(history.filenames),
+            )
+
+        return CoffeeChatLoadData(participant_names, constraints_ids)
+
+    def _merge_duplicate_names(self, participant_names: List[str], ids_filename: str) -> List[str]:
+        """
+        Flags roster names that are new to the ID registry but look like a registered
+        name (or an earlier new one), e.g. "katie nelson" for "Katie Nelson", and the
+        registered names on the roster that were flagged as someone else's spelling
+        elsewhere, e.g. while reading the history. The ones confirm_merge accepts become
+        aliases of the registered ID. Then every roster name is renamed to the spelling
+        its ID was registered under, so earlier merges apply without asking again.
+        """
+        if self.registry is None or self.registry.ids_filename != ids_filename:
+            self.registry = IdRegistry(ids_filename)
+        roster = list(dict.fromkeys(participant_names))
+        with self.metrics.span("find_duplicate_names", participants=len(roster)) as counts:
+            on_roster = set(roster)
+            self.duplicate_names = self.registry.find_duplicates(roster) + [
+                duplicate
+                for duplicate in self.registry.pending_duplicates()
+                if duplicate.name in on_roster or duplicate.existing in on_roster
+            ]
+            counts["duplicates"] = len(self.duplicate_names)
+        for duplicate in self.duplicate_names:
+            logger.warning(
+                f'"{duplicate.name}" looks like "{duplicate.existing}" '
+                f"({100 * duplicate.similarity:.0f}% similar)"
+            )
+            if self.confirm_merge is None:
+                continue
+            if self.confirm_merge(duplicate):
+                self.registry.merge(duplicate)
+                logger.info(f'Treating "{duplicate.name}" as "{duplicate.existing}" from now on')
+            else:
+                self.registry.keep_apart(duplicate)
+
+        renames = {}
+        for name in roster:
+            num_id = self.registry.lookup(name)
+            if num_id is not None and self.registry.name_of(num_id) != name:
+                renames[name] = self.registry.name_of(num_id)
+        if not renames:
+            return participant_names
+
+        # a merged name already on the roster is a repeated entry, drop it
+        merged_names = []
+        kept = set(participant_names)
+        for name in participant_names:
+            if name not in renames:
+                merged_names.append(name)
+            elif renames[name] not in kept:
+                merged_names.append(renames[name])
+                kept.add(renames[name])
+        if len(merged_names) < len(participant_names):
+            logger.info(f"Dropped {len(participant_names) - len(merged_names)} repeated roster entries after merging")
+        renamed = [renames.get(name, name) for name in self.attributes.names]
+        self.attributes = ParticipantAttributes(renamed, self.attributes.codes, self.attributes.vocab).select(
+            merged_names
+        )
+        return merged_names
 
+    def load_history(
+        self,
+        participant_names: List[str],
+        pairings_dirname: str = PAIRINGS_LOCATION,
+        ids_filename: str = os.path.join(IDS_LOCATION, "ids.csv"),
+        progress: Optional[ProgressCallback] = None,
+    ) -> PairingHistory:
+        """
+        Brings the history index up to date, re-reading only new or changed files in
+        parallel, and snapshots it into self.history for the later stages to share.
+        progress, when given, is called as the history files are read, and may raise
+        MatchingCancelled to stop loading.
+        """
+        logger.info(f"Loading constraints from directory {pairings_dirname}")
+        index = PairingHistoryIndex(pairings_dirname)
+        try:
+            timings = self._refresh_history_index(index, participant_names, ids_filename, progress)
+            filenames, occurrence_keys, occurrence_files = index.occurrences()
+            self.history = PairingHistory.from_occurrences(
+                pairings_dirname, filenames, occurrence_keys, occurrence_files, timings
+            )
+        finally:
+            index.close()
+        return self.history
+
+    def _refresh_history_index(
+        self,
+        index: PairingHistoryIndex,
+        participant_names: List[str],
+        ids_filename: str,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, float]:
+        changed, removed = index.stale_files()
+        for filename in removed:
+            logger.debug(f"Dropping {filename} from the history index, it no longer exists")
+            index.remove(filename)
+
+        parsed, timings = self._read_pairing_files(index.pairings_dirname, changed, progress)
         logger.info("Generating IDs for participants and constraints")
-        unique_constraint_names = set(itertools.chain(*constraints_names))
-        participants = set(participant_names)
-        all_names = unique_constraint_names | participants
-        self.names_to_ids = generate_ids(list(all_names), ids_filename)
+        unique_constraint_names = set(
+            itertools.chain.from_iterable(itertools.chain.from_iterable(parsed.values()))
+        )
+        all_names = unique_constraint_names | set(participant_names)
+        with self.metrics.span("generate_ids", names=len(all_names)) as counts:
+            if self.registry is None or self.registry.ids_filename != ids_filename:
+                self.registry = IdRegistry(ids_filename)
+            self.names_to_ids = self.registry.register(list(all_names))
+            counts["registry_size"] = len(self.registry)
+
+        if index.max_id() >= len(self.registry) or index.registry_aliases() != self.registry.aliases:
+            # the ID registry no longer covers the indexed keys, or merged a name that had
+            # an ID of its own, so they can't be trusted
+            logger.info("ID registry changed since the history index was built, rebuilding it")
+            index.clear()
+            index.set_registry_aliases(self.registry.aliases)
+            return self._refresh_history_index(index, participant_names, ids_filename, progress)
+
+        for filename, pairings in parsed.items():
+            logger.debug(f"Indexing {len(pairings)} pairings from {filename}")
+            # a group of more than two people met each other pairwise
+            index.ingest(
+                filename,
+                (
+                    pair_key(self.names_to_ids[a], self.names_to_ids[b])
+                    for pairing in pairings
+                    for a, b in itertools.combinations(pairing, 2)
+                    # two spellings of one merged person
+                    if self.names_to_ids[a] != self.names_to_ids[b]
+                ),
+            )
+        return timings
+
+    def _read_pairing_files(
+        self,
+        pairings_dirname: str,
+        filenames: List[str],
+        progress: Optional[ProgressCallback] = None,
+    ) -> Tuple[Dict[str, List[Tuple[str, ...]]], Dict[str, float]]:
+        def read_one(filename: str) -> Tuple[str, List[Tuple[str, ...]], float]:
+            start = time.perf_counter()
+            pairings = read_all_pairings(os.path.join(pairings_dirname, filename))
+            pairings = [[name for name in pairing if name] for pairing in pairings]
+            pairings = [pairing for pairing in pairings if len(pairing) >= 2]
+            return filename, pairings, time.perf_counter() - start
+
+        parsed = {}
+        timings = {}
+        if not filenames:
+            return parsed, timings
 
-        return CoffeeChatLoadData(participant_names, constraints_names)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(HISTORY_LOADER_THREADS, len(filenames))) as pool:
+            for filename, pairings, elapsed in pool.map(read_one, filenames):
+                logger.debug(f"Parsed {len(pairings)} pairings from {filename} in {elapsed * 1000:.1f}ms")
+                parsed[filename] = pairings
+                timings[filename] = elapsed
+                if progress is not None:
+                    progress("Reading pairing history", len(parsed) / len(filenames))
+        logger.info(
+            f"Read {len(filenames)} changed history files in {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+        return parsed, timings
 
     def run_matchmaking(
         self,
         participant_names: List[str],
-        constraints_names: List[Tuple[str, str]],
-    ) -> List[Tuple[str, str]]:
+        constraints_ids: List[Tuple[int, int]],
+        progress: Optional[ProgressCallback] = None,
+        use_cache: bool = True,
+    ) -> List[Tuple[str, ...]]:
         logger.info("Running matchmaking")
-        preprocess_data = self._preprocess_participants(
-            participant_names, constraints_names
+        if self.shard_key is not None:
+            return self._run_sharded_matchmaking(participant_names, constraints_ids, progress)
+        with self.metrics.span("preprocess_participants", participants=len(participant_names)):
+            participant_ids, weights, conflicts = self.prepare_matchmaking(participant_names)
+
+        # only plain pairings can look ahead, weighted ones and groups are solved as usual
+        look_ahead = (
+            self.lookahead_months is not None
+            and weights is None
+            and conflicts is None
+            and self.group_size == 2
         )
-        participant_ids = preprocess_data[0]
-        constraints_ids = preprocess_data[1]
+        backend = f"{self.backend}+lookahead{self.lookahead_months}" if look_ahead else self.backend
+        # a profiling run is after the solve itself, not a cache hit
+        use_cache = use_cache and self.cache_solves and self.profile_filename is None
+        warm_start = None
+        if use_cache:
+            with self.metrics.span("solve_cache") as counts:
+                key = solve_key(
+                    participant_ids, constraints_ids, None, weights, conflicts, self.group_size, backend
+                )
+                settings = settings_key(self.group_size, backend, weights, conflicts)
+                # only plain pairings can be repaired, and a repair doesn't look ahead
+                can_warm_start = weights is None and conflicts is None and self.group_size == 2 and not look_ahead
+                pair_ids, warm_start = self._cache_lookup(key, settings, participant_ids, can_warm_start)
+                counts["hit"] = int(pair_ids is not None)
+            if pair_ids is not None:
+                logger.info("Reusing the cached matching of these participants and history")
+                return self._postprocess_matches(pair_ids)
 
-        pair_ids = matchmake(participant_ids, constraints_ids)
+        with self.metrics.span(
+            "matchmake", participants=len(participant_ids), constraint_edges=len(constraints_ids)
+        ) as counts:
+            profiler = cProfile.Profile() if self.profile_filename else None
+            if profiler is not None:
+                profiler.enable()
+            if warm_start is not None:
+                # a cached trio is broken up, and the odd leftover joins a pair again
+                pair_ids = repair(
+                    [pair for pair in warm_start if len(pair) == 2], participant_ids, constraints_ids
+                )
+                counts["warm_start"] = 1
+                if len(set(participant_ids)) % 2 == 1:
+                    pair_ids, _ = attach_leftovers(pair_ids, participant_ids, constraints_ids)
+            elif look_ahead:
+                pair_ids = lookahead_matchmake(
+                    participant_ids,
+                    constraints_ids,
+                    horizon=self.lookahead_months,
+                    time_budget=self.lookahead_budget,
+                )
+                if len(set(participant_ids)) % 2 == 1:
+                    pair_ids, _ = attach_leftovers(pair_ids, participant_ids, constraints_ids)
+            else:
+                pair_ids = matchmake(
+                    participant_ids,
+                    constraints_ids,
+                    backend=self.backend,
+                    weights=weights,
+                    metrics=self.metrics,
+                    progress=progress,
+                    group_size=self.group_size,
+                    conflicts=conflicts,
+                )
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile_filename)
+                logger.info(f"Saved the solve's cProfile stats to {self.profile_filename}")
+            counts["pairs"] = len(pair_ids)
+        if use_cache:
+            self._cache_store(key, settings, participant_ids, pair_ids)
         res_pair_names = self._postprocess_matches(pair_ids)
 
         return res_pair_names
 
+    def _cache_lookup(
+        self,
+        key: str,
+        settings: str,
+        participant_ids: List[int],
+        can_warm_start: bool,
+    ) -> Tuple[Optional[List[Tuple[int, ...]]], Optional[List[Tuple[int, ...]]]]:
+        """
+        Returns the cached matching of exactly these inputs, or else the closest cached
+        matching to repair (None when there's neither).
+        """
+        cache = SolveCache(self._pairings_dirname())
+        try:
+            pair_ids = cache.get(key)
+            if pair_ids is not None or not can_warm_start:
+                return pair_ids, None
+            return None, cache.closest(settings, participant_ids)
+        finally:
+            cache.close()
+
+    def _cache_store(
+        self,
+        key: str,
+        settings: str,
+        participant_ids: List[int],
+        pair_ids: List[Tuple[int, ...]],
+    ) -> None:
+        cache = SolveCache(self._pairings_dirname())
+        try:
+            cache.put(key, settings, participant_ids, pair_ids)
+        finally:
+            cache.close()
+
+    def _pairings_dirname(self) -> str:
+        return os.path.dirname(self.results_filename) or PAIRINGS_LOCATION
+
+    def _run_sharded_matchmaking(
+        self,
+        participant_names: List[str],
+        constraints_ids: List[Tuple[int, int]],
+        progress: Optional[ProgressCallback],
+    ) -> List[Tuple[str, ...]]:
+        """
+        Matches every shard of the roster (people sharing a value of shard_key) on its
+        own in worker processes, then stitches the people each shard couldn't place
+        into groups of their own, against the same constraints and history.
+        """
+        rng = random.Random()
+        with self.metrics.span("preprocess_shards", participants=len(participant_names)) as counts:
+            shards = split_shards(self._participant_attributes(participant_names), self.shard_key)
+            constraints = np.array(constraints_ids, dtype=np.int64).reshape(-1, 2)
+            constraint_keys = pair_keys(constraints[:, 0], constraints[:, 1])
+            tasks = []
+            leftover_names = []
+            for value, names in shards.items():
+                # whoever wouldn't fill a whole group is stitched with the other shards' leftovers
+                rng.shuffle(names)
+                extra = len(names) % self.group_size
+                leftover_names.extend(names[:extra])
+                if len(names) == extra:
+                    continue
+                ids, weights, conflicts = self.prepare_matchmaking(names[extra:])
+                rows, cols, _ = key_positions(ids, constraint_keys)
+                ids_arr = np.asarray(ids, dtype=np.int64)
+                tasks.append(
+                    ShardTask(
+                        value,
+                        ids,
+                        list(zip(ids_arr[rows].tolist(), ids_arr[cols].tolist())),
+                        rng.getrandbits(32),
+                        weights,
+                        conflicts,
+                    )
+                )
+            counts.update(shards=len(tasks), largest_shard=max((len(task.ids) for task in tasks), default=0))
+
+        with self.metrics.span("matchmake.shards", shards=len(tasks)) as counts:
+            shard_groups = solve_shards(tasks, self.backend, self.group_size, self.shard_workers, progress)
+            group_ids: List[Tuple[int, ...]] = []
+            for task, groups in zip(tasks, shard_groups):
+                grouped = set(itertools.chain.from_iterable(groups))
+                leftover_names.extend(self.registry.names_of([idx for idx in task.ids if idx not in grouped]))
+                group_ids.extend(groups)
+            counts["groups"] = len(group_ids)
+
+        if 0 < len(leftover_names) < self.group_size and group_ids:
+            # too few to form a group, so break up one shard group to make room for them
+            leftover_names.extend(self.registry.names_of(group_ids.pop()))
+        with self.metrics.span("matchmake.stitch", participants=len(leftover_names)) as counts:
+            if leftover_names:
+                logger.info(f"Stitching {len(leftover_names)} participants left over from {len(tasks)} shards")
+                ids, weights, conflicts = self.prepare_matchmaking(leftover_names)
+                stitched = matchmake(
+                    ids,
+                    constraints_ids,
+                    backend=self.backend,
+                    weights=weights,
+                    group_size=self.group_size,
+                    conflicts=conflicts,
+                )
+                group_ids.extend(stitched)
+                counts["groups"] = len(stitched)
+        return self._postprocess_matches(group_ids)
+
+    def prepare_matchmaking(
+        self,
+        participant_names: List[str],
+    ) -> Tuple[List[int], Optional[SparseWeights], Optional[np.ndarray]]:
+        """
+        Maps participants to IDs, and builds the recency and affinity weights and group
+        conflicts a solve needs (None when they don't apply), so that the solve itself
+        can run anywhere, e.g. in another process.
+        """
+        participant_ids = self._preprocess_participants(participant_names)
+        weights = self._recency_weights(participant_ids)
+        if self.affinity_rules:
+            weights = self._affinity_weights(participant_names, participant_ids, weights)
+        return (
+            participant_ids,
+            weights,
+            self._group_conflicts(participant_ids),
+        )
+
+    def check_feasibility(
+        self,
+        participant_names: List[str],
+        constraints_ids: List[Tuple[int, int]],
+    ) -> FeasibilityReport:
+        """
+        Checks whether everyone can be paired before solving, and if not, who can't be
+        and which of the oldest past pairings would have to repeat to pair them.
+        """
+        if self.history is None:
+            raise RuntimeError("load_data must be called before checking feasibility")
+        with self.metrics.span("check_feasibility", participants=len(participant_names)) as counts:
+            participant_ids = self._preprocess_participants(participant_names)
+            hard_keys, soft_keys, soft_months = self._split_history()
+            if self.recency_half_life is not None:
+                # past pairings only lower the weight of a pair, the constraints are all that's forbidden
+                id_a, id_b = np.divmod(hard_keys, KEY_STRIDE)
+                constraints_ids = list(zip(id_a.tolist(), id_b.tolist()))
+            if any(rule.hard for rule in self.affinity_rules):
+                unique_ids = list(dict.fromkeys(participant_ids))
+                constraints_ids = constraints_ids + [
+                    (unique_ids[u], unique_ids[v])
+                    for u, v in forbidden_pairs(
+                        self._participant_attributes(participant_names), self.affinity_rules
+                    )
+                ]
+            report = analyze_feasibility(
+                participant_ids, constraints_ids, soft_keys, soft_months, hard_keys
+            )
+            counts.update(max_pairs=report.max_pairs, relaxations=len(report.relaxations))
+        if report.feasible:
+            logger.info(report.describe(self.registry.names_of))
+        else:
+            logger.error(report.describe(self.registry.names_of))
+        return report
+
+    def partner_index(self, participant_names: List[str]) -> PartnerIndex:
+        """
+        Indexes who each participant can't be paired with anymore: CONSTRAINTS.csv and
+        every past pairing, except an older copy of the results file.
+        """
+        if self.history is None:
+            raise RuntimeError("load_data must be called before indexing partners")
+        participant_ids = self._preprocess_participants(participant_names)
+        mask = self.history.file_mask([os.path.basename(self.results_filename)])
+        with self.metrics.span("partner_index", participants=len(participant_ids)):
+            return PartnerIndex.from_keys(
+                list(dict.fromkeys(participant_ids)), self.history.occurrence_keys[mask]
+            )
+
+    def coverage(self, participant_names: List[str] = ()) -> CoverageReport:
+        """
+        Analyzes how used up the community is: everyone who ever took part, plus the
+        participants given, and who of them met or can still meet whom.
+        """
+        if self.history is None:
+            raise RuntimeError("load_data or load_history must be called before analyzing coverage")
+        participant_ids = self._preprocess_participants(list(participant_names))
+        met_keys = self.history.occurrence_keys[self.history.file_mask([self.constraints_basename])]
+        ids = np.union1d(np.unique(np.divmod(met_keys, KEY_STRIDE)), participant_ids).astype(np.int64)
+        with self.metrics.span("coverage", people=len(ids), met_pairs=len(met_keys)):
+            return analyze_coverage(ids.tolist(), met_keys, self.history.keys)
+
+    def read_results(self) -> List[Tuple[str, ...]]:
+        pairings = [
+            tuple(name for name in pairing if name)
+            for pairing in read_all_pairings(self.results_filename)
+        ]
+        return [pairing for pairing in pairings if len(pairing) >= 2]
+
+    def amend(
+        self,
+        removed_names: List[str],
+        added_names: List[str],
+    ) -> List[Tuple[str, ...]]:
+        """
+        Repairs the pairings already saved in results_filename after people dropped out
+        or joined, keeping every pair that doesn't involve them. Members of bigger groups
+        (e.g. last month's trio) are re-paired too, and whoever is left over joins a pair
+        as its trio. With a group_size above 2, every group that lost nobody is kept, and
+        everyone else is split into new groups.
+        Inputs:
+            removed_names: List[str], people who dropped out.
+            added_names: List[str], people who joined.
+        Returns:
+            group_names: List[Tuple[str, ...]], the amended pairings. Someone can still be
+                left out, if no group may take them.
+        """
+        if self.history is None:
+            raise RuntimeError("load_data must be called before amending pairings")
+        logger.info(
+            f"Amending {self.results_filename}: {len(removed_names)} dropped out, {len(added_names)} joined"
+        )
+        with self.metrics.span(
+            "amend", removed=len(removed_names), added=len(added_names)
+        ) as counts:
+            previous = self.read_results()
+            removed = set(removed_names)
+            participant_names = [
+                name
+                for name in dict.fromkeys(itertools.chain(itertools.chain(*previous), added_names))
+                if name not in removed
+            ]
+            participant_ids = self._preprocess_participants(participant_names)
+            constraints_ids = self._amend_constraints()
+            if self.group_size == 2:
+                kept_ids = [
+                    (self.names_to_ids[pairing[0]], self.names_to_ids[pairing[1]])
+                    for pairing in previous
+                    if len(pairing) == 2 and not removed.intersection(pairing)
+                ]
+                group_ids = repair(kept_ids, participant_ids, constraints_ids)
+            else:
+                group_ids = [
+                    tuple(self.names_to_ids[name] for name in group)
+                    for group in previous
+                    if not removed.intersection(group)
+                ]
+                grouped = set(itertools.chain(*group_ids))
+                regrouped = [idx for idx in dict.fromkeys(participant_ids) if idx not in grouped]
+                if len(regrouped) >= self.group_size:
+                    group_ids += matchmake(regrouped, constraints_ids, group_size=self.group_size)
+            group_ids, unplaced = attach_leftovers(group_ids, participant_ids, constraints_ids)
+            if unplaced:
+                logger.warning(f"{len(unplaced)} people can't join any group without repeating a pairing")
+            counts.update(participants=len(participant_ids), pairs=len(group_ids))
+        return self._postprocess_matches(group_ids)
+
+    def _amend_constraints(self) -> List[Tuple[int, int]]:
+        # the results file being amended is in the history too, but its pairs are the
+        # ones to keep
+        if self.recency_half_life is not None:
+            keys, _, _ = self._split_history()
+        else:
+            mask = self.history.file_mask([os.path.basename(self.results_filename)])
+            keys = np.unique(self.history.occurrence_keys[mask])
+        id_a, id_b = np.divmod(keys, KEY_STRIDE)
+        return list(zip(id_a.tolist(), id_b.tolist()))
+
+    def start_candidate_pool(
+        self,
+        participant_names: List[str],
+        constraints_ids: List[Tuple[int, int]],
+        size: int = DEFAULT_POOL_SIZE,
+    ) -> None:
+        """
+        Starts solving a pool of candidate matchings in the background, so that
+        next_candidate can serve a fresh matching without waiting for a solve.
+        """
+        self.close_candidate_pool()
+        logger.info(f"Generating a pool of {size} candidate matchings")
+        participant_ids, weights, conflicts = self.prepare_matchmaking(participant_names)
+        self._pool_cache_key = None
+        if self.cache_solves:
+            # the matching last served is what a re-run with the same inputs gets back
+            self._pool_cache_key = (
+                solve_key(participant_ids, constraints_ids, None, weights, conflicts, self.group_size, self.backend),
+                settings_key(self.group_size, self.backend, weights, conflicts),
+                participant_ids,
+            )
+        self.candidate_pool = CandidatePool(
+            participant_ids,
+            constraints_ids,
+            size,
+            weights=weights,
+            group_size=self.group_size,
+            conflicts=conflicts,
+        )
+
+    def next_candidate(self) -> List[Tuple[str, ...]]:
+        if self.candidate_pool is None:
+            raise RuntimeError("start_candidate_pool must be called before next_candidate")
+        with self.metrics.span("next_candidate") as counts:
+            pair_ids = self.candidate_pool.next()
+            counts["pairs"] = len(pair_ids)
+        if self._pool_cache_key is not None:
+            self._cache_store(*self._pool_cache_key, pair_ids)
+        return self._postprocess_matches(pair_ids)
+
+    def cached_candidate(self) -> Optional[List[Tuple[str, ...]]]:
+        """
+        Returns the cached matching of the candidate pool's inputs, e.g. the one served
+        by an earlier run with the same roster and history, or None.
+        """
+        if self._pool_cache_key is None or self.profile_filename is not None:
+            return None
+        cache = SolveCache(self._pairings_dirname())
+        try:
+            pair_ids = cache.get(self._pool_cache_key[0])
+        finally:
+            cache.close()
+        if pair_ids is None:
+            return None
+        logger.info("Reusing the cached matching of these participants and history")
+        return self._postprocess_matches(pair_ids)
+
+    def close_candidate_pool(self) -> None:
+        if self.candidate_pool is not None:
+            self.candidate_pool.close()
+            self.candidate_pool = None
+
+    def run_schedule(
+        self,
+        participant_names: List[str],
+        constraints_ids: List[Tuple[int, int]],
+        months: int,
+    ) -> List[List[Tuple[str, ...]]]:
+        logger.info(f"Running matchmaking for the next {months} months")
+        participant_ids = self._preprocess_participants(participant_names)
+
+        with self.metrics.span(
+            "schedule", participants=len(participant_ids), months=months
+        ):
+            schedule_ids = schedule(participant_ids, constraints_ids, months)
+        return [self._postprocess_matches(pair_ids) for pair_ids in schedule_ids]
+
+    def schedule_filenames(self, months: int) -> List[str]:
+        stem, ext = os.path.splitext(self.results_filename)
+        return [f"{stem}_{month + 1}{ext}" for month in range(months)]
+
     def sanity_check_matches(
         self,
-        pair_names: List[Tuple[str, str]],
+        pair_names: List[Tuple[str, ...]],
+        participant_names: List[str],
+        pairings_dirname: str = PAIRINGS_LOCATION,
+    ) -> bool:
+        return self._sanity_check(
+            {self.results_filename: pair_names}, participant_names, pairings_dirname
+        )
+
+    def sanity_check_schedule(
+        self,
+        schedule_names: List[List[Tuple[str, ...]]],
         participant_names: List[str],
         pairings_dirname: str = PAIRINGS_LOCATION,
+    ) -> bool:
+        filenames = self.schedule_filenames(len(schedule_names))
+        return self._sanity_check(
+            dict(zip(filenames, schedule_names)), participant_names, pairings_dirname
+        )
+
+    def _sanity_check(
+        self,
+        pair_names_by_file: Dict[str, List[Tuple[str, ...]]],
+        participant_names: List[str],
+        pairings_dirname: str,
+    ) -> bool:
+        with self.metrics.span(
+            "sanity_check_matches",
+            participants=len(participant_names),
+            results_files=len(pair_names_by_file),
+        ):
+            return self._sanity_check_unmeasured(
+                pair_names_by_file, participant_names, pairings_dirname
+            )
+
+    def _sanity_check_unmeasured(
+        self,
+        pair_names_by_file: Dict[str, List[Tuple[str, ...]]],
+        participant_names: List[str],
+        pairings_dirname: str,
     ) -> bool:
         # sanity check that everyone is paired, and that pairs were never repeated
         logger.info("Checking that everyone that is participating has been paired...")
-        actual_participants = set(itertools.chain(*pair_names))
-        nonparticipants = set(participant_names) - actual_participants
-        if len(nonparticipants) == 0:
-            logger.info("All participants were paired successfully!")
-        else:
-            logger.error("Some people left unpaired :(")
-            logger.error(f"Unpaired folks: {nonparticipants}")
-            return False
+        for results_filename, pair_names in pair_names_by_file.items():
+            actual_participants = set(itertools.chain(*pair_names))
+            nonparticipants = set(participant_names) - actual_participants
+            if len(nonparticipants) == 0:
+                logger.info(f"All participants were paired successfully in {results_filename}!")
+            else:
+                logger.error(f"Some people left unpaired in {results_filename} :(")
+                logger.error(f"Unpaired folks: {nonparticipants}")
+                return False
 
         logger.info("Checking that no pairings are repeats...")
-        history = {}
-        # grab all the previous pairing history
-        csv_filenames = os.listdir(pairings_dirname)
-        for filename in csv_filenames:
-            if filename.endswith("constraints.csv"):
-                logger.debug('Skipping "constraints.csv" file during history check')
-                continue
-            csv_filename = os.path.join(pairings_dirname, filename)
-            history[csv_filename] = read_all_pairings(csv_filename)
-        # also add in currently generated pairings
-        history[self.results_filename] = pair_names
+        # reuse the history loaded alongside the constraints, skipping the constraints
+        # file and any stale copy of the results files
+        if self.history is None or self.history.pairings_dirname != pairings_dirname:
+            self.load_history(participant_names, pairings_dirname)
+        repeats = self.find_repeats(pair_names_by_file)
 
-        all_histories = get_all_pairing_history(history)
-        if all(len(history) == 1 for history in all_histories.values()):
+        if not repeats:
             logger.info("All pairings are new and haven't been repeated!")
+        elif self.recency_half_life is not None:
+            logger.warning("Some pairings are repeats, allowed because history is weighted by recency:")
+            for (name_a, name_b), filenames in repeats.items():
+                logger.warning(f"{name_a} & {name_b}: {filenames}")
         else:
             logger.error(
                 "Some invalid pairings. Repeated pairings, and offending files:"
             )
-            for pair_name, filenames in all_histories.items():
-                if len(filenames) > 1:
-                    logger.error(f"{pair_name[0]} & {pair_name[1]}: {filenames}")
+            for (name_a, name_b), filenames in repeats.items():
+                logger.error(f"{name_a} & {name_b}: {filenames}")
             return False
         return True
 
-    def finalize_matches(self, pair_names: List[Tuple[str, str]]) -> None:
-        write_pairings(pair_names, self.results_filename)
+    def find_repeats(
+        self,
+        pair_names_by_file: Dict[str, List[Tuple[str, ...]]],
+    ) -> Dict[Tuple[str, str], List[str]]:
+        """
+        Finds the pairings in pair_names_by_file (results filename -> groups) that
+        already happened, skipping the constraints file and any stale copy of the
+        results files in the history.
+        Returns:
+            repeats: Dict[Tuple[str, str], List[str]], the repeated pairs and the files they appear in.
+        """
+        # encode the new pairings as int64 keys too, then find repeats in one sort
+        extra = {}
+        for results_filename, pair_names in pair_names_by_file.items():
+            # every two members of a group count as a pairing
+            member_pairs = [
+                pair for pair_name in pair_names for pair in itertools.combinations(pair_name, 2)
+            ]
+            ids_a = [self.names_to_ids[a] for a, _ in member_pairs]
+            ids_b = [self.names_to_ids[b] for _, b in member_pairs]
+            extra[results_filename] = pair_keys(ids_a, ids_b)
+        repeats = self.history.repeats(
+            extra,
+            exclude=[self.constraints_basename]
+            + [os.path.basename(filename) for filename in pair_names_by_file],
+        )
+        return {
+            tuple(self.registry.names_of(split_key(key))): filenames
+            for key, filenames in repeats.items()
+        }
+
+    def finalize_matches(self, pair_names: List[Tuple[str, ...]]) -> None:
+        with self.metrics.span("finalize_matches", pairs=len(pair_names)):
+            write_pairings(pair_names, self.results_filename)
+
+    def finalize_schedule(self, schedule_names: List[List[Tuple[str, ...]]]) -> None:
+        for pair_names, filename in zip(
+            schedule_names, self.schedule_filenames(len(schedule_names))
+        ):
+            write_pairings(pair_names, filename)
 
-    def _preprocess_participants(
+    def _recency_weights(self, participant_ids: List[int]) -> Optional[SparseWeights]:
+        if self.recency_half_life is None:
+            return None
+        if self.history is None:
+            raise RuntimeError("load_data must be called before weighting history by recency")
+
+        hard_keys, soft_keys, soft_months = self._split_history()
+        current_month = file_month(self.results_filename)
+        if current_month is None:
+            current_month = month_index(datetime.date.today())
+        logger.info(
+            f"Weighting {len(soft_keys)} past pairings by recency (half-life {self.recency_half_life} months)"
+        )
+        return recency_weights(
+            list(dict.fromkeys(participant_ids)),
+            hard_keys,
+            soft_keys,
+            soft_months,
+            current_month,
+            self.recency_half_life,
+        )
+
+    def _affinity_weights(
         self,
         participant_names: List[str],
-        constraints_names: List[Tuple[str, str]],
-    ) -> Tuple[List[int], List[Tuple[int, int]]]:
-        constraints_ids = []
-        for constraint_name in constraints_names:
-            constraints_ids.append(
-                [
-                    self.names_to_ids[constraint_name[0]],
-                    self.names_to_ids[constraint_name[1]],
-                ]
-            )
-        participant_ids = [self.names_to_ids[name] for name in participant_names]
-        return (participant_ids, constraints_ids)
+        participant_ids: List[int],
+        weights: Optional[SparseWeights],
+    ) -> SparseWeights:
+        if self.history is None:
+            raise RuntimeError("load_data must be called before weighting pairs by affinity")
+        if weights is None:
+            # without recency weights every pair that ever met is forbidden
+            weights = fresh_weights(list(dict.fromkeys(participant_ids)), self.history.keys)
+        logger.info(
+            "Weighting pairs by affinity: " + ", ".join(str(rule) for rule in self.affinity_rules)
+        )
+        return apply_affinity(weights, self._participant_attributes(participant_names), self.affinity_rules)
+
+    def _participant_attributes(self, participant_names: List[str]) -> ParticipantAttributes:
+        attributes = self.attributes or ParticipantAttributes([])
+        return attributes.select(list(dict.fromkeys(participant_names)))
+
+    def _group_conflicts(self, participant_ids: List[int]) -> Optional[np.ndarray]:
+        """
+        Builds the conflict matrix used when splitting the roster into groups of more
+        than 2: how many times each pair met before, with CONSTRAINTS.csv pairs as hard
+        conflicts. Returns None when the roster is paired up (an odd one's trio is
+        attached to a pair instead), or when recency or affinity weights provide the
+        conflicts instead.
+        """
+        unique_ids = list(dict.fromkeys(participant_ids))
+        if self.group_size == 2:
+            return None
+        if self.recency_half_life is not None or self.affinity_rules:
+            return None
+        if self.history is None:
+            raise RuntimeError("load_data must be called before splitting into groups")
+        hard_keys, _, _ = self._split_history()
+        mask = self.history.file_mask(
+            [self.constraints_basename, os.path.basename(self.results_filename)]
+        )
+        soft_keys, soft_counts = np.unique(self.history.occurrence_keys[mask], return_counts=True)
+        logger.info(f"Splitting {len(unique_ids)} participants into groups of {self.group_size}")
+        return conflict_matrix(unique_ids, soft_keys, soft_counts, hard_keys)
+
+    def _split_history(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Splits the history into the CONSTRAINTS.csv pairs, which must never be repeated,
+        and past pairings with the latest month they met in.
+        """
+        constraints_mask = ~self.history.file_mask([self.constraints_basename])
+        hard_keys = np.unique(self.history.occurrence_keys[constraints_mask])
+        soft_keys, soft_months = latest_meetings(
+            self.history,
+            exclude=[self.constraints_basename, os.path.basename(self.results_filename)],
+        )
+        return hard_keys, soft_keys, soft_months
+
+    def _preprocess_participants(self, participant_names: List[str]) -> List[int]:
+        # names added after load_data (e.g. someone sitting in) may not have been looked up yet
+        missing = [name for name in participant_names if name not in self.names_to_ids]
+        if missing:
+            self.names_to_ids.update(self.registry.register(missing))
+        return [self.names_to_ids[name] for name in participant_names]
 
     def _postprocess_matches(
         self,
-        pair_ids: List[Tuple[int, int]],
-    ) -> List[Tuple[str, str]]:
-        ids_to_names = {v: k for k, v in self.names_to_ids.items()}
-        res_pair_names = [
-            (ids_to_names[pair_id[0]], ids_to_names[pair_id[1]]) for pair_id in pair_ids
-        ]
+        pair_ids: List[Tuple[int, ...]],
+    ) -> List[Tuple[str, ...]]:
+        res_pair_names = [tuple(self.registry.names_of(pair_id)) for pair_id in pair_ids]
 
         return res_pair_names
@@ -0,0 +1,181 @@
+import logging
+import random
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from implicit_matching import ComplementMatcher
+from partner_index import PartnerIndex
+from weights import key_positions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RUNS = 32
+# simulated months per run, past this the forecast just says "at least"
+DEFAULT_MAX_MONTHS = 120
+# bins of the fresh partner distribution, as fractions of the rest of the community
+DISTRIBUTION_BINS = (0.0, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0)
+
+
+@dataclass
+class CoverageReport:
+    """
+    How used up the community is. People are registry IDs.
+    """
+
+    ids: List[int]
+    # how many distinct people each of ids has met, and can still meet
+    met: np.ndarray
+    fresh: np.ndarray
+    met_pairs: int
+    # months each Monte-Carlo run kept everyone pairable, capped at max_months
+    forecast: List[int] = field(default_factory=list)
+    max_months: int = DEFAULT_MAX_MONTHS
+
+    @property
+    def possible_pairs(self) -> int:
+        return len(self.ids) * (len(self.ids) - 1) // 2
+
+    @property
+    def met_fraction(self) -> float:
+        return self.met_pairs / self.possible_pairs if self.possible_pairs else 0.0
+
+    @property
+    def novelty(self) -> np.ndarray:
+        """
+        The fraction of the rest of the community each person can still meet.
+        """
+        return self.fresh / max(len(self.ids) - 1, 1)
+
+    def distribution(self) -> List[Tuple[float, float, int]]:
+        """
+        Counts the people per novelty bin, as (low, high, people).
+        """
+        counts, edges = np.histogram(self.novelty, bins=DISTRIBUTION_BINS)
+        return list(zip(edges[:-1].tolist(), edges[1:].tolist(), counts.tolist()))
+
+    def describe(self) -> List[str]:
+        n = len(self.ids)
+        lines = [
+            f"{n} people have taken part, {self.met_pairs} of {self.possible_pairs} possible pairs "
+            f"have met ({100 * self.met_fraction:.1f}%).",
+        ]
+        if n:
+            lines.append(
+                f"Distinct partners met per person: min {int(self.met.min())}, "
+                f"median {float(np.median(self.met)):.0f}, max {int(self.met.max())}"
+            )
+            lines.append("Fresh partners left, as a share of everyone else:")
+            for low, high, people in self.distribution():
+                lines.append(f"  {100 * low:3.0f}%-{100 * high:3.0f}%: {people}")
+        if self.forecast:
+            months = np.array(self.forecast)
+            capped = " (at least)" if (months >= self.max_months).any() else ""
+            lines.append(
+                f"Everyone stays pairable for another {int(np.median(months))} months{capped} "
+                f"(median of {len(months)} simulations, range {int(months.min())}-{int(months.max())})."
+            )
+        return lines
+
+
+def analyze_coverage(
+    ids: Sequence[int],
+    met_keys: np.ndarray,
+    forbidden_keys: np.ndarray,
+) -> CoverageReport:
+    """
+    Counts how many of the people in `ids` each person met, and can still meet.
+    Inputs:
+        ids: Sequence[int], the community, without repeats.
+        met_keys: np.ndarray[int64], pair keys of every past pairing.
+        forbidden_keys: np.ndarray[int64], pair keys that can't be paired anymore,
+            i.e. met_keys plus the constraints.
+    Returns:
+        report: CoverageReport, without a forecast.
+    """
+    ids = list(ids)
+    rows, cols, _ = key_positions(ids, np.unique(met_keys))
+    met = np.bincount(np.concatenate([rows, cols]), minlength=len(ids))
+    fresh = PartnerIndex.from_keys(ids, forbidden_keys).fresh_counts()
+    return CoverageReport(ids, met, fresh, int(len(rows)))
+
+
+def _simulate(
+    n: int,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    seed: int,
+    max_months: int,
+    attendance: float,
+) -> int:
+    """
+    Pairs the community month after month, never repeating a pair, and returns how
+    many months everyone attending could be paired.
+    """
+    rng = random.Random(seed)
+    forbidden = [set() for _ in range(n)]
+    for u, v in zip(rows.tolist(), cols.tolist()):
+        forbidden[u].add(v)
+        forbidden[v].add(u)
+    for month in range(max_months):
+        attending = [v for v in range(n) if rng.random() < attendance] if attendance < 1 else list(range(n))
+        position = {v: i for i, v in enumerate(attending)}
+        matcher = ComplementMatcher(
+            len(attending),
+            [{position[u] for u in forbidden[v] if u in position} for v in attending],
+        )
+        pairs = matcher.solve(rng)
+        if len(attending) - 2 * len(pairs) > len(attending) % 2:
+            return month
+        for u, v in pairs:
+            forbidden[attending[u]].add(attending[v])
+            forbidden[attending[v]].add(attending[u])
+    return max_months
+
+
+def forecast_exhaustion(
+    report: CoverageReport,
+    forbidden_keys: np.ndarray,
+    runs: int = DEFAULT_RUNS,
+    max_months: int = DEFAULT_MAX_MONTHS,
+    attendance: float = 1.0,
+    seed: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> CoverageReport:
+    """
+    Estimates how many more months perfect matchings stay possible, by simulating
+    future months of the matcher in a process pool, and stores it in the report.
+    Inputs:
+        report: CoverageReport, from analyze_coverage.
+        forbidden_keys: np.ndarray[int64], the same keys analyze_coverage was given.
+        runs: int, how many independent simulations to run.
+        max_months: int, how many months to simulate at most per run.
+        attendance: float, the fraction of the community attending each simulated month.
+        seed: Optional[int], seed for the simulations.
+        max_workers: Optional[int], processes to simulate in (default: one per CPU).
+    Returns:
+        report: CoverageReport, the same report.
+    """
+    # multiprocessing is slow to import, only pay for it when forecasting
+    from concurrent.futures import ProcessPoolExecutor
+
+    rows, cols = PartnerIndex.from_keys(report.ids, forbidden_keys).pairs()
+    rng = random.Random(seed)
+    seeds = [rng.getrandbits(32) for _ in range(runs)]
+    n = len(report.ids)
+    logger.info(f"Simulating {runs} futures of {n} people, up to {max_months} months each")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        report.forecast = list(
+            executor.map(
+                _simulate,
+                [n] * runs,
+                [rows] * runs,
+                [cols] * runs,
+                seeds,
+                [max_months] * runs,
+                [attendance] * runs,
+            )
+        )
+    report.max_months = max_months
+    return report
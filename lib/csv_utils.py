@@ -1,9 +1,11 @@
 import logging
 import os
 import csv
-import datetime
 from typing import Dict, List, Tuple
 
+from affinity import ROSTER_COLUMNS, AttributeReader, ParticipantAttributes
+from id_registry import IdRegistry
+
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +19,7 @@ def read_all_pairings(pairings_file: str) -> List[Tuple[str, str]]:
         pairings: List[Tuple[str, str]], a list of IDs pairs to avoid pairing.
     """
     pairings = []
-    if os.path.splitext(pairings_file)[1] != ".csv":
+    if os.path.splitext(pairings_file)[1].lower() != ".csv":
         logger.info(f'Skip reading "{pairings_file}" because it\'s not a CSV file.')
         return []
 
@@ -35,13 +37,35 @@ def read_participants(participants_file: str) -> List[str]:
     Returns:
         participants: List[str], a list of participant names.
     """
-    participants = []
-    if os.path.splitext(participants_file)[1] != ".csv":
+    return read_roster(participants_file)[1].names
+
+
+def read_roster(participants_file: str) -> Tuple[List[str], ParticipantAttributes]:
+    """
+    Reads the participants and their optional columns from the specified file. A roster
+    either starts with a header row whose first column is "name", naming its other
+    columns, or has no header and lists name, team, office, timezone, seniority.
+    Inputs:
+        participants_file: str, the path to the participants CSV to be read.
+    Returns:
+        participants: List[str], a list of participant names.
+        attributes: ParticipantAttributes, the other columns of every row.
+    """
+    if os.path.splitext(participants_file)[1].lower() != ".csv":
         raise RuntimeError(f"participants_file {participants_file} is not a csv file.")
+    reader = None
     with open(participants_file) as csv_file:
-        for name in csv.reader(csv_file):
-            participants.append(name[0])
-    return participants
+        for row in csv.reader(csv_file):
+            if not row:
+                continue
+            if reader is None:
+                if row[0].strip().lower() == "name":
+                    reader = AttributeReader([column.strip().lower() for column in row[1:]])
+                    continue
+                reader = AttributeReader(ROSTER_COLUMNS)
+            reader.add(row[0], row[1:])
+    attributes = (reader or AttributeReader(ROSTER_COLUMNS)).finish()
+    return attributes.names, attributes
 
 
 def write_pairings(pairings: List[Tuple[str, str]], destination: str) -> None:
@@ -52,31 +76,50 @@ def write_pairings(pairings: List[Tuple[str, str]], destination: str) -> None:
     Outputs:
         filename: str, the name of the csv file that was written.
     """
-    with open(destination, "w") as f:
+    # write next to the destination and swap it in, so the file is never half written
+    tmp_destination = destination + ".tmp"
+    with open(tmp_destination, "w") as f:
         for pair in pairings:
             csv.writer(f).writerow(pair)
+    os.replace(tmp_destination, destination)
+
+
+def write_all_pairings(pairings_by_destination: Dict[str, List[Tuple[str, ...]]]) -> None:
+    """
+    Writes several pairings files, swapping them in only once all of them are written,
+    so that a failure part way leaves none of them behind.
+    Inputs:
+        pairings_by_destination: Dict[str, List[Tuple[str, ...]]], the pairings to
+            write to each path.
+    """
+    tmp_destinations = {destination: destination + ".tmp" for destination in pairings_by_destination}
+    try:
+        for destination, pairings in pairings_by_destination.items():
+            with open(tmp_destinations[destination], "w") as f:
+                writer = csv.writer(f)
+                for pair in pairings:
+                    writer.writerow(pair)
+    except BaseException:
+        for tmp_destination in tmp_destinations.values():
+            if os.path.exists(tmp_destination):
+                os.remove(tmp_destination)
+        raise
+    for destination, tmp_destination in tmp_destinations.items():
+        os.replace(tmp_destination, destination)
 
 
 def generate_ids(names: List[str], ids_filename: str) -> Dict[str, int]:
-    # read ids from csv
-    names_to_ids = {}
-    if os.path.exists(ids_filename):
-        with open(ids_filename) as csv_file:
-            for name, num_id in csv.reader(csv_file):
-                names_to_ids[name] = int(num_id)
-
-    # generate new ids
-    for name in names:
-        if name not in names_to_ids:
-            logger.debug(
-                f"New participant, adding name-ID pair {name}: {len(names_to_ids)}"
-            )
-            names_to_ids[name] = len(names_to_ids)
-
-    # write new ids to csv
-    with open(ids_filename, "w") as csv_file:
-        writer = csv.writer(csv_file)
-        for name, num_id in names_to_ids.items():
-            writer.writerow([name, num_id])
-
-    return names_to_ids
+    """
+    Looks up the IDs of the specified names, registering new names in the append-only
+    ID log.
+    Inputs:
+        names: List[str], the names to look up.
+        ids_filename: str, the path to the ID log CSV.
+    Returns:
+        names_to_ids: Dict[str, int], the ID of every name in names.
+    """
+    registry = IdRegistry(ids_filename)
+    try:
+        return registry.register(names)
+    finally:
+        registry.close()
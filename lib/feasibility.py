@@ -0,0 +1,165 @@
+import logging
+import random
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from implicit_matching import ComplementMatcher, build_forbidden
+from weights import key_positions
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FeasibilityReport:
+    """
+    What a maximum matching of this month's roster looks like before solving for real.
+    People are participant IDs.
+    """
+
+    participants: int
+    max_pairs: int
+    # left unpaired by the maximum matching the analysis found
+    unpaired: List[int] = field(default_factory=list)
+    # Gallai-Edmonds D: anyone here may be the one left out
+    could_be_unpaired: List[int] = field(default_factory=list)
+    # Gallai-Edmonds A: the only people anyone in could_be_unpaired can still meet
+    bottleneck: List[int] = field(default_factory=list)
+    # oldest past pairings to allow again, with the month they last met in, which
+    # together make everyone pairable
+    relaxations: List[Tuple[int, int, int]] = field(default_factory=list)
+
+    @property
+    def left_out(self) -> int:
+        return self.participants - 2 * self.max_pairs
+
+    @property
+    def feasible(self) -> bool:
+        return self.left_out <= self.participants % 2
+
+    @property
+    def relaxed_pairs(self) -> int:
+        return self.max_pairs + len(self.relaxations)
+
+    def describe(self, names_of: Callable[[Sequence[int]], List[str]]) -> str:
+        if self.feasible:
+            return f"Everyone can be paired ({self.max_pairs} pairs)."
+        lines = [
+            f"At most {self.max_pairs} pairs are possible, {self.left_out} of {self.participants} people will be left out.",
+            f"Left out by one best matching: {', '.join(names_of(self.unpaired))}",
+            f"Any of these may be left out: {', '.join(names_of(self.could_be_unpaired))}",
+        ]
+        if self.bottleneck:
+            lines.append(f"...because they can only meet: {', '.join(names_of(self.bottleneck))}")
+        if self.relaxations:
+            lines.append("Allowing these oldest past pairings to repeat would pair more people:")
+            for a, b, month in self.relaxations:
+                name_a, name_b = names_of([a, b])
+                year, month_of_year = divmod(month, 12)
+                lines.append(f"  {name_a} & {name_b} (last met {year}-{month_of_year + 1:02d})")
+        still_left_out = self.participants - 2 * self.relaxed_pairs
+        if still_left_out > self.participants % 2:
+            lines.append(
+                f"Even then, {still_left_out} people can't be paired without breaking CONSTRAINTS.csv."
+            )
+        return "\n".join(lines)
+
+
+def analyze_feasibility(
+    ids: List[int],
+    constraints: List[Tuple[int, int]],
+    soft_keys: np.ndarray,
+    soft_months: np.ndarray,
+    hard_keys: np.ndarray,
+    seed: Optional[int] = None,
+) -> FeasibilityReport:
+    """
+    Finds a maximum matching of the allowed graph and its Gallai-Edmonds decomposition,
+    then, if some people can't be paired, the fewest past pairings that fix it.
+    Inputs:
+        ids: List[int], this month's participant IDs.
+        constraints: List[Tuple[int, int]], every forbidden pair.
+        soft_keys: np.ndarray[int64], pair keys of past pairings that may be repeated.
+        soft_months: np.ndarray[int64], the latest month each of soft_keys met in.
+        hard_keys: np.ndarray[int64], pair keys that must never be repeated.
+        seed: Optional[int], seed for the matching.
+    Returns:
+        report: FeasibilityReport, the analysis.
+    """
+    ids = list(dict.fromkeys(ids))
+    _, forbidden = build_forbidden(ids, constraints)
+    matcher = ComplementMatcher(len(ids), forbidden)
+    matcher.solve(random.Random(seed))
+    d, a = matcher.decomposition()
+    report = FeasibilityReport(
+        participants=len(ids),
+        max_pairs=len(matcher.pairs()),
+        unpaired=[ids[v] for v in matcher.free_vertices()],
+        could_be_unpaired=[ids[v] for v in d],
+        bottleneck=[ids[v] for v in a],
+    )
+    if report.feasible:
+        return report
+
+    relaxable = ~np.isin(soft_keys, hard_keys)
+    rows, cols, kept = key_positions(ids, soft_keys[relaxable])
+    months = soft_months[relaxable][kept]
+    relaxations = relax_oldest(matcher, rows, cols, months)
+    report.relaxations = [(ids[u], ids[v], month) for u, v, month in relaxations]
+    logger.info(
+        f"{report.left_out} people can't be paired, allowing {len(relaxations)} past pairings "
+        f"would pair {2 * len(relaxations)} more"
+    )
+    return report
+
+
+def relax_oldest(
+    matcher: ComplementMatcher,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    months: np.ndarray,
+) -> List[Tuple[int, int, int]]:
+    """
+    Allows forbidden pairs back into `matcher` one at a time, oldest first, keeping only
+    the ones that make an augmenting path possible. Each kept pair pairs two more
+    people, and no pair can do better, so this needs the fewest pairs possible whenever
+    one-at-a-time augmentation reaches a perfect matching.
+    A pair can only help if it joins two different components of the Gallai-Edmonds D
+    set, and its augmenting path has to start from a free vertex that reaches one of
+    its ends, so only those candidates get an augmenting search, from only those roots.
+    Inputs:
+        matcher: ComplementMatcher, holding a maximum matching.
+        rows, cols: np.ndarray, local indices of the candidate pairs.
+        months: np.ndarray, the month each candidate pair last met in.
+    Returns:
+        relaxations: List[Tuple[int, int, int]], kept pairs as local indices and month.
+    """
+    order = np.argsort(months, kind="stable")
+    rows, cols, months = rows[order].tolist(), cols[order].tolist(), months[order].tolist()
+    relaxed = [False] * len(rows)
+    relaxations = []
+    while len(matcher.free_vertices()) > matcher.n % 2:
+        # the free vertices reaching each vertex of D on even alternating paths
+        roots_of: Dict[int, List[int]] = {}
+        for root in matcher.free_vertices():
+            for v in matcher.even_vertices(root):
+                roots_of.setdefault(v, []).append(root)
+        component = matcher.components(list(roots_of))
+        augmented = False
+        for i, (u, v) in enumerate(zip(rows, cols)):
+            if relaxed[i] or u not in component or v not in component or component[u] == component[v]:
+                continue
+            matcher.forbidden[u].discard(v)
+            matcher.forbidden[v].discard(u)
+            roots = dict.fromkeys(roots_of[u] + roots_of[v])
+            if any(matcher.augment(root) for root in roots if matcher.mate[root] == -1):
+                relaxed[i] = True
+                relaxations.append((u, v, months[i]))
+                augmented = True
+                break
+            matcher.forbidden[u].add(v)
+            matcher.forbidden[v].add(u)
+        if not augmented:
+            break
+    return relaxations
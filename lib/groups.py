@@ -0,0 +1,228 @@
+import logging
+import random
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from implicit_matching import ProgressCallback
+from weights import WEIGHT_SCALE, SparseWeights, constraint_positions, key_positions
+
+logger = logging.getLogger(__name__)
+
+# conflict of a pair that must never share a group, far above any number of repeats
+HARD_CONFLICT = 1_000_000
+# iterations a swapped person stays put, unless moving them beats the best partition
+TABU_TENURE = 10
+# give up after this many iterations without improving the best partition
+MAX_STALL = 5000
+# how many iterations to run between progress reports
+PROGRESS_INTERVAL = 256
+
+
+def group_sizes(n: int, group_size: int) -> List[int]:
+    """
+    Splits n people into groups of group_size, giving the leftovers to the last groups,
+    so that e.g. an odd roster in pairs ends with a single trio.
+    """
+    if n <= group_size:
+        return [n] if n else []
+    groups = n // group_size
+    sizes = [group_size] * groups
+    for i in range(n - groups * group_size):
+        sizes[groups - 1 - i % groups] += 1
+    return sizes
+
+
+def conflict_matrix(
+    ids: List[int],
+    soft_keys: np.ndarray,
+    soft_counts: np.ndarray,
+    hard_keys: np.ndarray,
+) -> np.ndarray:
+    """
+    Builds the conflict matrix for the participants in `ids`: how many times each pair
+    already met, and HARD_CONFLICT for pairs that must never share a group.
+    Inputs:
+        ids: List[int], the participant IDs, without repeats.
+        soft_keys: np.ndarray[int64], pair keys of past pairings.
+        soft_counts: np.ndarray, how many times each of soft_keys met.
+        hard_keys: np.ndarray[int64], pair keys that must never be grouped.
+    Returns:
+        conflicts: np.ndarray[int32], symmetric with a zero diagonal.
+    """
+    conflicts = np.zeros((len(ids), len(ids)), dtype=np.int32)
+    rows, cols, kept = key_positions(ids, soft_keys)
+    counts = np.minimum(np.asarray(soft_counts)[kept], HARD_CONFLICT - 1)
+    conflicts[rows, cols] = counts
+    conflicts[cols, rows] = counts
+    rows, cols, _ = key_positions(ids, hard_keys)
+    conflicts[rows, cols] = HARD_CONFLICT
+    conflicts[cols, rows] = HARD_CONFLICT
+    return conflicts
+
+
+def constraint_conflicts(ids: List[int], constraints: Optional[Sequence[Tuple[int, int]]]) -> np.ndarray:
+    """
+    Conflict matrix with a conflict of 1 for every constrained pair.
+    """
+    conflicts = np.zeros((len(ids), len(ids)), dtype=np.int32)
+    rows, cols = constraint_positions(ids, constraints)
+    conflicts[rows, cols] = 1
+    conflicts[cols, rows] = 1
+    return conflicts
+
+
+def weight_conflicts(weights: SparseWeights) -> np.ndarray:
+    """
+    Turns recency or affinity weights into conflicts: a pair that never met has no
+    conflict, a recent pair nearly WEIGHT_SCALE, and a pair with weight 0 is a hard
+    conflict. Affinity bonuses above WEIGHT_SCALE don't lower a conflict below 0.
+    """
+    dense = weights.dense()
+    conflicts = np.where(
+        dense > 0, np.maximum(WEIGHT_SCALE - dense, 0), HARD_CONFLICT
+    ).astype(np.int32)
+    np.fill_diagonal(conflicts, 0)
+    return conflicts
+
+
+class GroupSearch:
+    """
+    Tabu search over partitions of the people 0..n-1 into groups of fixed sizes,
+    minimizing the total conflict between members of the same group.
+
+    load[p, g] caches the conflict between p and everyone in group g. Moves swap two
+    people from different groups, so one person's best swap is a single vectorized pass
+    over everyone else, and applying a swap updates two columns of load.
+    """
+
+    def __init__(
+        self,
+        conflicts: np.ndarray,
+        sizes: Sequence[int],
+        order: Sequence[int],
+        progress: Optional[ProgressCallback] = None,
+    ):
+        self.conflicts = conflicts
+        self.n = len(conflicts)
+        self.progress = progress
+        order = np.asarray(order, dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        self.group_of = np.empty(self.n, dtype=np.int64)
+        self.group_of[order] = np.repeat(np.arange(len(sizes)), sizes)
+        if self.n:
+            self.load = np.add.reduceat(conflicts[:, order], starts, axis=1).astype(np.int64)
+        else:
+            self.load = np.zeros((0, len(sizes)), dtype=np.int64)
+        self.cost = int(self.own_load().sum()) // 2
+
+    def own_load(self) -> np.ndarray:
+        return self.load[np.arange(self.n), self.group_of]
+
+    def groups(self, group_of: Optional[np.ndarray] = None) -> List[List[int]]:
+        group_of = self.group_of if group_of is None else group_of
+        order = np.argsort(group_of, kind="stable")
+        bounds = np.flatnonzero(np.diff(group_of[order])) + 1
+        return [group.tolist() for group in np.split(order, bounds)] if self.n else []
+
+    def swap(self, a: int, b: int, delta: int) -> None:
+        ga, gb = self.group_of[a], self.group_of[b]
+        change = self.conflicts[:, b].astype(np.int64) - self.conflicts[:, a]
+        self.load[:, ga] += change
+        self.load[:, gb] -= change
+        self.group_of[a], self.group_of[b] = gb, ga
+        self.cost += delta
+
+    def search(
+        self,
+        rng: random.Random,
+        max_iterations: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> List[List[int]]:
+        """
+        Runs the tabu search until nobody shares a group with a conflict, the best
+        partition stops improving for MAX_STALL iterations, or a limit is hit.
+        Returns the best partition found, as lists of people.
+        """
+        max_iterations = max_iterations if max_iterations is not None else 50 * self.n + MAX_STALL
+        deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        np_rng = np.random.default_rng(rng.getrandbits(32))
+        tabu_until = np.zeros(self.n, dtype=np.int64)
+        best_cost, best_group_of = self.cost, self.group_of.copy()
+        last_improvement = 0
+        iteration = 0
+        for iteration in range(1, max_iterations + 1):
+            own = self.own_load()
+            conflicted = np.flatnonzero(own > 0)
+            if len(conflicted) == 0:
+                break
+            if iteration % PROGRESS_INTERVAL == 0:
+                if self.progress is not None:
+                    self.progress("groups", 1 - len(conflicted) / self.n)
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+            if iteration - last_improvement > MAX_STALL:
+                break
+
+            a = int(conflicted[np_rng.integers(len(conflicted))])
+            ga = self.group_of[a]
+            load_a = self.load[a]
+            deltas = (
+                load_a[self.group_of]
+                - load_a[ga]
+                + self.load[:, ga]
+                - own
+                - 2 * self.conflicts[a].astype(np.int64)
+            )
+            allowed = self.group_of != ga
+            tabu = tabu_until > iteration
+            # a tabu swap is still fine if it beats the best partition so far
+            allowed &= ~tabu | (self.cost + deltas < best_cost)
+            candidates = np.flatnonzero(allowed)
+            if len(candidates) == 0:
+                continue
+            best_delta = deltas[candidates].min()
+            ties = candidates[deltas[candidates] == best_delta]
+            b = int(ties[np_rng.integers(len(ties))])
+
+            self.swap(a, b, int(best_delta))
+            tabu_until[a] = tabu_until[b] = iteration + TABU_TENURE + np_rng.integers(TABU_TENURE)
+            if self.cost < best_cost:
+                best_cost, best_group_of = self.cost, self.group_of.copy()
+                last_improvement = iteration
+
+        logger.debug(f"Group search ended after {iteration} iterations with conflict {best_cost}")
+        if self.progress is not None:
+            self.progress("done", 1.0)
+        return self.groups(best_group_of)
+
+
+def partition(
+    conflicts: np.ndarray,
+    group_size: int,
+    seed: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+    time_budget: Optional[float] = None,
+) -> List[List[int]]:
+    """
+    Splits the people 0..n-1 of a conflict matrix into groups of group_size (with the
+    leftovers in slightly bigger groups), minimizing conflicts inside groups.
+    Inputs:
+        conflicts: np.ndarray, symmetric conflict matrix with a zero diagonal.
+        group_size: int, the number of people per group.
+        seed: Optional[int], seed for the starting partition and the search.
+        progress: Optional[ProgressCallback], called with the stage and the fraction of
+            people without a conflict. It may raise MatchingCancelled to stop the search.
+        time_budget: Optional[float], seconds after which to return the best partition so far.
+    Returns:
+        groups: List[List[int]], the groups of people.
+    """
+    n = len(conflicts)
+    rng = random.Random(seed)
+    sizes = group_sizes(n, group_size)
+    order = list(range(n))
+    rng.shuffle(order)
+    search = GroupSearch(conflicts, sizes, order, progress)
+    logger.debug(f"Starting group search over {len(sizes)} groups with conflict {search.cost}")
+    return search.search(rng, time_budget=time_budget)
@@ -0,0 +1,244 @@
+import logging
+import os
+import sqlite3
+from collections import defaultdict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HISTORY_INDEX_FILENAME = ".history-index.sqlite"
+# pair keys are min(id) * KEY_STRIDE + max(id), which stays stable as the ID registry grows
+KEY_STRIDE = 1 << 32
+
+
+def pair_key(a: int, b: int) -> int:
+    if a > b:
+        a, b = b, a
+    return a * KEY_STRIDE + b
+
+
+def split_key(key: int) -> Tuple[int, int]:
+    return divmod(key, KEY_STRIDE)
+
+
+def pair_keys(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Vectorized pair_key over two arrays of IDs.
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    return np.minimum(a, b) * KEY_STRIDE + np.maximum(a, b)
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+@dataclass(frozen=True)
+class PairingHistory:
+    """
+    Immutable snapshot of the pairing history, shared by every stage of a run.
+    Every occurrence of a pair is one entry of occurrence_keys, and the matching entry
+    of occurrence_files indexes the file it came from in filenames. timings holds the
+    parse time in seconds of every file re-read for this snapshot.
+    """
+
+    pairings_dirname: str
+    filenames: Tuple[str, ...]
+    occurrence_keys: np.ndarray
+    occurrence_files: np.ndarray
+    keys: np.ndarray
+    timings: Mapping[str, float]
+
+    @classmethod
+    def from_occurrences(
+        cls,
+        pairings_dirname: str,
+        filenames: List[str],
+        occurrence_keys: np.ndarray,
+        occurrence_files: np.ndarray,
+        timings: Dict[str, float],
+    ) -> "PairingHistory":
+        return cls(
+            pairings_dirname,
+            tuple(os.path.join(pairings_dirname, filename) for filename in filenames),
+            _frozen(occurrence_keys),
+            _frozen(occurrence_files),
+            _frozen(np.unique(occurrence_keys)),
+            MappingProxyType(dict(timings)),
+        )
+
+    def file_mask(self, exclude: Iterable[str] = ()) -> np.ndarray:
+        """
+        Returns which occurrences don't come from a file whose basename is in `exclude`
+        (compared case-insensitively).
+        """
+        exclude = {filename.lower() for filename in exclude}
+        excluded = [
+            i
+            for i, filename in enumerate(self.filenames)
+            if os.path.basename(filename).lower() in exclude
+        ]
+        return ~np.isin(self.occurrence_files, excluded)
+
+    def repeats(
+        self,
+        extra: Mapping[str, np.ndarray],
+        exclude: Iterable[str] = (),
+    ) -> Dict[int, List[str]]:
+        """
+        Finds every pair that occurs more than once across the history and the `extra`
+        pairings (results filename -> pair keys), ignoring files in `exclude`.
+        Returns:
+            repeats: Dict[int, List[str]], the offending pair keys and the files they appear in.
+        """
+        mask = self.file_mask(exclude)
+        all_keys = np.sort(
+            np.concatenate([self.occurrence_keys[mask]] + [np.asarray(keys, dtype=np.int64) for keys in extra.values()])
+        )
+        offending = np.unique(all_keys[1:][all_keys[1:] == all_keys[:-1]])
+        if len(offending) == 0:
+            return {}
+
+        # only the few offending keys need to be traced back to their files
+        res: Dict[int, List[str]] = defaultdict(list)
+        hits = mask & np.isin(self.occurrence_keys, offending)
+        for key, f in zip(self.occurrence_keys[hits].tolist(), self.occurrence_files[hits].tolist()):
+            res[key].append(self.filenames[f])
+        for filename, keys in extra.items():
+            for key in np.asarray(keys, dtype=np.int64)[np.isin(keys, offending)].tolist():
+                res[key].append(filename)
+        return res
+
+
+class PairingHistoryIndex:
+    """
+    On-disk index of every pair found in the pairings/ folder, stored as integer pair
+    keys alongside the file each pair came from. Source files are tracked by mtime and
+    size so that only new or changed CSVs need to be re-ingested.
+    """
+
+    def __init__(self, pairings_dirname: str, index_filename: str = HISTORY_INDEX_FILENAME):
+        self.pairings_dirname = pairings_dirname
+        self.index_path = os.path.join(pairings_dirname, index_filename)
+        self.conn = sqlite3.connect(self.index_path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pairs (
+                file TEXT NOT NULL,
+                key INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS pairs_by_key ON pairs (key);
+            CREATE INDEX IF NOT EXISTS pairs_by_file ON pairs (file);
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def stale_files(self) -> Tuple[List[str], List[str]]:
+        """
+        Compares the pairings folder against the index.
+        Returns:
+            changed: List[str], CSV filenames that are new or modified since they were indexed.
+            removed: List[str], indexed filenames that no longer exist.
+        """
+        indexed = {
+            name: (mtime_ns, size)
+            for name, mtime_ns, size in self.conn.execute(
+                "SELECT name, mtime_ns, size FROM files"
+            )
+        }
+        changed = []
+        on_disk = set()
+        for filename in sorted(os.listdir(self.pairings_dirname)):
+            if os.path.splitext(filename)[1].lower() != ".csv":
+                continue
+            on_disk.add(filename)
+            stat = os.stat(os.path.join(self.pairings_dirname, filename))
+            if indexed.get(filename) != (stat.st_mtime_ns, stat.st_size):
+                changed.append(filename)
+        removed = sorted(set(indexed) - on_disk)
+        return changed, removed
+
+    def ingest(self, filename: str, keys: Iterable[int]) -> None:
+        """
+        Replaces the indexed pairs of `filename` with `keys`, recording the file's current
+        mtime and size.
+        """
+        stat = os.stat(os.path.join(self.pairings_dirname, filename))
+        with self.conn:
+            self.conn.execute("DELETE FROM pairs WHERE file = ?", (filename,))
+            self.conn.executemany(
+                "INSERT INTO pairs (file, key) VALUES (?, ?)",
+                ((filename, key) for key in keys),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (name, mtime_ns, size) VALUES (?, ?, ?)",
+                (filename, stat.st_mtime_ns, stat.st_size),
+            )
+
+    def remove(self, filename: str) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM pairs WHERE file = ?", (filename,))
+            self.conn.execute("DELETE FROM files WHERE name = ?", (filename,))
+
+    def clear(self) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM pairs")
+            self.conn.execute("DELETE FROM files")
+
+    def registry_aliases(self) -> int:
+        """
+        How many aliases the ID registry had when the indexed keys were built. Names
+        merged since then may have had IDs of their own in the indexed keys.
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'registry_aliases'").fetchone()
+        return 0 if row is None else row[0]
+
+    def set_registry_aliases(self, aliases: int) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('registry_aliases', ?)", (aliases,)
+            )
+
+    def max_id(self) -> int:
+        # the larger ID of a pair is the key modulo the stride
+        (max_id,) = self.conn.execute("SELECT MAX(key % ?) FROM pairs", (KEY_STRIDE,)).fetchone()
+        return -1 if max_id is None else max_id
+
+    def occurrences(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Reads every indexed pair occurrence into arrays.
+        Returns:
+            filenames: List[str], the indexed files.
+            keys: np.ndarray[int64], the pair key of every occurrence.
+            files: np.ndarray[int32], the index in filenames of every occurrence's file.
+        """
+        filenames = [name for (name,) in self.conn.execute("SELECT name FROM files ORDER BY name")]
+        keys = []
+        files = []
+        for i, filename in enumerate(filenames):
+            file_keys = np.fromiter(
+                (key for (key,) in self.conn.execute("SELECT key FROM pairs WHERE file = ?", (filename,))),
+                dtype=np.int64,
+            )
+            keys.append(file_keys)
+            files.append(np.full(len(file_keys), i, dtype=np.int32))
+        if not filenames:
+            return filenames, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+        return filenames, np.concatenate(keys), np.concatenate(files)
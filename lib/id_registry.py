@@ -0,0 +1,454 @@
+import csv
+import hashlib
+import io
+import logging
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from name_index import (
+    DUPLICATES_SUFFIX,
+    DuplicateLog,
+    DuplicateName,
+    NameIndex,
+    DEFAULT_SIMILARITY,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"CCID"
+INDEX_VERSION = 3
+# magic, version, number of IDs and of rows (IDs and aliases) in the sorted table,
+# number of records appended after it, number of bytes of the CSV log covered by the
+# index, and of them, how many were checked for duplicate names
+INDEX_HEADER = struct.Struct("<4sIQQQQQ")
+# a row added since the sorted table was written: name hash, ID and byte offset
+DELTA_RECORD = np.dtype([("hash", "<u8"), ("id", "<i8"), ("offset", "<i8")])
+# the appended records are merged into the sorted table once they outnumber an eighth
+# of it, so every row is rewritten a bounded number of times on average
+MIN_DELTA_RECORDS = 1024
+DELTA_FRACTION = 8
+
+
+def _format_row(name: str, num_id: int) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow([name, num_id])
+    return buffer.getvalue().encode("utf-8")
+
+
+def name_hash(name: str) -> int:
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class IdRegistry:
+    """
+    Append-only registry of participant IDs.
+
+    ids/ids.csv stays the source of truth as a log of "name,id" rows that only ever
+    grows. A row with an ID that was already given out is an alias, e.g. another
+    spelling merged into that person, and a name's latest row wins. Next to it,
+    ids/ids.csv.idx holds a sorted table of name hashes with the ID and byte offset of
+    every row, and the offset of every ID's first row, so lookups are binary searches
+    over memory-mapped arrays instead of parsing the whole CSV. Rows registered since
+    the table was written are appended to the index as fixed-width records and kept in
+    a small sorted delta that is searched alongside it, so registering names costs
+    O(new names) until the delta is merged into the table.
+
+    New names that look like a registered one are flagged as they're registered, and
+    logged in ids/ids.csv.dupes along with whether they were merged or kept apart. The
+    trigram index for this is built from the log when a check needs it.
+    """
+
+    def __init__(self, ids_filename: str):
+        self.ids_filename = ids_filename
+        self.index_filename = ids_filename + INDEX_SUFFIX
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.hash_ids = np.zeros(0, dtype=np.int64)
+        self.hash_offsets = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(0, dtype=np.int64)
+        # rows after the sorted table, in log order and sorted by hash
+        self.delta = np.zeros(0, dtype=DELTA_RECORD)
+        self._delta_sorted = self.delta
+        # first-row offsets of the IDs given out after the sorted table
+        self._new_offsets: List[int] = []
+        self.covered = 0
+        self.checked = 0
+        self._log: Optional[mmap.mmap] = None
+        self._names: Optional[NameIndex] = None
+        self._duplicates: Optional[DuplicateLog] = None
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self.offsets) + len(self._new_offsets)
+
+    @property
+    def aliases(self) -> int:
+        return len(self.hashes) + len(self.delta) - len(self)
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def lookup(self, name: str) -> Optional[int]:
+        h = name_hash(name)
+        # the delta's rows come after the table's, so a match there is the latest
+        found = self._search(
+            self._delta_sorted["hash"], self._delta_sorted["id"], self._delta_sorted["offset"], h, name
+        )
+        if found is None:
+            found = self._search(self.hashes, self.hash_ids, self.hash_offsets, h, name)
+        return found
+
+    def name_of(self, num_id: int) -> str:
+        if num_id < len(self.offsets):
+            return self._read_row(int(self.offsets[num_id]))[0]
+        return self._read_row(self._new_offsets[num_id - len(self.offsets)])[0]
+
+    def names_of(self, ids: Sequence[int]) -> List[str]:
+        return [self.name_of(num_id) for num_id in ids]
+
+    def reverse(self) -> List[str]:
+        """
+        Returns the id -> name array for every registered ID.
+        """
+        return self.names_of(range(len(self)))
+
+    def register(self, names: Sequence[str]) -> Dict[str, int]:
+        """
+        Looks up the IDs of `names`, appending new ones to the log in a single write.
+        Returns:
+            names_to_ids: Dict[str, int], the ID of every name in `names`.
+        """
+        names_to_ids = {}
+        new_names = []
+        for name in names:
+            if name in names_to_ids:
+                continue
+            num_id = self.lookup(name)
+            if num_id is None:
+                num_id = len(self) + len(new_names)
+                logger.debug(f"New participant, adding name-ID pair {name}: {num_id}")
+                new_names.append(name)
+            names_to_ids[name] = num_id
+        if new_names:
+            duplicates = self.find_duplicates(new_names)
+            self._append([(name, names_to_ids[name]) for name in new_names])
+            self._flag(duplicates)
+        return names_to_ids
+
+    def find_duplicates(
+        self,
+        names: Sequence[str],
+        threshold: float = DEFAULT_SIMILARITY,
+    ) -> List[DuplicateName]:
+        """
+        Flags the names that aren't registered yet but look like a registered name, or
+        like a new name before them, without registering anything.
+        """
+        unknown = [name for name in dict.fromkeys(names) if self.lookup(name) is None]
+        if not unknown:
+            return []
+        index = self._name_index()
+        new_index = NameIndex()
+        duplicates = []
+        for name in unknown:
+            matches = index.similar(name, threshold) + new_index.similar(name, threshold)
+            if matches:
+                existing, similarity = max(matches, key=lambda match: match[1])
+                duplicates.append(DuplicateName(name, existing, similarity))
+            new_index.add(name)
+        return duplicates
+
+    def pending_duplicates(self) -> List[DuplicateName]:
+        """
+        Returns the flagged pairs of registered names that were neither merged nor
+        kept apart yet.
+        """
+        if self.checked < self.covered:
+            # rows that reached the log some other way are checked once
+            self._name_index()
+        return [
+            duplicate
+            for duplicate in self._duplicate_log().pending()
+            if self.lookup(duplicate.name) != self.lookup(duplicate.existing)
+        ]
+
+    def merge(self, duplicate: DuplicateName) -> int:
+        """
+        Makes duplicate.name an alias of duplicate.existing's ID, for good. Returns the ID.
+        """
+        num_id = self.register([duplicate.existing])[duplicate.existing]
+        if self.lookup(duplicate.name) != num_id:
+            self._append([(duplicate.name, num_id)])
+        self._duplicate_log().decide(duplicate, merged=True)
+        return num_id
+
+    def keep_apart(self, duplicate: DuplicateName) -> None:
+        """
+        Records that duplicate.name and duplicate.existing are different people, so
+        they aren't flagged again.
+        """
+        self._duplicate_log().decide(duplicate, merged=False)
+
+    def _search(
+        self,
+        hashes: np.ndarray,
+        hash_ids: np.ndarray,
+        hash_offsets: np.ndarray,
+        h: int,
+        name: str,
+    ) -> Optional[int]:
+        h = np.uint64(h)
+        i = int(np.searchsorted(hashes, h))
+        found = None
+        # rows of the same hash are in log order, so the last match is the latest row
+        while i < len(hashes) and hashes[i] == h:
+            if self._read_row(int(hash_offsets[i]))[0] == name:
+                found = int(hash_ids[i])
+            i += 1
+        return found
+
+    def _flag(self, duplicates: List[DuplicateName]) -> None:
+        flagged = self._duplicate_log().flag(duplicates)
+        for duplicate in flagged:
+            logger.warning(
+                f'Registered "{duplicate.name}", which looks like "{duplicate.existing}" '
+                f"({100 * duplicate.similarity:.0f}% similar)"
+            )
+
+    def _duplicate_log(self) -> DuplicateLog:
+        if self._duplicates is None:
+            self._duplicates = DuplicateLog(self.ids_filename + DUPLICATES_SUFFIX)
+        return self._duplicates
+
+    def _name_index(self) -> NameIndex:
+        """
+        Builds the trigram index of every registered name from the log. Rows that
+        weren't checked for duplicates yet, e.g. added by hand or from before the
+        check existed, are checked against the names before them on the way.
+        """
+        if self._names is not None:
+            return self._names
+        index = NameIndex()
+        duplicates = []
+        rows = self._read_rows(0, self.covered)
+        if self.checked < self.covered:
+            logger.info(f"Checking {sum(offset >= self.checked for offset, _, _ in rows)} registered names for duplicates")
+        for offset, name, num_id in rows:
+            if offset >= self.checked:
+                matches = [match for match in index.similar(name) if self.lookup(match[0]) != num_id]
+                if matches:
+                    duplicates.append(DuplicateName(name, *matches[0]))
+            index.add(name)
+        self._names = index
+        if self.checked < self.covered:
+            self.checked = self.covered
+            self._write_header()
+            self._flag(duplicates)
+        return index
+
+    def _append(self, rows_to_add: List[Tuple[str, int]]) -> None:
+        rows = [_format_row(name, num_id) for name, num_id in rows_to_add]
+        if self._log is not None and self._log[-1:] != b"\n":
+            # a hand-edited log may be missing its final line break
+            rows[0] = b"\r\n" + rows[0]
+        row_offsets = (self.covered + np.cumsum([0] + [len(row) for row in rows[:-1]])).tolist()
+        if self._log is not None and rows[0].startswith(b"\r\n"):
+            row_offsets[0] += 2
+        data = b"".join(rows)
+
+        # one O_APPEND write, so a crash can't leave half of a batch in the log
+        fd = os.open(self.ids_filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        # the registry checks names before appending them
+        checked = self.checked == self.covered
+        self._add_rows(rows_to_add, row_offsets)
+        self.covered += len(data)
+        if checked:
+            self.checked = self.covered
+        self._save_rows()
+        self._map_log()
+        if self._names is not None:
+            for name, _ in rows_to_add:
+                self._names.add(name)
+
+    def _add_rows(self, rows: List[Tuple[str, int]], row_offsets: List[int]) -> None:
+        records = np.zeros(len(rows), dtype=DELTA_RECORD)
+        records["hash"] = [name_hash(name) for name, _ in rows]
+        records["id"] = [num_id for _, num_id in rows]
+        records["offset"] = row_offsets
+        # an ID's first row holds its name, later rows are aliases
+        for num_id, offset in zip(records["id"].tolist(), row_offsets):
+            if num_id >= len(self):
+                self._new_offsets.append(offset)
+        self.delta = np.concatenate([self.delta, records])
+        records = records[np.argsort(records["hash"], kind="stable")]
+        positions = np.searchsorted(self._delta_sorted["hash"], records["hash"], side="right")
+        self._delta_sorted = np.insert(self._delta_sorted, positions, records)
+
+    def _save_rows(self) -> None:
+        """
+        Appends the delta's unsaved records to the index, or merges the delta into the
+        sorted table once it's grown too big.
+        """
+        if len(self.delta) > max(MIN_DELTA_RECORDS, len(self.hashes) // DELTA_FRACTION):
+            self._merge_delta()
+            self._write_index()
+            return
+        with open(self.index_filename, "r+b") as f:
+            _, _, _, _, saved, _, _ = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            f.seek(self._delta_start() + saved * DELTA_RECORD.itemsize)
+            f.write(self.delta[saved:].tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        # the records are in place before the header counts them
+        self._write_header()
+
+    def _merge_delta(self) -> None:
+        hashes = np.concatenate([self.hashes, self.delta["hash"]])
+        order = np.argsort(hashes, kind="stable")
+        self.hashes = hashes[order]
+        self.hash_ids = np.concatenate([self.hash_ids, self.delta["id"]])[order]
+        self.hash_offsets = np.concatenate([self.hash_offsets, self.delta["offset"]])[order]
+        self.offsets = np.concatenate([self.offsets, np.array(self._new_offsets, dtype=np.int64)])
+        self._new_offsets = []
+        self.delta = np.zeros(0, dtype=DELTA_RECORD)
+        self._delta_sorted = self.delta
+
+    def _open(self) -> None:
+        log_size = os.path.getsize(self.ids_filename) if os.path.exists(self.ids_filename) else 0
+        mapped = False
+        if os.path.exists(self.index_filename):
+            with open(self.index_filename, "rb") as f:
+                header = f.read(INDEX_HEADER.size)
+            if len(header) == INDEX_HEADER.size:
+                magic, version, count, entries, delta, covered, checked = INDEX_HEADER.unpack(header)
+                if magic == INDEX_MAGIC and version == INDEX_VERSION and covered <= log_size:
+                    mapped = self._map_index(count, entries, delta, covered, checked)
+        if not mapped:
+            self._write_index()
+        if self.covered < log_size:
+            # rows were added by something other than the registry, index just those
+            logger.info(f"Indexing {self.ids_filename} from byte {self.covered}")
+            self._scan_log(log_size)
+            self._save_rows()
+        self._map_log()
+
+    def _map_index(self, count: int, entries: int, delta: int, covered: int, checked: int) -> bool:
+        table_offset = INDEX_HEADER.size
+        delta_start = table_offset + 24 * entries + 8 * count
+        if os.path.getsize(self.index_filename) < delta_start + delta * DELTA_RECORD.itemsize:
+            return False
+        self.hashes = np.memmap(
+            self.index_filename, dtype=np.uint64, mode="r", offset=table_offset, shape=(entries,)
+        ) if entries else np.zeros(0, dtype=np.uint64)
+        table_offset += 8 * entries
+        self.hash_ids = np.memmap(
+            self.index_filename, dtype=np.int64, mode="r", offset=table_offset, shape=(entries,)
+        ) if entries else np.zeros(0, dtype=np.int64)
+        table_offset += 8 * entries
+        self.hash_offsets = np.memmap(
+            self.index_filename, dtype=np.int64, mode="r", offset=table_offset, shape=(entries,)
+        ) if entries else np.zeros(0, dtype=np.int64)
+        table_offset += 8 * entries
+        self.offsets = np.memmap(
+            self.index_filename, dtype=np.int64, mode="r", offset=table_offset, shape=(count,)
+        ) if count else np.zeros(0, dtype=np.int64)
+        self.delta = np.fromfile(self.index_filename, dtype=DELTA_RECORD, count=delta, offset=delta_start)
+        self._delta_sorted = self.delta[np.argsort(self.delta["hash"], kind="stable")]
+        # a new ID's first row holds its name, later rows in the delta are aliases
+        new = self.delta[self.delta["id"] >= count]
+        _, first = np.unique(new["id"], return_index=True)
+        self._new_offsets = new["offset"][first].tolist()
+        self.covered = covered
+        self.checked = checked
+        return True
+
+    def _scan_log(self, log_size: int) -> None:
+        rows = []
+        row_offsets = []
+        next_id = len(self)
+        for offset, name, num_id in self._read_rows(self.covered, log_size):
+            # an ID given out before is an alias
+            if num_id > next_id:
+                raise RuntimeError(
+                    f"{self.ids_filename} has ID {num_id} for {name}, expected at most {next_id}"
+                )
+            next_id += num_id == next_id
+            rows.append((name, num_id))
+            row_offsets.append(offset)
+        self._add_rows(rows, row_offsets)
+        self.covered = log_size
+
+    def _read_rows(self, start: int, stop: int) -> List[Tuple[int, str, int]]:
+        """
+        Parses the log's rows between two byte offsets, as (offset, name, ID).
+        """
+        rows = []
+        if start >= stop:
+            # e.g. a fresh registry, whose log doesn't exist yet
+            return rows
+        with open(self.ids_filename, "rb") as f:
+            f.seek(start)
+            offset = start
+            while offset < stop:
+                line = f.readline()
+                if not line:
+                    break
+                row = next(csv.reader([line.decode("utf-8")]), None)
+                if row:
+                    name, num_id = row
+                    rows.append((offset, name, int(num_id)))
+                offset += len(line)
+        return rows
+
+    def _delta_start(self) -> int:
+        return INDEX_HEADER.size + 24 * len(self.hashes) + 8 * len(self.offsets)
+
+    def _header(self) -> bytes:
+        return INDEX_HEADER.pack(
+            INDEX_MAGIC,
+            INDEX_VERSION,
+            len(self.offsets),
+            len(self.hashes),
+            len(self.delta),
+            self.covered,
+            self.checked,
+        )
+
+    def _write_header(self) -> None:
+        with open(self.index_filename, "r+b") as f:
+            f.write(self._header())
+
+    def _write_index(self) -> None:
+        tmp_filename = self.index_filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            f.write(self._header())
+            f.write(np.ascontiguousarray(self.hashes, dtype=np.uint64).tobytes())
+            f.write(np.ascontiguousarray(self.hash_ids, dtype=np.int64).tobytes())
+            f.write(np.ascontiguousarray(self.hash_offsets, dtype=np.int64).tobytes())
+            f.write(np.ascontiguousarray(self.offsets, dtype=np.int64).tobytes())
+            f.write(self.delta.tobytes())
+        os.replace(tmp_filename, self.index_filename)
+
+    def _map_log(self) -> None:
+        self.close()
+        if os.path.exists(self.ids_filename) and os.path.getsize(self.ids_filename) > 0:
+            with open(self.ids_filename, "rb") as f:
+                self._log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_row(self, offset: int) -> List[str]:
+        end = self._log.find(b"\n", offset)
+        line = self._log[offset : end if end != -1 else len(self._log)]
+        return next(csv.reader([line.decode("utf-8")]))
@@ -0,0 +1,319 @@
+import logging
+import random
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# called with a stage name and the fraction of participants matched so far
+ProgressCallback = Callable[[str, float], None]
+# how many greedy steps to take between progress reports
+PROGRESS_INTERVAL = 4096
+
+
+class MatchingCancelled(Exception):
+    """
+    Raised from a progress callback to abandon a solve.
+    """
+
+
+class ComplementMatcher:
+    """
+    Maximum-cardinality matching on the complement of a "forbidden" graph.
+
+    Participants are the local indices 0..n-1. Only the forbidden edges (constraints
+    and pairing history) are stored; every other pair is implicitly allowed. This keeps
+    memory proportional to the history instead of O(n^2), and lets us match large
+    rosters with a randomized greedy pass followed by augmenting-path repair.
+    """
+
+    def __init__(
+        self,
+        n: int,
+        forbidden: Optional[Sequence[Set[int]]] = None,
+        progress: Optional[ProgressCallback] = None,
+    ):
+        self.n = n
+        self.forbidden: List[Set[int]] = (
+            list(forbidden) if forbidden is not None else [set() for _ in range(n)]
+        )
+        self.mate: List[int] = [-1] * n
+        self.progress = progress
+        self.matched = 0
+
+    def allowed(self, u: int, v: int) -> bool:
+        return u != v and v not in self.forbidden[u]
+
+    def pairs(self) -> List[Tuple[int, int]]:
+        return [(v, u) for v, u in enumerate(self.mate) if v < u]
+
+    def free_vertices(self) -> List[int]:
+        return [v for v, u in enumerate(self.mate) if u == -1]
+
+    def report(self, stage: str) -> None:
+        if self.progress is not None:
+            self.progress(stage, self.matched / self.n if self.n else 1.0)
+
+    def seed(self, pairs: Iterable[Tuple[int, int]]) -> int:
+        """
+        Starts from an existing partial matching, skipping pairs that are forbidden or
+        that reuse an already matched vertex. Returns the number of pairs kept.
+        """
+        kept = 0
+        for u, v in pairs:
+            if self.mate[u] == -1 and self.mate[v] == -1 and self.allowed(u, v):
+                self.mate[u] = v
+                self.mate[v] = u
+                kept += 1
+        self.matched += 2 * kept
+        return kept
+
+    def greedy(self, rng: random.Random) -> None:
+        """
+        Randomized greedy matching over the still-free vertices. Each vertex scans the
+        shuffled pool from the back, so the cost is O(n + |forbidden|).
+        """
+        pool = self.free_vertices()
+        rng.shuffle(pool)
+        steps = 0
+        while len(pool) >= 2:
+            steps += 1
+            if steps % PROGRESS_INTERVAL == 0:
+                self.report("greedy")
+            v = pool.pop()
+            forbidden_v = self.forbidden[v]
+            for i in range(len(pool) - 1, -1, -1):
+                u = pool[i]
+                if u not in forbidden_v:
+                    pool[i] = pool[-1]
+                    pool.pop()
+                    self.mate[v] = u
+                    self.mate[u] = v
+                    self.matched += 2
+                    break
+
+    def augment(self, root: int) -> bool:
+        """
+        Looks for an augmenting path starting at the free vertex `root` and flips it.
+        Tries a cheap alternating BFS first, and falls back to Edmonds' blossom search.
+        """
+        end, parent = self._find_path_simple(root)
+        if end == -1:
+            end, parent = self._find_path_blossom(root)
+        if end == -1:
+            return False
+
+        v = end
+        while v != -1:
+            pv = parent[v]
+            ppv = self.mate[pv]
+            self.mate[v] = pv
+            self.mate[pv] = v
+            v = ppv
+        self.matched += 2
+        return True
+
+    def maximize(self, rng: Optional[random.Random] = None) -> int:
+        """
+        Repairs the current matching into a maximum-cardinality one. A free vertex with
+        no augmenting path stays unmatchable after later augmentations, so each free
+        vertex is searched from at most once. Returns the number of augmentations.
+        """
+        free = self.free_vertices()
+        if rng is not None:
+            rng.shuffle(free)
+        augmentations = 0
+        while len(free) >= 2:
+            root = free.pop()
+            if self.mate[root] != -1:
+                continue
+            self.report("augment")
+            if self.augment(root):
+                augmentations += 1
+                free = [v for v in free if self.mate[v] == -1]
+        return augmentations
+
+    def solve(self, rng: Optional[random.Random] = None) -> List[Tuple[int, int]]:
+        rng = rng or random.Random()
+        self.report("greedy")
+        self.greedy(rng)
+        augmentations = self.maximize(rng)
+        self.report("done")
+        logger.debug(
+            f"Matched {2 * len(self.pairs())}/{self.n} vertices "
+            f"({augmentations} augmenting paths)"
+        )
+        return self.pairs()
+
+    def _find_path_simple(self, root: int) -> Tuple[int, List[int]]:
+        # alternating BFS without blossom shrinking. Each unlabeled vertex is removed
+        # from the candidate set once, so a search costs O(n + |forbidden|).
+        mate = self.mate
+        parent = [-1] * self.n
+        unlabeled = set(range(self.n))
+        unlabeled.discard(root)
+        queue = deque([root])
+        while queue:
+            v = queue.popleft()
+            forbidden_v = self.forbidden[v]
+            labeled = [u for u in unlabeled if u not in forbidden_v]
+            for u in labeled:
+                unlabeled.discard(u)
+                parent[u] = v
+                if mate[u] == -1:
+                    return u, parent
+            for u in labeled:
+                if mate[u] in unlabeled:
+                    unlabeled.discard(mate[u])
+                    queue.append(mate[u])
+        return -1, parent
+
+    def decomposition(self) -> Tuple[List[int], List[int]]:
+        """
+        Gallai-Edmonds decomposition of the allowed graph, given that the current
+        matching is maximum (i.e. after maximize).
+        Returns:
+            d: List[int], vertices left free by some maximum matching. These are the
+                ones reachable from a free vertex by an even alternating path.
+            a: List[int], vertices outside d with an allowed partner in d. Every maximum
+                matching pairs each of them with someone in d.
+        """
+        even = [False] * self.n
+        for root in self.free_vertices():
+            if even[root]:
+                continue
+            _, _, outer = self._blossom_search(root)
+            for v in range(self.n):
+                even[v] = even[v] or outer[v]
+        d = [v for v in range(self.n) if even[v]]
+        # v has a partner in d unless d is just v itself plus v's forbidden partners
+        a = [
+            v
+            for v in range(self.n)
+            if not even[v] and len(d) > sum(even[u] for u in self.forbidden[v])
+        ]
+        return d, a
+
+    def even_vertices(self, root: int) -> List[int]:
+        """
+        Returns the vertices reachable from the free vertex `root` by an even
+        alternating path, given that the current matching is maximum.
+        """
+        _, _, outer = self._blossom_search(root)
+        return [v for v in range(self.n) if outer[v]]
+
+    def components(self, vertices: Sequence[int]) -> Dict[int, int]:
+        """
+        Labels the connected components of the allowed graph induced on `vertices`.
+        Each vertex is taken off the unvisited set once, so this costs
+        O(len(vertices) + |forbidden|).
+        """
+        unvisited = set(vertices)
+        component: Dict[int, int] = {}
+        label = 0
+        while unvisited:
+            start = unvisited.pop()
+            component[start] = label
+            queue = deque([start])
+            while queue:
+                v = queue.popleft()
+                forbidden_v = self.forbidden[v]
+                reached = [u for u in unvisited if u not in forbidden_v]
+                for u in reached:
+                    unvisited.discard(u)
+                    component[u] = label
+                    queue.append(u)
+            label += 1
+        return component
+
+    def _find_path_blossom(self, root: int) -> Tuple[int, List[int]]:
+        end, parent, _ = self._blossom_search(root)
+        return end, parent
+
+    def _blossom_search(self, root: int) -> Tuple[int, List[int], List[bool]]:
+        # Edmonds' blossom search over the implicit complement graph, O(n^2) per root.
+        # Without an augmenting path, `used` ends up marking every vertex reachable from
+        # root by an even alternating path.
+        n = self.n
+        mate = self.mate
+        parent = [-1] * n
+        base = list(range(n))
+        used = [False] * n
+        used[root] = True
+        queue = deque([root])
+
+        def lca(a: int, b: int) -> int:
+            seen = [False] * n
+            while True:
+                a = base[a]
+                seen[a] = True
+                if mate[a] == -1:
+                    break
+                a = parent[mate[a]]
+            while True:
+                b = base[b]
+                if seen[b]:
+                    return b
+                b = parent[mate[b]]
+
+        def mark_path(v: int, b: int, child: int, blossom: List[bool]) -> None:
+            while base[v] != b:
+                blossom[base[v]] = True
+                blossom[base[mate[v]]] = True
+                parent[v] = child
+                child = mate[v]
+                v = parent[mate[v]]
+
+        while queue:
+            v = queue.popleft()
+            forbidden_v = self.forbidden[v]
+            for u in range(n):
+                if u == v or u in forbidden_v:
+                    continue
+                if base[v] == base[u] or mate[v] == u:
+                    continue
+                if u == root or (mate[u] != -1 and parent[mate[u]] != -1):
+                    cur_base = lca(v, u)
+                    blossom = [False] * n
+                    mark_path(v, cur_base, u, blossom)
+                    mark_path(u, cur_base, v, blossom)
+                    for i in range(n):
+                        if blossom[base[i]]:
+                            base[i] = cur_base
+                            if not used[i]:
+                                used[i] = True
+                                queue.append(i)
+                elif parent[u] == -1:
+                    parent[u] = v
+                    if mate[u] == -1:
+                        return u, parent, used
+                    used[mate[u]] = True
+                    queue.append(mate[u])
+        return -1, parent, used
+
+
+def build_forbidden(
+    ids: Sequence[int],
+    constraints: Optional[Iterable[Tuple[int, int]]],
+) -> Tuple[Dict[int, int], List[Set[int]]]:
+    """
+    Maps participant IDs to local indices and builds the forbidden adjacency, dropping
+    constraints that involve someone who isn't participating.
+    """
+    # mapping the pairs needs numpy, which is slow to import, only pay for it once solving
+    from weights import constraint_positions
+
+    ids = list(ids)
+    rows, cols = constraint_positions(ids, constraints)
+    return {idx: i for i, idx in enumerate(ids)}, forbidden_sets(len(ids), rows.tolist(), cols.tolist())
+
+
+def forbidden_sets(n: int, rows: Iterable[int], cols: Iterable[int]) -> List[Set[int]]:
+    """
+    Builds the forbidden adjacency of n vertices from forbidden pairs of local indices.
+    """
+    forbidden: List[Set[int]] = [set() for _ in range(n)]
+    for u, v in zip(rows, cols):
+        forbidden[u].add(v)
+        forbidden[v].add(u)
+    return forbidden
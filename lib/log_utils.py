@@ -0,0 +1,33 @@
+import datetime
+import logging
+import os
+import sys
+
+LOGS_LOCATION = "logs"
+
+log_file = os.path.join(LOGS_LOCATION, f"coffee-chat-debug-logs-{datetime.datetime.now()}.txt")
+
+
+def init_logging(verbose=False) -> None:
+    root_logger = logging.getLogger()
+        
+    if getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS"):
+        if not os.path.exists(LOGS_LOCATION):
+            os.mkdir(LOGS_LOCATION)
+        log_handler = logging.FileHandler(log_file)
+    else:
+        log_handler = logging.StreamHandler(sys.stderr)
+
+    log_handler.setFormatter(
+        logging.Formatter(
+            "[%(asctime)0s.%(msecs)03d %(filename)s:%(lineno)s] %(levelname)s: %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+    )
+
+    root_logger.addHandler(log_handler)
+    if verbose:
+        root_logger.setLevel(logging.DEBUG)
+        root_logger.debug("Verbose logging enabled")
+    else:
+        root_logger.setLevel(logging.INFO)
@@ -0,0 +1,174 @@
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from implicit_matching import ComplementMatcher, forbidden_sets
+from weights import constraint_positions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HORIZON = 3
+DEFAULT_CANDIDATES = 16
+DEFAULT_TIME_BUDGET = 10.0
+# simulated futures per surviving candidate in the first round, doubled every round
+FIRST_ROUND_ROLLOUTS = 2
+MAX_ROUNDS = 5
+
+
+def _rollout(
+    n: int,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    candidate: List[Tuple[int, int]],
+    horizon: int,
+    seed: int,
+) -> Tuple[int, int, int]:
+    """
+    Simulates `horizon` months after the candidate matching, each a random maximum
+    matching that repeats no pair.
+    Returns:
+        months: int, how many of those months everyone could be paired.
+        left_out: int, people left out over all the months, beyond an odd roster's one.
+        slack: int, the fewest fresh partners anyone has left at the end.
+    """
+    rng = random.Random(seed)
+    forbidden = forbidden_sets(n, rows.tolist(), cols.tolist())
+    for u, v in candidate:
+        forbidden[u].add(v)
+        forbidden[v].add(u)
+    months = 0
+    left_out = 0
+    feasible = True
+    for _ in range(horizon):
+        matcher = ComplementMatcher(n, forbidden)
+        pairs = matcher.solve(rng)
+        missing = n - 2 * len(pairs) - n % 2
+        left_out += missing
+        feasible = feasible and missing == 0
+        months += feasible
+        for u, v in pairs:
+            forbidden[u].add(v)
+            forbidden[v].add(u)
+    slack = min((n - 1 - len(partners) for partners in forbidden), default=0)
+    return months, left_out, slack
+
+
+def lookahead_matchmake(
+    ids: List[int],
+    constraints: Optional[Sequence[Tuple[int, int]]],
+    horizon: int = DEFAULT_HORIZON,
+    candidates: int = DEFAULT_CANDIDATES,
+    time_budget: float = DEFAULT_TIME_BUDGET,
+    seed: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> List[Tuple[int, int]]:
+    """
+    Picks, among several maximum matchings, the one that keeps the community matchable
+    longest. Every candidate is scored by simulated future months (how many of them
+    pair everyone, how many people they leave out, and how many fresh partners the
+    most constrained person has left), in worker processes. Candidates are pruned by
+    successive halving: each round the better half gets twice the simulations.
+    Inputs:
+        ids: List[int], the IDs of this round's participants.
+        constraints: Optional[Sequence[Tuple[int, int]]], ID pairs that must not be matched.
+        horizon: int, how many future months to simulate after this one.
+        candidates: int, how many maximum matchings to choose from.
+        time_budget: float, seconds after which the best candidate so far is returned.
+        seed: Optional[int], seed for the candidates and the simulations.
+        max_workers: Optional[int], processes to simulate in (default: one per CPU).
+    Returns:
+        matches: List[Tuple[int, int]], the chosen matched ID pairs.
+    """
+    deadline = time.perf_counter() + time_budget
+    rng = random.Random(seed)
+    ids = list(dict.fromkeys(ids))
+    n = len(ids)
+    rows, cols = constraint_positions(ids, constraints)
+    forbidden = forbidden_sets(n, rows.tolist(), cols.tolist())
+
+    # the candidates are distinct maximum matchings, so they all pair as many people
+    pool: List[List[Tuple[int, int]]] = []
+    seen = set()
+    for _ in range(max(candidates, 1)):
+        if pool and time.perf_counter() >= deadline:
+            logger.info(f"The lookahead ran out of time after solving {len(pool)} candidate matchings")
+            break
+        pairs = ComplementMatcher(n, forbidden).solve(rng)
+        matching = frozenset(pairs)
+        if matching not in seen:
+            seen.add(matching)
+            pool.append(pairs)
+    if len(pool) == 1 or horizon <= 0 or time.perf_counter() >= deadline:
+        return [(ids[u], ids[v]) for u, v in pool[0]]
+
+    # multiprocessing is slow to import, only pay for it when looking ahead
+    import multiprocessing
+    import queue
+
+    totals: Dict[int, np.ndarray] = {i: np.zeros(3) for i in range(len(pool))}
+    runs: Dict[int, int] = {i: 0 for i in range(len(pool))}
+    alive = list(range(len(pool)))
+    rollouts = FIRST_ROUND_ROLLOUTS
+    # (candidate, result) of every finished rollout, or (None, error) of a failed one
+    results: "queue.Queue[Tuple[Optional[int], object]]" = queue.Queue()
+    # unlike an executor, a Pool can stop the rollouts still running once time is up
+    workers = multiprocessing.Pool(processes=max_workers)
+    try:
+        for round_number in range(MAX_ROUNDS):
+            pending = 0
+            for i in alive:
+                for _ in range(rollouts):
+                    workers.apply_async(
+                        _rollout,
+                        (n, rows, cols, pool[i], horizon, rng.getrandbits(32)),
+                        callback=lambda result, i=i: results.put((i, result)),
+                        error_callback=lambda error: results.put((None, error)),
+                    )
+                    pending += 1
+            out_of_time = False
+            while pending:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining <= 0:
+                        raise queue.Empty
+                    i, result = results.get(timeout=remaining)
+                except queue.Empty:
+                    out_of_time = True
+                    break
+                pending -= 1
+                if i is None:
+                    raise result
+                months, left_out, slack = result
+                totals[i] += (months, -left_out, slack)
+                runs[i] += 1
+
+            scored = [i for i in alive if runs[i]]
+            if not scored:
+                break
+            alive = sorted(scored, key=lambda i: tuple(totals[i] / runs[i]), reverse=True)
+            logger.debug(
+                f"Lookahead round {round_number + 1}: best of {len(scored)} candidates averages "
+                f"{totals[alive[0]] / runs[alive[0]]} (feasible months, -left out, slack)"
+            )
+            if out_of_time or len(alive) == 1:
+                break
+            alive = alive[: max(len(alive) // 2, 1)]
+            rollouts *= 2
+    finally:
+        workers.terminate()
+        workers.join()
+
+    best = alive[0]
+    if runs[best]:
+        months, left_out, slack = totals[best] / runs[best]
+        logger.info(
+            f"Chose 1 of {len(pool)} matchings by looking {horizon} months ahead: everyone "
+            f"pairable for {months:.1f} months on average, {abs(left_out):.1f} people left out, "
+            f"slack {slack:.1f} ({sum(runs.values())} simulations)"
+        )
+    else:
+        logger.warning("The lookahead ran out of time before simulating any future, using the first matching")
+    return [(ids[u], ids[v]) for u, v in pool[best]]
@@ -1,44 +1,128 @@
 import logging
 import argparse
+import itertools
 import os
+from typing import List, Optional, Sequence, Tuple
 
-from core import init_logging, CoffeeChatCore
+from affinity import AffinityRule, parse_rule
+from core import CoffeeChatCore
+from log_utils import init_logging
+from name_index import DuplicateName
 
 
 logger = logging.getLogger(__name__)
 
 
-def main(participants_filename: str, results_filename: str):
+def main(
+    participants_filename: str,
+    results_filename: str,
+    schedule_months: int = 0,
+    check_only: bool = False,
+    amend: bool = False,
+    group_size: int = 2,
+    recency_half_life: Optional[float] = None,
+    profile_filename: Optional[str] = None,
+    metrics_filename: Optional[str] = None,
+    affinity_rules: Sequence[AffinityRule] = (),
+    shard_key: Optional[str] = None,
+    shard_workers: Optional[int] = None,
+    cache_solves: bool = True,
+    lookahead_months: Optional[int] = None,
+    lookahead_budget: Optional[float] = None,
+    merge_duplicates: bool = False,
+):
     core = CoffeeChatCore(
         participants_filename=participants_filename,
         results_filename=results_filename,
     )
+    core.recency_half_life = recency_half_life
+    core.group_size = group_size
+    core.profile_filename = profile_filename
+    core.affinity_rules = list(affinity_rules)
+    core.shard_key = shard_key
+    core.shard_workers = shard_workers
+    core.cache_solves = cache_solves
+    core.lookahead_months = lookahead_months
+    if lookahead_budget is not None:
+        core.lookahead_budget = lookahead_budget
+    core.confirm_merge = (lambda duplicate: True) if merge_duplicates else confirm_merge
+    try:
+        run(core, schedule_months, check_only, amend)
+    finally:
+        if profile_filename is not None:
+            logger.info(core.metrics.summary())
+        if metrics_filename is not None:
+            core.metrics.dump(metrics_filename)
+            logger.info(f"Saved stage metrics to {metrics_filename}")
+
+
+def run(
+    core: CoffeeChatCore,
+    schedule_months: int,
+    check_only: bool = False,
+    amend: bool = False,
+):
     loaded_data = core.load_data()
 
     participant_names = loaded_data.participant_names
-    constraints_names = loaded_data.constraints_names
-
-    if len(participant_names) % 2 == 1:
-        skip_choice = None
-        logger.error("Odd number of participants this month! Who are we leaving out?")
-        while skip_choice not in list("EeMmQ"):
-            skip_choice = input(
-                "Press (E/e) for Eliette, (M/m) for Michael, Q to exit.\n"
-            )
+    constraints_ids = loaded_data.constraints_ids
+
+    if amend:
+        run_amend(core, participant_names)
+        return
+
+    if core.shard_key is not None:
+        if check_only or schedule_months > 0:
+            logger.error("--check and --schedule don't support --shard-by.")
+            return
+        # every restart is a new sharded solve, a global check or candidate pool would
+        # cost the whole-organization solve sharding avoids
+        run_matchmaking_loop(core, participant_names, constraints_ids)
+        return
+
+    if core.group_size == 2:
+        if len(participant_names) % 2 == 1:
+            logger.info("Odd number of participants this month, one of the chats will be a trio.")
+        # one analysis up front, instead of re-rolling matchings that can't pair everyone
+        report = core.check_feasibility(participant_names, constraints_ids)
+        if check_only or (not report.feasible and not confirm_left_out(report.left_out)):
+            return
+    elif check_only or schedule_months > 0:
+        logger.error("--check and --schedule only support pairs, not --group-size.")
+        return
+
+    if schedule_months > 0:
+        run_schedule(core, participant_names, constraints_ids, schedule_months)
+        return
+
+    if core.lookahead_months is not None:
+        # every restart looks ahead again, the pool's matchings don't
+        run_matchmaking_loop(core, participant_names, constraints_ids)
+        return
 
-        if skip_choice in "Ee":
-            participant_names.remove("Eliette Seo")
-        elif skip_choice in "Mm":
-            participant_names.remove("Michael Youn")
-        else:  # skip_choice was Q
-            logger.info("Quitting after not being able to agree on who to skip :(")
-            exit(0)
+    # restarts are served from a pool of matchings solved ahead of time
+    core.start_candidate_pool(participant_names, constraints_ids)
+    try:
+        run_matchmaking_loop(core, participant_names, constraints_ids)
+    finally:
+        core.close_candidate_pool()
 
+
+def run_matchmaking_loop(
+    core: CoffeeChatCore,
+    participant_names: List[str],
+    constraints_ids: List[Tuple[int, int]],
+):
+    first = True
     while not os.path.exists(core.results_filename):
-        pair_names = core.run_matchmaking(
-            participant_names=participant_names,
-            constraints_names=constraints_names,
-        )
+        # when profiling, the first solve runs in this process so that cProfile can see it
+        if core.candidate_pool is None or (first and core.profile_filename is not None):
+            # a restart asks for a different matching than the cached one
+            pair_names = core.run_matchmaking(participant_names, constraints_ids, use_cache=first)
+        else:
+            # a re-run with the same inputs gets its last result back, without a solve
+            pair_names = (core.cached_candidate() if first else None) or core.next_candidate()
+        first = False
         core.sanity_check_matches(
             pair_names,
             participant_names,
@@ -67,6 +151,75 @@ def main(participants_filename: str, results_filename: str):
             )
 
 
+def run_amend(core: CoffeeChatCore, participant_names: List[str]):
+    if not os.path.exists(core.results_filename):
+        logger.error(f"There are no pairings at {core.results_filename} to amend.")
+        return
+    previous_names = set(itertools.chain.from_iterable(core.read_results()))
+    removed_names = sorted(previous_names - set(participant_names))
+    added_names = [name for name in dict.fromkeys(participant_names) if name not in previous_names]
+    if not removed_names and not added_names:
+        logger.info(f"{core.results_filename} already pairs everyone in {core.participants_filename}.")
+        return
+    pair_names = core.amend(removed_names, added_names)
+    core.sanity_check_matches(pair_names, participant_names)
+    left_out = set(participant_names) - set(itertools.chain(*pair_names))
+    if left_out and not confirm_left_out(len(left_out)):
+        logger.info(f"Keeping the pairings at {core.results_filename} as they were.")
+        return
+    core.finalize_matches(pair_names)
+    logger.info(f"Amended pairings saved to {core.results_filename}")
+
+
+def confirm_left_out(left_out: int) -> bool:
+    choice = None
+    while choice not in list("CcQ"):
+        choice = input(
+            f"{left_out} people will be left unpaired. (C/c) to continue anyway, Q to exit.\n"
+        )
+    return choice in "Cc"
+
+
+def confirm_merge(duplicate: DuplicateName) -> bool:
+    choice = None
+    while choice not in list("YyNn"):
+        choice = input(
+            f'Is "{duplicate.name}" the same person as "{duplicate.existing}"? (Y/y) to merge them, (N/n) to keep both.\n'
+        )
+    return choice in "Yy"
+
+
+def run_schedule(
+    core: CoffeeChatCore,
+    participant_names: List[str],
+    constraints_ids: List[Tuple[int, int]],
+    months: int,
+):
+    results_filenames = core.schedule_filenames(months)
+    while not all(os.path.exists(filename) for filename in results_filenames):
+        schedule_names = core.run_schedule(
+            participant_names=participant_names,
+            constraints_ids=constraints_ids,
+            months=months,
+        )
+        core.sanity_check_schedule(schedule_names, participant_names)
+        core.finalize_schedule(schedule_names)
+
+        choice = None
+        while choice not in list("YyNnQ"):
+            choice = input(
+                f"Check over the files {results_filenames}. (Y/y) to finish, (N/n) to restart, Q to exit.\n"
+            )
+        if choice in "Nn" or choice == "Q":
+            logger.info(f"Deleting generated matches files {results_filenames}.")
+            for filename in results_filenames:
+                os.remove(filename)
+            if choice == "Q":
+                break
+        else:  # choice is Y or y
+            logger.info(f"Finished scheduling, results saved to {results_filenames}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the coffee matching app!")
     parser.add_argument(
@@ -77,8 +230,128 @@ if __name__ == "__main__":
         "results_filename",
         help="CSV file (filename only) to write the results to. Automatically saves to pairings/ folder.",
     )
+    parser.add_argument(
+        "--schedule",
+        type=int,
+        default=0,
+        metavar="MONTHS",
+        help="Precompute this many months of pairings at once, saved as <results>_1.csv, <results>_2.csv, ...",
+    )
+    parser.add_argument(
+        "--recency-half-life",
+        type=float,
+        default=None,
+        metavar="MONTHS",
+        help="Allow repeat pairings, preferring pairs that met longest ago. Constraints stay hard.",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="coffee-chat-solve.prof",
+        default=None,
+        metavar="PROF_FILE",
+        help="Log per-stage timings and save a cProfile capture of the solve (default coffee-chat-solve.prof).",
+    )
+    parser.add_argument(
+        "--metrics-out",
+        default=None,
+        metavar="JSON_FILE",
+        help="Save per-stage durations, counts and peak RSS as JSON.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only check whether everyone can be paired, suggesting past pairings to repeat if not.",
+    )
+    parser.add_argument(
+        "--amend",
+        action="store_true",
+        help="Update the existing results file to the participants file, re-pairing only the people affected by the changes.",
+    )
+    parser.add_argument(
+        "--group-size",
+        type=int,
+        default=2,
+        metavar="K",
+        help="Number of people per chat (default 2). Leftovers join the last chats, e.g. one trio for an odd roster.",
+    )
+    parser.add_argument(
+        "--prefer",
+        action="append",
+        default=[],
+        metavar="RELATION:COLUMN[=WEIGHT]",
+        help="Prefer pairs by a roster column, e.g. cross:team, same:office or near:seniority=300. Repeatable.",
+    )
+    parser.add_argument(
+        "--require",
+        action="append",
+        default=[],
+        metavar="RELATION:COLUMN",
+        help="Only pair people by a roster column, e.g. same:timezone. Repeatable.",
+    )
+    parser.add_argument(
+        "--shard-by",
+        default=None,
+        metavar="COLUMN",
+        help="Match everyone sharing a roster column value (e.g. office) on their own, in parallel, then pair up the leftovers.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes to solve shards in (default: one per CPU).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always solve from scratch, instead of reusing or repairing cached matchings of the same or similar inputs.",
+    )
+    parser.add_argument(
+        "--lookahead",
+        type=int,
+        default=None,
+        metavar="MONTHS",
+        help="Pick the matching that keeps everyone pairable longest, simulating this many months ahead.",
+    )
+    parser.add_argument(
+        "--lookahead-budget",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Time to spend looking ahead before taking the best matching so far (default 10).",
+    )
+    parser.add_argument(
+        "--merge-duplicates",
+        action="store_true",
+        help="Treat new roster names that look like a known name (e.g. different case or spacing) as that person, without asking.",
+    )
     parser.add_argument("-v", "--verbose", action="store_true")
     args = parser.parse_args()
+    if args.group_size < 2:
+        parser.error("--group-size must be at least 2")
+    try:
+        affinity_rules = [parse_rule(spec) for spec in args.prefer] + [
+            parse_rule(spec, hard=True) for spec in args.require
+        ]
+    except ValueError as e:
+        parser.error(str(e))
 
     init_logging(args.verbose)
-    main(args.participants_filename, args.results_filename)
+    main(
+        args.participants_filename,
+        args.results_filename,
+        args.schedule,
+        args.check,
+        args.amend,
+        args.group_size,
+        args.recency_half_life,
+        args.profile,
+        args.metrics_out,
+        affinity_rules,
+        args.shard_by,
+        args.workers,
+        not args.no_cache,
+        args.lookahead,
+        args.lookahead_budget,
+        args.merge_duplicates,
+    )
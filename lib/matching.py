@@ -1,63 +1,389 @@
 import logging
+import itertools
 import random
-from collections import defaultdict
-from typing import Optional, List, Tuple, Dict
-import networkx as nx
-from networkx.exception import NetworkXError
+from typing import TYPE_CHECKING, Optional, List, Tuple
+
+from implicit_matching import ComplementMatcher, ProgressCallback, build_forbidden
+from metrics import Metrics, NullMetrics
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from weights import SparseWeights
 
 logger = logging.getLogger(__name__)
 
+BACKENDS = ("implicit", "networkx")
+# the edges lighter than the default weight are let in over this many rounds, heaviest first
+WEIGHT_TIERS = 8
+
 
 def matchmake(
     ids: List[int],
     constraints: Optional[List[Tuple[int, int]]] = None,
-) -> List[Tuple[int, int]]:
-    # generate a undirected graph that connects each participant to every other
-    G = nx.Graph()
-    for idx in ids:
-        G.add_node(idx)
-
-    edges = []
-    for i in range(len(ids)):
-        for j in range(i + 1, len(ids)):
-            edges.append((ids[i], ids[j]))
-
-    random.shuffle(edges)
-
-    for u, v in edges:
-        G.add_edge(u, v)
-
-    # exclude all edges according to constraints
-    if constraints is not None:
-        for constraint in constraints:
-            try:
-                G.remove_edge(*constraint)
-            except NetworkXError:
-                logger.debug(
-                    f"skip adding edge {constraint} because one or more persons in this pair is not a participant"
-                )
-
-    matches = nx.max_weight_matching(G, maxcardinality=True)
+    backend: str = "implicit",
+    seed: Optional[int] = None,
+    weights: Optional["SparseWeights"] = None,
+    metrics: Optional[Metrics] = None,
+    progress: Optional[ProgressCallback] = None,
+    group_size: int = 2,
+    conflicts: Optional["np.ndarray"] = None,
+) -> List[Tuple[int, ...]]:
+    """
+    Pairs up participants so that as many people as possible are matched, without using
+    any pair listed in the constraints. An odd roster's leftover then joins a pair they
+    may meet both of, as its trio. With a group_size above 2, everyone is split into
+    groups instead, keeping people who already met apart wherever possible.
+    Inputs:
+        ids: List[int], the IDs of this round's participants.
+        constraints: Optional[List[Tuple[int, int]]], ID pairs that must not be matched.
+        backend: str, "implicit" (default) or "networkx" for the reference solver.
+        seed: Optional[int], seed for the random tie-breaking between equally good matchings.
+        weights: Optional[SparseWeights], edge weights indexed like the de-duplicated
+            ids. When given, a maximum-cardinality matching preferring heavy pairs is
+            returned, and pairs with weight 0 are never matched (constraints are ignored).
+            An odd roster's leftover joins the pair they have the heaviest edges to.
+        metrics: Optional[Metrics], records the graph build and solve as separate spans.
+        progress: Optional[ProgressCallback], called with the solver stage and the fraction
+            of participants matched so far. It may raise MatchingCancelled to stop the solve.
+        group_size: int, the number of people per group. Leftovers join the last groups.
+        conflicts: Optional[np.ndarray], how strongly each pair of the de-duplicated ids
+            should be kept apart, used when splitting into groups of more than 2. Built
+            from the weights or the constraints when not given.
+    Returns:
+        matches: List[Tuple[int, ...]], the matched ID pairs (or groups).
+    """
+    metrics = metrics or NullMetrics()
+    if group_size != 2:
+        return _matchmake_groups(ids, constraints, group_size, seed, weights, conflicts, metrics, progress)
+    if weights is not None:
+        return _matchmake_weighted(list(dict.fromkeys(ids)), weights, seed, metrics, progress)
+    if backend == "implicit":
+        return _matchmake_implicit(ids, constraints, seed, metrics, progress)
+
+    # the networkx solver can't report partial progress, only its start and end
+    if progress is not None:
+        progress("solve", 0.0)
+    if backend == "networkx":
+        matches = _matchmake_networkx(ids, constraints, seed, metrics)
+    else:
+        raise ValueError(f"Unknown matching backend {backend}, expected one of {BACKENDS}")
+    if len(set(ids)) % 2 == 1:
+        matches, unplaced = attach_leftovers(matches, ids, constraints, seed)
+        _warn_unplaced(unplaced)
+    if progress is not None:
+        progress("done", 2 * len(matches) / len(ids) if ids else 1.0)
     return matches
 
 
-def get_all_pairing_history(
-    schedules_of_pairings: Dict[str, List[Tuple[int, int]]]
-) -> Dict[Tuple[int, int], List[str]]:
+def _matchmake_implicit(
+    ids: List[int],
+    constraints: Optional[List[Tuple[int, int]]],
+    seed: Optional[int],
+    metrics: Metrics,
+    progress: Optional[ProgressCallback],
+) -> List[Tuple[int, int]]:
+    with metrics.span("matchmake.build"):
+        # a roster can list someone twice, but they're still a single vertex
+        ids = list(dict.fromkeys(ids))
+        # only the forbidden edges are materialized, everything else is implicitly allowed
+        _, forbidden = build_forbidden(ids, constraints)
+        matcher = ComplementMatcher(len(ids), forbidden, progress)
+    with metrics.span("matchmake.solve"):
+        rng = random.Random(seed)
+        groups = [list(pair) for pair in matcher.solve(rng)]
+        if len(ids) % 2 == 1:
+            _warn_unplaced(_attach(groups, matcher.free_vertices(), forbidden, rng))
+    return [tuple(ids[v] for v in group) for group in groups]
+
+
+def _matchmake_groups(
+    ids: List[int],
+    constraints: Optional[List[Tuple[int, int]]],
+    group_size: int,
+    seed: Optional[int],
+    weights: Optional["SparseWeights"],
+    conflicts: Optional["np.ndarray"],
+    metrics: Metrics,
+    progress: Optional[ProgressCallback],
+) -> List[Tuple[int, ...]]:
+    from groups import constraint_conflicts, partition, weight_conflicts
+
+    with metrics.span("matchmake.build"):
+        ids = list(dict.fromkeys(ids))
+        if conflicts is None:
+            conflicts = (
+                weight_conflicts(weights)
+                if weights is not None
+                else constraint_conflicts(ids, constraints)
+            )
+    with metrics.span("matchmake.solve"):
+        groups = partition(conflicts, group_size, seed, progress)
+    return [tuple(ids[v] for v in group) for group in groups]
+
+
+def _matchmake_weighted(
+    ids: List[int],
+    weights: "SparseWeights",
+    seed: Optional[int],
+    metrics: Metrics,
+    progress: Optional[ProgressCallback],
+) -> List[Tuple[int, int]]:
+    """
+    Maximum-cardinality matching that prefers heavy pairs, on the implicit matcher. The
+    pairs heavier than the default weight are matched greedily, heaviest first, then
+    everyone else is matched on the default-weight edges, and only the people still
+    free get the lighter edges, e.g. pairs that met recently, a tier at a time from the
+    heaviest. Only the listed pairs are ever materialized.
+    """
+    import numpy as np
+
+    rng = random.Random(seed)
+    with metrics.span("matchmake.build"):
+        rows, cols, values = weights.rows, weights.cols, weights.values
+        heavy = values > weights.default
+        # the lighter edges are let in later, edges of weight 0 never
+        forbidden: List[set] = [set() for _ in range(weights.n)]
+        for u, v in zip(rows[~heavy].tolist(), cols[~heavy].tolist()):
+            forbidden[u].add(v)
+            forbidden[v].add(u)
+        matcher = ComplementMatcher(weights.n, forbidden, progress)
+    with metrics.span("matchmake.solve"):
+        # equally heavy pairs are taken in a random order
+        shuffle = np.random.default_rng(seed).permutation(int(heavy.sum()))
+        heavy_rows, heavy_cols = rows[heavy][shuffle], cols[heavy][shuffle]
+        order = np.argsort(-values[heavy][shuffle], kind="stable")
+        matcher.seed(zip(heavy_rows[order].tolist(), heavy_cols[order].tolist()))
+        matcher.greedy(rng)
+        matcher.maximize(rng)
+
+        light = (values > 0) & (values < weights.default)
+        tiers = np.ceil(values * WEIGHT_TIERS / weights.default).astype(np.int64)
+        for tier in range(WEIGHT_TIERS, 0, -1):
+            if len(matcher.free_vertices()) <= weights.n % 2:
+                break
+            let_in = light & (tiers == tier)
+            for u, v in zip(rows[let_in].tolist(), cols[let_in].tolist()):
+                forbidden[u].discard(v)
+                forbidden[v].discard(u)
+            matcher.greedy(rng)
+            matcher.maximize(rng)
+        groups = [list(pair) for pair in matcher.pairs()]
+        if weights.n % 2 == 1:
+            _warn_unplaced(_attach_heaviest(groups, matcher.free_vertices(), weights))
+        matcher.report("done")
+    return [tuple(ids[v] for v in group) for group in groups]
+
+
+def _matchmake_networkx(
+    ids: List[int],
+    constraints: Optional[List[Tuple[int, int]]],
+    seed: Optional[int],
+    metrics: Metrics,
+) -> List[Tuple[int, int]]:
+    import networkx as nx
+    from weights import constraint_positions
+
+    with metrics.span("matchmake.build"):
+        # generate a undirected graph that connects each participant to every other
+        G = nx.Graph()
+        for idx in ids:
+            G.add_node(idx)
+
+        edges = []
+        for i in range(len(ids)):
+            for j in range(i + 1, len(ids)):
+                edges.append((ids[i], ids[j]))
+
+        random.Random(seed).shuffle(edges)
+
+        for u, v in edges:
+            G.add_edge(u, v)
+
+        # exclude all edges according to constraints, among participants only
+        rows, cols = constraint_positions(ids, constraints)
+        G.remove_edges_from(zip((ids[r] for r in rows.tolist()), (ids[c] for c in cols.tolist())))
+
+    with metrics.span("matchmake.solve"):
+        matches = nx.max_weight_matching(G, maxcardinality=True)
+    return list(matches)
+
+
+def repair(
+    pairs: List[Tuple[int, int]],
+    ids: List[int],
+    constraints: Optional[List[Tuple[int, int]]] = None,
+    seed: Optional[int] = None,
+) -> List[Tuple[int, int]]:
+    """
+    Re-matches a roster that changed after `pairs` were generated. Every pair whose
+    people are both still in `ids` is kept, the people left without a partner are
+    paired among themselves, and only then are augmenting paths used, which each
+    re-pair just the few people along the path.
+    Inputs:
+        pairs: List[Tuple[int, int]], the previous matching.
+        ids: List[int], the IDs of the current roster.
+        constraints: Optional[List[Tuple[int, int]]], ID pairs that must not be matched.
+        seed: Optional[int], seed for pairing up the people without a partner.
+    Returns:
+        matches: List[Tuple[int, int]], the repaired matching.
+    """
+    ids = list(dict.fromkeys(ids))
+    index, forbidden = build_forbidden(ids, constraints)
+    matcher = ComplementMatcher(len(ids), forbidden)
+    kept = matcher.seed(
+        (index[a], index[b]) for a, b in pairs if a in index and b in index
+    )
+    rng = random.Random(seed)
+    free = len(matcher.free_vertices())
+    matcher.greedy(rng)
+    augmentations = matcher.maximize(rng)
+    logger.info(
+        f"Kept {kept} of {len(pairs)} pairs, re-pairing {free} people "
+        f"({augmentations} augmenting paths)"
+    )
+    return [(ids[u], ids[v]) for u, v in matcher.pairs()]
+
+
+def attach_leftovers(
+    groups: List[Tuple[int, ...]],
+    ids: List[int],
+    constraints: Optional[List[Tuple[int, int]]] = None,
+    seed: Optional[int] = None,
+) -> Tuple[List[Tuple[int, ...]], List[int]]:
+    """
+    Adds everyone in `ids` who isn't in one of `groups` to a group whose members they
+    may all meet, e.g. turning a pair into the trio of an odd roster.
+    Inputs:
+        groups: List[Tuple[int, ...]], the groups so far, of people in ids.
+        ids: List[int], the IDs of the whole roster.
+        constraints: Optional[List[Tuple[int, int]]], ID pairs that must not be matched.
+        seed: Optional[int], seed for picking among equally small groups.
+    Returns:
+        groups: List[Tuple[int, ...]], the groups with the leftovers added.
+        unplaced: List[int], the leftovers no group could take.
+    """
+    ids = list(dict.fromkeys(ids))
+    index, forbidden = build_forbidden(ids, constraints)
+    local = [[index[idx] for idx in group] for group in groups]
+    grouped = {v for group in local for v in group}
+    leftovers = [v for v in range(len(ids)) if v not in grouped]
+    unplaced = _attach(local, leftovers, forbidden, random.Random(seed))
+    return [tuple(ids[v] for v in group) for group in local], [ids[v] for v in unplaced]
+
+
+def _attach(
+    groups: List[List[int]],
+    leftovers: List[int],
+    forbidden: List[set],
+    rng: random.Random,
+) -> List[int]:
+    # the smallest groups take leftovers first, and a random one of them, so that
+    # repeated solves don't always grow the same pair
+    unplaced = []
+    for v in leftovers:
+        fits = [group for group in groups if not any(u in forbidden[v] for u in group)]
+        if not fits:
+            unplaced.append(v)
+            continue
+        smallest = min(len(group) for group in fits)
+        rng.choice([group for group in fits if len(group) == smallest]).append(v)
+    return unplaced
+
+
+def _attach_heaviest(
+    groups: List[List[int]],
+    leftovers: List[int],
+    weights: "SparseWeights",
+) -> List[int]:
+    # like _attach, but among the smallest groups with no weight-0 edge to the
+    # leftover, the one with the heaviest edges to them
+    import numpy as np
+
+    unplaced = []
+    for v in leftovers:
+        sizes = np.array([len(group) for group in groups], dtype=np.int64)
+        which = np.repeat(np.arange(len(groups)), sizes)
+        members = np.fromiter((u for group in groups for u in group), dtype=np.int64, count=int(sizes.sum()))
+        edges = weights.lookup(np.full(len(members), v), members)
+        total = np.bincount(which, weights=edges, minlength=len(groups))
+        fits = np.bincount(which, weights=edges == 0, minlength=len(groups)) == 0
+        if not fits.any():
+            unplaced.append(v)
+            continue
+        fits &= sizes == sizes[fits].min()
+        groups[int(np.argmax(np.where(fits, total, -1)))].append(v)
+    return unplaced
+
+
+def _warn_unplaced(unplaced: List[int]) -> None:
+    if unplaced:
+        logger.warning(f"{len(unplaced)} people can't join a pair without repeating a pairing, leaving them out")
+
+
+def circle_round(n: int, r: int) -> List[Tuple[int, int]]:
     """
-    Consolidates all match histories.
+    Round r of the round-robin 1-factorization of n players by the circle method,
+    computed directly: the last player stays put while the rest rotate, so round r
+    pairs r with the fixed player and r + i with r - i around the circle. With an odd
+    n, whoever meets the dummy fixed player sits out.
     """
-    seen: Dict[frozenset, List[str]] = defaultdict(list)
-    for match_csv_filename, pairings in schedules_of_pairings.items():
-        for pairing in pairings:
-            pairing = frozenset(pairing)
-            if pairing in seen:
-                logger.debug(
-                    f"Pairing {pairing} was already done in {seen[pairing][-1]}"
-                )
-            seen[pairing].append(match_csv_filename)
+    size = n + n % 2
+    circle = size - 1
+    pairs = [] if n % 2 == 1 else [(r % circle, circle)]
+    for i in range(1, size // 2):
+        pairs.append(((r + i) % circle, (r - i) % circle))
+    return pairs
+
+
+def schedule(
+    ids: List[int],
+    constraints: Optional[List[Tuple[int, int]]],
+    months: int,
+    seed: Optional[int] = None,
+) -> List[List[Tuple[int, ...]]]:
+    """
+    Precomputes several months of pairings at once, so that no pair repeats across
+    the months or with the constraints.
+    Inputs:
+        ids: List[int], the IDs of the participants for every month.
+        constraints: Optional[List[Tuple[int, int]]], ID pairs that must not be matched.
+        months: int, how many months of pairings to generate.
+        seed: Optional[int], seed for shuffling the roster and breaking ties.
+    Returns:
+        schedule: List[List[Tuple[int, ...]]], the matched ID pairs for each month, with a
+            trio when the roster is odd.
+    """
+    rng = random.Random(seed)
+    ids = list(dict.fromkeys(ids))
+    _, forbidden = build_forbidden(ids, constraints)
+
+    # start every month from a round of a shuffled circle-method factorization, which
+    # is already disjoint from the other months, and repair the pairs it conflicts on
+    order = list(range(len(ids)))
+    rng.shuffle(order)
+    # only the rounds that are used are computed, in a random order
+    n_rounds = max(len(ids) + len(ids) % 2 - 1, 0)
+    rounds = rng.sample(range(n_rounds), min(months, n_rounds))
 
-    formatted_seen = {}
-    for k, v in seen.items():
-        formatted_seen[tuple(k)] = v
-    return formatted_seen
+    res = []
+    for month in range(months):
+        matcher = ComplementMatcher(len(ids), forbidden)
+        if month < len(rounds):
+            matcher.seed((order[u], order[v]) for u, v in circle_round(len(ids), rounds[month]))
+        pairs = matcher.solve(rng)
+        unmatched = len(ids) - 2 * len(pairs)
+        if unmatched > len(ids) % 2:
+            logger.warning(
+                f"Month {month + 1} of the schedule leaves {unmatched} people without a fresh partner"
+            )
+        groups = [list(pair) for pair in pairs]
+        if len(ids) % 2 == 1:
+            # the odd one out joins a pair as a trio, like a single month's matching
+            _warn_unplaced(_attach(groups, matcher.free_vertices(), forbidden, rng))
+        for group in groups:
+            for u, v in itertools.combinations(group, 2):
+                forbidden[u].add(v)
+                forbidden[v].add(u)
+        res.append([tuple(ids[v] for v in group) for group in groups])
+    return res
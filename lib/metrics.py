@@ -0,0 +1,85 @@
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Returns the peak resident set size of this process so far, or None where the
+    resource module isn't available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclass
+class Span:
+    name: str
+    seconds: float
+    counts: Dict[str, int] = field(default_factory=dict)
+    peak_rss_bytes: Optional[int] = None
+
+
+class Metrics:
+    """
+    Collects one span per pipeline stage, with its duration, item counts and the peak
+    RSS of the process when the stage ended.
+    """
+
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    @contextmanager
+    def span(self, name: str, **counts: int) -> Iterator[Dict[str, int]]:
+        """
+        Times the enclosed block. The yielded dict can be filled with more counts
+        once they're known inside the block.
+        """
+        counts = dict(counts)
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            span = Span(name, time.perf_counter() - start, counts, peak_rss_bytes())
+            self.spans.append(span)
+            logger.debug(f"{name} took {span.seconds * 1000:.1f}ms {counts}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"spans": [asdict(span) for span in self.spans]}
+
+    def dump(self, filename: str) -> None:
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self) -> str:
+        lines = ["Stage timings:"]
+        for span in self.spans:
+            counts = ", ".join(f"{k}={v}" for k, v in span.counts.items())
+            rss = (
+                f", peak RSS {span.peak_rss_bytes / 2**20:.1f}MiB"
+                if span.peak_rss_bytes is not None
+                else ""
+            )
+            lines.append(f"  {span.name}: {span.seconds * 1000:.1f}ms{rss}" + (f" ({counts})" if counts else ""))
+        return "\n".join(lines)
+
+
+class NullMetrics(Metrics):
+    """
+    Metrics that records nothing, for callers that don't care about timings.
+    """
+
+    @contextmanager
+    def span(self, name: str, **counts: int) -> Iterator[Dict[str, int]]:
+        yield dict(counts)
@@ -0,0 +1,172 @@
+import csv
+import logging
+import os
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# how alike two names' trigrams must be (Dice coefficient) to flag them
+DEFAULT_SIMILARITY = 0.75
+# trigrams shared by more names than this (e.g. of a common surname) are skipped when
+# looking for candidates, which keeps a lookup's cost independent of the registry size
+MAX_POSTING = 256
+# next to the ID log, the log of flagged duplicates
+DUPLICATES_SUFFIX = ".dupes"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_name(name: str) -> str:
+    """
+    Folds case, accents and whitespace, so that "Katie Nelson " and "katie nelson"
+    normalize the same.
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _WHITESPACE.sub(" ", stripped).strip().casefold()
+
+
+def trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class DuplicateName:
+    """
+    A name that looks like another one the ID registry already has.
+    """
+
+    name: str
+    existing: str
+    similarity: float
+
+
+class NameIndex:
+    """
+    Normalized names and a character-trigram inverted index over them. A lookup only
+    scores the names sharing a rare enough trigram with the query, so finding the
+    likely duplicates of a name takes roughly constant time however many names are
+    indexed.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names: List[str] = []
+        self.grams: List[Set[str]] = []
+        self.by_normalized: Dict[str, int] = {}
+        self.postings: Dict[str, List[int]] = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, name: str) -> None:
+        normalized = normalize_name(name)
+        grams = trigrams(normalized)
+        i = len(self.names)
+        self.names.append(name)
+        self.grams.append(grams)
+        self.by_normalized.setdefault(normalized, i)
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(i)
+
+    def similar(self, name: str, threshold: float = DEFAULT_SIMILARITY) -> List[Tuple[str, float]]:
+        """
+        Returns the indexed names (other than `name` itself) that normalize the same as
+        `name`, with similarity 1, or whose trigrams are at least `threshold` alike,
+        most similar first.
+        """
+        normalized = normalize_name(name)
+        grams = trigrams(normalized)
+        matches: Dict[int, float] = {}
+        exact = self.by_normalized.get(normalized)
+        if exact is not None:
+            matches[exact] = 1.0
+
+        shared: Counter = Counter()
+        skipped = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                continue
+            if len(posting) > MAX_POSTING:
+                skipped.append(gram)
+            else:
+                shared.update(posting)
+        # alike enough needs at least threshold * |grams| / (2 - threshold) trigrams in
+        # common, so most candidates can be dropped on their count of rare ones alone
+        needed = threshold * len(grams) / (2 - threshold) - len(skipped)
+        for i, count in shared.items():
+            if count < needed or i in matches:
+                continue
+            # the common trigrams weren't used to find candidates, but still count
+            count += sum(1 for gram in skipped if gram in self.grams[i])
+            similarity = 2 * count / (len(grams) + len(self.grams[i]))
+            if similarity >= threshold:
+                matches[i] = similarity
+        return sorted(
+            ((self.names[i], similarity) for i, similarity in matches.items() if self.names[i] != name),
+            key=lambda match: match[1],
+            reverse=True,
+        )
+
+
+class DuplicateLog:
+    """
+    Append-only CSV of "name,existing,similarity,decision" rows: a pair of names flagged
+    as likely the same person (no decision), and later whether they were "merged" or
+    kept "distinct". Every pair is flagged, and decided, once.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.flagged: Dict[Tuple[str, str], DuplicateName] = {}
+        self.decided: Set[Tuple[str, str]] = set()
+        if os.path.exists(filename):
+            with open(filename, newline="", encoding="utf-8") as f:
+                for row in csv.reader(f):
+                    if len(row) != 4:
+                        continue
+                    name, existing, similarity, decision = row
+                    if decision:
+                        self.decided.add((name, existing))
+                    else:
+                        self.flagged[name, existing] = DuplicateName(name, existing, float(similarity))
+
+    def pending(self) -> List[DuplicateName]:
+        return [
+            duplicate for key, duplicate in self.flagged.items() if key not in self.decided
+        ]
+
+    def flag(self, duplicates: Iterable[DuplicateName]) -> List[DuplicateName]:
+        """
+        Logs the duplicates that weren't flagged or decided before, either way round,
+        and returns them.
+        """
+        new = []
+        for duplicate in duplicates:
+            key = (duplicate.name, duplicate.existing)
+            seen = (key, key[::-1])
+            if not any(pair in self.flagged or pair in self.decided for pair in seen):
+                self.flagged[key] = duplicate
+                new.append(duplicate)
+        self._append([(d.name, d.existing, f"{d.similarity:.3f}", "") for d in new])
+        return new
+
+    def decide(self, duplicate: DuplicateName, merged: bool) -> None:
+        self.decided.add((duplicate.name, duplicate.existing))
+        self._append(
+            [(duplicate.name, duplicate.existing, f"{duplicate.similarity:.3f}", "merged" if merged else "distinct")]
+        )
+
+    def _append(self, rows: List[Tuple[str, str, str, str]]) -> None:
+        if not rows:
+            return
+        with open(self.filename, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(rows)
+
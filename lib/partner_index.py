@@ -0,0 +1,100 @@
+import logging
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from weights import constraint_positions, key_positions
+
+logger = logging.getLogger(__name__)
+
+WORD_BITS = 64
+
+
+class PartnerIndex:
+    """
+    Who can't be paired with whom among this round's participants, as one bitset per
+    person: bit j of row i is set when the i-th and j-th participant are constrained or
+    already met. Rows are looked up by registry ID, and counting someone's remaining
+    fresh partners is a popcount over n / 64 words.
+    """
+
+    def __init__(self, ids: Sequence[int], rows: np.ndarray, cols: np.ndarray):
+        self.ids = list(ids)
+        self.position = {idx: i for i, idx in enumerate(self.ids)}
+        n = len(self.ids)
+        # both directions, without self-pairs
+        keep = rows != cols
+        rows, cols = rows[keep], cols[keep]
+        self.rows = np.concatenate([rows, cols]).astype(np.int64)
+        self.cols = np.concatenate([cols, rows]).astype(np.int64)
+        self.bits = np.zeros((n, (n + WORD_BITS - 1) // WORD_BITS), dtype=np.uint64)
+        np.bitwise_or.at(
+            self.bits,
+            (self.rows, self.cols // WORD_BITS),
+            np.left_shift(np.uint64(1), (self.cols % WORD_BITS).astype(np.uint64)),
+        )
+
+    @classmethod
+    def from_keys(cls, ids: Sequence[int], keys: np.ndarray) -> "PartnerIndex":
+        """
+        Builds the index of the participants in `ids` from pair keys, dropping the keys
+        that involve anyone else in one vectorized pass.
+        """
+        rows, cols, kept = key_positions(list(ids), keys)
+        logger.debug(f"Indexed {int(kept.sum())} of {len(kept)} forbidden pairs among {len(ids)} participants")
+        return cls(ids, rows, cols)
+
+    @classmethod
+    def from_constraints(
+        cls,
+        ids: Sequence[int],
+        constraints: Optional[Iterable[Tuple[int, int]]],
+    ) -> "PartnerIndex":
+        rows, cols = constraint_positions(list(ids), constraints)
+        return cls(ids, rows, cols)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def forbidden_counts(self) -> np.ndarray:
+        return np.bitwise_count(self.bits).sum(axis=1, dtype=np.int64)
+
+    def fresh_counts(self) -> np.ndarray:
+        """
+        Returns how many of the other participants each participant can still meet.
+        """
+        return np.maximum(len(self.ids) - 1 - self.forbidden_counts(), 0)
+
+    def fresh_count(self, idx: int) -> int:
+        i = self.position[idx]
+        return max(len(self.ids) - 1 - int(np.bitwise_count(self.bits[i]).sum()), 0)
+
+    def allowed(self, a: int, b: int) -> bool:
+        i, j = self.position[a], self.position[b]
+        return i != j and not (int(self.bits[i, j // WORD_BITS]) >> (j % WORD_BITS)) & 1
+
+    def fresh_partners(self, idx: int) -> List[int]:
+        """
+        Returns the registry IDs of the participants `idx` can still meet.
+        """
+        i = self.position[idx]
+        row = np.unpackbits(self.bits[i].view(np.uint8), bitorder="little")[: len(self.ids)]
+        row[i] = 1
+        return [self.ids[j] for j in np.flatnonzero(row == 0).tolist()]
+
+    def nearly_exhausted(self, threshold: int) -> List[Tuple[int, int]]:
+        """
+        Returns the participants with at most `threshold` fresh partners left, as
+        (registry ID, fresh partners), fewest first.
+        """
+        counts = self.fresh_counts()
+        exhausted = np.flatnonzero(counts <= threshold)
+        exhausted = exhausted[np.argsort(counts[exhausted], kind="stable")]
+        return [(self.ids[i], int(counts[i])) for i in exhausted.tolist()]
+
+    def pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns every forbidden pair once, as local indices with rows < cols.
+        """
+        upper = self.rows < self.cols
+        return self.rows[upper], self.cols[upper]
@@ -0,0 +1,166 @@
+import argparse
+import logging
+from typing import List, Optional
+
+import numpy as np
+
+from core import CoffeeChatCore
+from coverage import DEFAULT_MAX_MONTHS, DEFAULT_RUNS, forecast_exhaustion
+from log_utils import init_logging
+
+logger = logging.getLogger(__name__)
+
+# people with at most this many fresh partners left are listed as nearly exhausted
+DEFAULT_EXHAUSTION_THRESHOLD = 3
+
+
+def partners_report(
+    participants_filename: str,
+    threshold: int = DEFAULT_EXHAUSTION_THRESHOLD,
+    people: Optional[List[str]] = None,
+) -> List[str]:
+    """
+    Reports how many people on the roster each participant has never met (and isn't
+    constrained from meeting), listing whoever is nearly out of fresh partners.
+    Inputs:
+        participants_filename: str, the roster to report on.
+        threshold: int, the most fresh partners someone nearly exhausted has left.
+        people: Optional[List[str]], participants to also list the fresh partners of.
+    Returns:
+        lines: List[str], the report.
+    """
+    core = CoffeeChatCore(participants_filename=participants_filename, results_filename="")
+    participant_names = core.load_data().participant_names
+    index = core.partner_index(participant_names)
+    counts = index.fresh_counts()
+
+    lines = [f"{len(index)} participants, fresh partners left per person:"]
+    if len(index):
+        lines.append(
+            f"  min {int(counts.min())}, median {float(np.median(counts)):.0f}, "
+            f"max {int(counts.max())} (of {len(index) - 1} others)"
+        )
+    exhausted = index.nearly_exhausted(threshold)
+    if exhausted:
+        lines.append(f"{len(exhausted)} people have at most {threshold} fresh partners left:")
+        names = core.registry.names_of([idx for idx, _ in exhausted])
+        lines.extend(f"  {name}: {count}" for name, (_, count) in zip(names, exhausted))
+    else:
+        lines.append(f"Nobody is down to {threshold} fresh partners or fewer.")
+
+    for name in people or []:
+        idx = core.names_to_ids.get(name)
+        if idx is None or idx not in index.position:
+            lines.append(f"{name} isn't on the roster.")
+            continue
+        partners = core.registry.names_of(index.fresh_partners(idx))
+        lines.append(f"{name} can still meet {len(partners)}: {', '.join(partners)}")
+    return lines
+
+
+def coverage_report(
+    participants_filename: Optional[str] = None,
+    runs: int = DEFAULT_RUNS,
+    max_months: int = DEFAULT_MAX_MONTHS,
+    attendance: float = 1.0,
+    seed: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> List[str]:
+    """
+    Reports how much of the community already met, how many fresh partners people have
+    left, and how many months everyone can still be paired with someone new.
+    Inputs:
+        participants_filename: Optional[str], a roster whose people count as part of
+            the community even if they never took part.
+        runs: int, Monte-Carlo simulations of future months, 0 to skip the forecast.
+        max_months: int, how many months to simulate at most per run.
+        attendance: float, the fraction of the community attending each simulated month.
+        seed: Optional[int], seed for the simulations.
+        max_workers: Optional[int], processes to simulate in (default: one per CPU).
+    Returns:
+        lines: List[str], the report.
+    """
+    core = CoffeeChatCore(participants_filename=participants_filename or "", results_filename="")
+    if participants_filename:
+        participant_names = core.load_data().participant_names
+    else:
+        participant_names = []
+        core.load_history(participant_names)
+    report = core.coverage(participant_names)
+    if runs > 0 and len(report.ids) >= 2:
+        with core.metrics.span("forecast_exhaustion", runs=runs, people=len(report.ids)):
+            forecast_exhaustion(
+                report, core.history.keys, runs, max_months, attendance, seed, max_workers
+            )
+    logger.debug(core.metrics.summary())
+    return report.describe()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on the pairing history of the coffee chats.")
+    subparsers = parser.add_subparsers(dest="report", required=True)
+    partners_parser = subparsers.add_parser(
+        "partners", help="How many fresh partners everyone on a roster has left."
+    )
+    partners_parser.add_argument("participants_filename", help="CSV file containing the participants' names.")
+    partners_parser.add_argument(
+        "--threshold",
+        type=int,
+        default=DEFAULT_EXHAUSTION_THRESHOLD,
+        help=f"List people with at most this many fresh partners left (default {DEFAULT_EXHAUSTION_THRESHOLD}).",
+    )
+    partners_parser.add_argument(
+        "--person",
+        action="append",
+        default=[],
+        metavar="NAME",
+        help="Also list who this participant can still meet. Repeatable.",
+    )
+    coverage_parser = subparsers.add_parser(
+        "coverage", help="How much of the community already met, and how long until fresh pairs run out."
+    )
+    coverage_parser.add_argument(
+        "participants_filename",
+        nargs="?",
+        default=None,
+        help="Optional roster, whose people count as part of the community too.",
+    )
+    coverage_parser.add_argument(
+        "--runs",
+        type=int,
+        default=DEFAULT_RUNS,
+        help=f"Simulations of future months for the forecast, 0 to skip it (default {DEFAULT_RUNS}).",
+    )
+    coverage_parser.add_argument(
+        "--max-months",
+        type=int,
+        default=DEFAULT_MAX_MONTHS,
+        help=f"Months to simulate at most per run (default {DEFAULT_MAX_MONTHS}).",
+    )
+    coverage_parser.add_argument(
+        "--attendance",
+        type=float,
+        default=1.0,
+        help="Fraction of the community attending each simulated month (default 1).",
+    )
+    coverage_parser.add_argument("--seed", type=int, default=None)
+    coverage_parser.add_argument("--workers", type=int, default=None, help="Processes to simulate in (default: one per CPU).")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    init_logging(args.verbose)
+    if args.report == "partners":
+        print("\n".join(partners_report(args.participants_filename, args.threshold, args.person)))
+    elif args.report == "coverage":
+        print(
+            "\n".join(
+                coverage_report(
+                    args.participants_filename,
+                    args.runs,
+                    args.max_months,
+                    args.attendance,
+                    args.seed,
+                    args.workers,
+                )
+            )
+        )
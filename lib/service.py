@@ -0,0 +1,368 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core import IDS_LOCATION, PAIRINGS_LOCATION, CoffeeChatCore
+from csv_utils import read_participants
+from history_index import KEY_STRIDE, PairingHistoryIndex
+from log_utils import init_logging
+from matching import matchmake
+from weights import SparseWeights
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# requests bigger than this are refused instead of read into memory
+MAX_BODY_BYTES = 64 * 2**20
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+def _solve(
+    ids: List[int],
+    constraints: List[Tuple[int, int]],
+    seed: Optional[int],
+    weights: Optional[SparseWeights],
+    group_size: int,
+    conflicts: Optional[np.ndarray],
+) -> List[Tuple[int, ...]]:
+    return matchmake(
+        ids, constraints, seed=seed, weights=weights, group_size=group_size, conflicts=conflicts
+    )
+
+
+class RequestError(Exception):
+    """
+    A request the service can't serve, reported back with its HTTP status.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class MatchingService:
+    """
+    Serves match, validate and amend requests over local HTTP, keeping the pairing
+    history, the ID registry and the constraint pairs warm between requests. Before
+    each request, only new or changed pairing files are re-read, and solves run in a
+    process pool so that several requests can be in flight at once.
+
+    Every request gets its own CoffeeChatCore sharing the warm state, so settings such
+    as the group size or the results file are per request.
+    """
+
+    def __init__(
+        self,
+        pairings_dirname: str = PAIRINGS_LOCATION,
+        ids_filename: str = os.path.join(IDS_LOCATION, "ids.csv"),
+        max_workers: Optional[int] = None,
+    ):
+        self.pairings_dirname = pairings_dirname
+        self.ids_filename = ids_filename
+        self.max_workers = max_workers
+        self.warm = CoffeeChatCore(participants_filename="", results_filename="")
+        self.constraints_ids: List[Tuple[int, int]] = []
+        self.lock = asyncio.Lock()
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.routes: Dict[Tuple[str, str], Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = {
+            ("GET", "/health"): self.health,
+            ("POST", "/match"): self.match,
+            ("POST", "/validate"): self.validate,
+            ("POST", "/amend"): self.amend,
+        }
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: Optional[str] = None) -> None:
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        try:
+            async with self.lock:
+                self.refresh()
+            if socket_path is not None:
+                server = await asyncio.start_unix_server(self.handle, path=socket_path)
+                logger.info(f"Serving on unix socket {socket_path}")
+            else:
+                server = await asyncio.start_server(self.handle, host, port)
+                logger.info(f"Serving on http://{host}:{port}")
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def refresh(self) -> bool:
+        """
+        Brings the warm state up to date with the files on disk. Returns whether
+        anything had to be re-read.
+        """
+        registry = self.warm.registry
+        registry_stale = registry is not None and (
+            not os.path.exists(self.ids_filename)
+            or os.path.getsize(self.ids_filename) != registry.covered
+        )
+        if registry_stale:
+            # something else registered names, reopen the registry to index them. Requests
+            # still holding the old one keep it alive until they're done.
+            logger.info(f"{self.ids_filename} changed, reloading the ID registry")
+            self.warm.registry = None
+
+        index = PairingHistoryIndex(self.pairings_dirname)
+        try:
+            changed, removed = index.stale_files()
+        finally:
+            index.close()
+        if self.warm.history is not None and not changed and not removed and not registry_stale:
+            return False
+
+        start = time.perf_counter()
+        history = self.warm.load_history([], self.pairings_dirname, self.ids_filename)
+        id_a, id_b = np.divmod(history.keys, KEY_STRIDE)
+        self.constraints_ids = list(zip(id_a.tolist(), id_b.tolist()))
+        logger.info(
+            f"Refreshed history ({len(changed)} changed, {len(removed)} removed files) "
+            f"in {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+        return True
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                method, path, payload = await read_request(reader)
+                route = self.routes.get((method, path))
+                if route is None:
+                    known = any(path == route_path for _, route_path in self.routes)
+                    raise RequestError(405 if known else 404, f"No route for {method} {path}")
+                status, response = 200, await route(payload)
+            except RequestError as e:
+                status, response = e.status, {"error": str(e)}
+            except Exception as e:
+                logger.exception("Request failed")
+                status, response = 500, {"error": str(e)}
+            write_response(writer, status, response)
+            await writer.drain()
+        except ConnectionError:
+            logger.debug("Client went away before the response was sent")
+        finally:
+            writer.close()
+
+    async def health(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.lock:
+            refreshed = self.refresh()
+        return {
+            "status": "ok",
+            "refreshed": refreshed,
+            "registered_names": len(self.warm.registry) if self.warm.registry is not None else 0,
+            "history_files": len(self.warm.history.filenames) if self.warm.history is not None else 0,
+            "constraint_pairs": len(self.constraints_ids),
+        }
+
+    async def match(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Solves a matching for a roster. Body: participants (list of names) or
+        participants_filename, and optionally results_filename with write=true to save
+        it under pairings/, group_size, recency_half_life and seed.
+        """
+        participant_names = participants_of(payload)
+        if payload.get("write") and "results_filename" not in payload:
+            raise RequestError(400, "write needs a results_filename")
+        async with self.lock:
+            self.refresh()
+            core = self.request_core(payload)
+            participant_ids, weights, conflicts = core.prepare_matchmaking(participant_names)
+            constraints_ids = self.constraints_ids
+
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        group_ids = await loop.run_in_executor(
+            self.executor,
+            _solve,
+            participant_ids,
+            constraints_ids,
+            payload.get("seed"),
+            weights,
+            core.group_size,
+            conflicts,
+        )
+        solve_seconds = time.perf_counter() - start
+
+        async with self.lock:
+            groups = [tuple(core.registry.names_of(group)) for group in group_ids]
+            response = self.check(core, groups, participant_names)
+            if payload.get("write"):
+                core.finalize_matches(groups)
+                response["results_filename"] = core.results_filename
+        response["groups"] = [list(group) for group in groups]
+        response["solve_seconds"] = solve_seconds
+        return response
+
+    async def validate(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Checks a proposed matching. Body: groups (lists of names), and optionally
+        participants (everyone who should be in a group) and results_filename (whose
+        older copy in pairings/ is then ignored). Nothing is registered: names the ID
+        registry doesn't know are reported as unknown, and can't repeat a pairing.
+        """
+        if not isinstance(payload.get("groups"), list):
+            raise RequestError(400, "validate needs a list of groups")
+        groups = [tuple(group) for group in payload["groups"]]
+        participant_names = payload.get("participants") or list(itertools.chain(*groups))
+        async with self.lock:
+            self.refresh()
+            core = self.request_core(payload)
+            names = list(dict.fromkeys(itertools.chain(participant_names, *groups)))
+            names_to_ids = {name: core.registry.lookup(name) for name in names}
+            unknown = [name for name, num_id in names_to_ids.items() if num_id is None]
+            core.names_to_ids.update({name: num_id for name, num_id in names_to_ids.items() if num_id is not None})
+            return self.check(core, groups, participant_names, unknown)
+
+    async def amend(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Amends a saved matching after people dropped out or joined, and saves it again.
+        Body: results_filename, and either removed and added (lists of names) or the
+        updated participants to diff against the saved matching. A matching that leaves
+        someone out is only saved with allow_incomplete=true.
+        """
+        if "results_filename" not in payload:
+            raise RequestError(400, "amend needs a results_filename")
+        async with self.lock:
+            self.refresh()
+            core = self.request_core(payload)
+            if not os.path.exists(core.results_filename):
+                raise RequestError(404, f"There are no pairings at {core.results_filename} to amend")
+            previous_names = set(itertools.chain.from_iterable(core.read_results()))
+            if "participants" in payload or "participants_filename" in payload:
+                participant_names = participants_of(payload)
+                removed_names = sorted(previous_names - set(participant_names))
+                added_names = [name for name in dict.fromkeys(participant_names) if name not in previous_names]
+            else:
+                removed_names = list(payload.get("removed", []))
+                added_names = list(payload.get("added", []))
+                participant_names = [
+                    name for name in previous_names if name not in set(removed_names)
+                ] + added_names
+            groups = core.amend(removed_names, added_names)
+            response = self.check(core, groups, participant_names)
+            # leaving someone out has to be asked for
+            saved = not response["unpaired"] or bool(payload.get("allow_incomplete"))
+            if saved:
+                core.finalize_matches(groups)
+        response.update(
+            groups=[list(group) for group in groups],
+            saved=saved,
+            results_filename=core.results_filename,
+            removed=removed_names,
+            added=added_names,
+        )
+        return response
+
+    def request_core(self, payload: Dict[str, Any]) -> CoffeeChatCore:
+        results_filename = payload.get("results_filename", "")
+        if os.path.basename(results_filename) != results_filename:
+            raise RequestError(400, "results_filename must be a filename inside pairings/, not a path")
+        core = CoffeeChatCore(participants_filename="", results_filename=results_filename)
+        core.registry = self.warm.registry
+        core.history = self.warm.history
+        core.names_to_ids = self.warm.names_to_ids
+        core.constraints_basename = self.warm.constraints_basename
+        group_size = int(payload.get("group_size", 2))
+        if group_size < 2:
+            raise RequestError(400, "group_size must be at least 2")
+        core.group_size = group_size
+        if payload.get("recency_half_life") is not None:
+            core.recency_half_life = float(payload["recency_half_life"])
+        return core
+
+    def check(
+        self,
+        core: CoffeeChatCore,
+        groups: List[Tuple[str, ...]],
+        participant_names: List[str],
+        unknown: Sequence[str] = (),
+    ) -> Dict[str, Any]:
+        grouped = set(itertools.chain(*groups))
+        unpaired = [name for name in dict.fromkeys(participant_names) if name not in grouped]
+        # someone the registry has never seen hasn't met anyone yet
+        skipped = set(unknown)
+        known_groups = [tuple(name for name in group if name not in skipped) for group in groups]
+        repeats = core.find_repeats({core.results_filename: known_groups})
+        return {
+            # with recency weights, repeats are allowed but still reported
+            "valid": not unpaired and (not repeats or core.recency_half_life is not None),
+            "unpaired": unpaired,
+            "repeats": [{"pair": list(pair), "files": files} for pair, files in repeats.items()],
+            "unknown": list(unknown),
+        }
+
+
+def participants_of(payload: Dict[str, Any]) -> List[str]:
+    if isinstance(payload.get("participants"), list):
+        return [str(name) for name in payload["participants"]]
+    if "participants_filename" in payload:
+        try:
+            return read_participants(payload["participants_filename"])
+        except (OSError, RuntimeError) as e:
+            raise RequestError(400, str(e))
+    raise RequestError(400, "Expected participants or participants_filename")
+
+
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, Any]]:
+    request_line = await reader.readline()
+    try:
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise RequestError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0) or 0)
+    if length > MAX_BODY_BYTES:
+        raise RequestError(400, f"Request body over {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    try:
+        payload = json.loads(body) if body else {}
+    except json.JSONDecodeError as e:
+        raise RequestError(400, f"Body isn't valid JSON: {e}")
+    if not isinstance(payload, dict):
+        raise RequestError(400, "Body must be a JSON object")
+    return method.upper(), target.split("?", 1)[0], payload
+
+
+def write_response(writer: asyncio.StreamWriter, status: int, response: Dict[str, Any]) -> None:
+    body = json.dumps(response).encode("utf-8")
+    writer.write(
+        (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1")
+        + body
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve coffee chat matchings from a long-running local process.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", default=None, metavar="PATH", help="Listen on a unix socket instead of TCP.")
+    parser.add_argument("--workers", type=int, default=None, help="Processes to solve in (default: one per CPU).")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    init_logging(args.verbose)
+    service = MatchingService(max_workers=args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
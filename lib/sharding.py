@@ -0,0 +1,102 @@
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from affinity import UNKNOWN, ParticipantAttributes
+from implicit_matching import ProgressCallback
+from matching import matchmake
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from weights import SparseWeights
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ShardTask:
+    """
+    Everything a worker process needs to solve one shard, restricted to the shard's
+    participants so that its size, not the organization's, bounds the memory it takes.
+    """
+
+    value: str
+    ids: List[int]
+    constraints: List[Tuple[int, int]]
+    seed: int
+    weights: Optional["SparseWeights"] = None
+    conflicts: Optional["np.ndarray"] = None
+
+
+def split_shards(attributes: ParticipantAttributes, column: str) -> Dict[str, List[str]]:
+    """
+    Groups the participants by their value in a roster column. People without a value
+    share the "" shard.
+    """
+    if column not in attributes.codes:
+        raise ValueError(f"The roster has no {column!r} column to shard by, it has {attributes.columns}")
+    vocab = attributes.vocab[column]
+    shards: Dict[str, List[str]] = {}
+    for name, code in zip(attributes.names, attributes.codes[column].tolist()):
+        shards.setdefault(vocab[code] if code != UNKNOWN else "", []).append(name)
+    if "" in shards:
+        logger.warning(f"{len(shards[''])} participants have no {column}, they're matched as one more shard")
+    return shards
+
+
+def _solve_shard(task: ShardTask, backend: str, group_size: int) -> List[Tuple[int, ...]]:
+    return matchmake(
+        task.ids,
+        task.constraints,
+        backend=backend,
+        seed=task.seed,
+        weights=task.weights,
+        group_size=group_size,
+        conflicts=task.conflicts,
+    )
+
+
+def solve_shards(
+    tasks: List[ShardTask],
+    backend: str = "implicit",
+    group_size: int = 2,
+    max_workers: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> List[List[Tuple[int, ...]]]:
+    """
+    Solves every shard, in parallel worker processes when there's more than one.
+    Progress is reported as the fraction of shards solved, and a MatchingCancelled
+    raised from it abandons the shards still solving.
+    Returns:
+        groups: List[List[Tuple[int, ...]]], the groups of every task, in order.
+    """
+    if progress is not None:
+        progress("shards", 0.0)
+    if len(tasks) <= 1 or max_workers == 1:
+        solved = []
+        for i, task in enumerate(tasks):
+            solved.append(_solve_shard(task, backend, group_size))
+            if progress is not None:
+                progress("shards", (i + 1) / len(tasks))
+        return solved
+
+    # multiprocessing is slow to import, only pay for it when sharding
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    # largest shards first, so that a big one doesn't start last and hold everyone up
+    order = sorted(range(len(tasks)), key=lambda i: len(tasks[i].ids), reverse=True)
+    results: List[List[Tuple[int, ...]]] = [[] for _ in tasks]
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(_solve_shard, tasks[i], backend, group_size): i for i in order}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            results[i] = future.result()
+            logger.debug(f"Solved shard {tasks[i].value!r} ({len(tasks[i].ids)} participants)")
+            if progress is not None:
+                progress("shards", done / len(tasks))
+    finally:
+        # after a cancel, don't wait for the shards still solving
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from history_index import pair_keys
+from weights import SparseWeights
+
+logger = logging.getLogger(__name__)
+
+SOLVE_CACHE_FILENAME = ".solve-cache.sqlite"
+# least recently used solves are evicted past this many
+DEFAULT_CACHE_ENTRIES = 64
+# a cached matching is only worth warm-starting from if it shares this much of the roster
+MIN_WARM_START_OVERLAP = 0.5
+
+
+def solve_key(
+    ids: Sequence[int],
+    constraints: Optional[Sequence[Tuple[int, int]]],
+    seed: Optional[int] = None,
+    weights: Optional[SparseWeights] = None,
+    conflicts: Optional[np.ndarray] = None,
+    group_size: int = 2,
+    backend: str = "implicit",
+) -> str:
+    """
+    Hashes everything a solve depends on. The roster and the constraints are hashed as
+    sets, so the same people and history in another order give the same key.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps([settings_key(group_size, backend, weights, conflicts), seed]).encode("utf-8"))
+    digest.update(np.unique(np.asarray(ids, dtype=np.int64)).tobytes())
+    pairs = np.array(list(constraints or ()), dtype=np.int64).reshape(-1, 2)
+    digest.update(np.unique(pair_keys(pairs[:, 0], pairs[:, 1])).tobytes())
+    if weights is not None:
+        digest.update(weights.fingerprint())
+    if conflicts is not None:
+        digest.update(np.ascontiguousarray(conflicts).tobytes())
+    return digest.hexdigest()
+
+
+def settings_key(
+    group_size: int,
+    backend: str,
+    weights: Optional[SparseWeights],
+    conflicts: Optional[np.ndarray],
+) -> str:
+    """
+    Describes how a solve was run, so that only matchings solved the same way are
+    warm-started from.
+    """
+    return f"{backend}/k={group_size}/weights={weights is not None}/conflicts={conflicts is not None}"
+
+
+class SolveCache:
+    """
+    On-disk cache of solved matchings keyed by solve_key, with least recently used
+    eviction. Besides exact hits, it finds the cached matching whose roster overlaps a
+    new roster the most, to repair instead of solving from scratch.
+    """
+
+    def __init__(
+        self,
+        pairings_dirname: str,
+        max_entries: int = DEFAULT_CACHE_ENTRIES,
+        cache_filename: str = SOLVE_CACHE_FILENAME,
+    ):
+        self.cache_path = os.path.join(pairings_dirname, cache_filename)
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(self.cache_path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS solves (
+                key TEXT PRIMARY KEY,
+                settings TEXT NOT NULL,
+                participants BLOB NOT NULL,
+                groups TEXT NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS solves_by_settings ON solves (settings);
+            """
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get(self, key: str) -> Optional[List[Tuple[int, ...]]]:
+        row = self.conn.execute("SELECT groups FROM solves WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute("UPDATE solves SET last_used = ? WHERE key = ?", (time.time(), key))
+        return [tuple(group) for group in json.loads(row[0])]
+
+    def put(
+        self,
+        key: str,
+        settings: str,
+        ids: Sequence[int],
+        groups: Sequence[Tuple[int, ...]],
+    ) -> None:
+        participants = np.unique(np.asarray(ids, dtype=np.int64)).tobytes()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO solves (key, settings, participants, groups, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, settings, participants, json.dumps([list(group) for group in groups]), time.time()),
+            )
+            evicted = self.conn.execute(
+                "DELETE FROM solves WHERE key NOT IN (SELECT key FROM solves ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            ).rowcount
+        if evicted:
+            logger.debug(f"Evicted {evicted} least recently used solves from {self.cache_path}")
+
+    def closest(
+        self,
+        settings: str,
+        ids: Sequence[int],
+        min_overlap: float = MIN_WARM_START_OVERLAP,
+    ) -> Optional[List[Tuple[int, ...]]]:
+        """
+        Finds the cached matching solved the same way whose roster is most similar to
+        `ids` (by Jaccard overlap), if it's similar enough to warm-start from.
+        """
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        best_overlap, best_key, best_groups = min_overlap, None, None
+        for key, participants, groups in self.conn.execute(
+            "SELECT key, participants, groups FROM solves WHERE settings = ?", (settings,)
+        ):
+            cached = np.frombuffer(participants, dtype=np.int64)
+            shared = len(np.intersect1d(ids, cached, assume_unique=True))
+            overlap = shared / (len(ids) + len(cached) - shared) if len(ids) or len(cached) else 0.0
+            if overlap >= best_overlap:
+                best_overlap, best_key, best_groups = overlap, key, groups
+        if best_key is None:
+            return None
+        logger.info(f"Warm-starting from a cached matching sharing {100 * best_overlap:.0f}% of the roster")
+        with self.conn:
+            self.conn.execute("UPDATE solves SET last_used = ? WHERE key = ?", (time.time(), best_key))
+        return [tuple(group) for group in json.loads(best_groups)]
@@ -0,0 +1,231 @@
+import datetime
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from history_index import KEY_STRIDE, PairingHistory, pair_keys
+
+logger = logging.getLogger(__name__)
+
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+MONTH_PATTERN = re.compile(r"^(" + "|".join(MONTHS) + r")[a-z]*[-_ ]?(\d{2}|\d{4})", re.IGNORECASE)
+# integer weights, where a pair that never met is worth WEIGHT_SCALE and 0 means no edge
+WEIGHT_SCALE = 1000
+# listing more pairs than this would take as much memory as the dense matrix it avoids
+MAX_LISTED_PAIRS = 20_000_000
+
+
+def month_index(date: datetime.date) -> int:
+    return date.year * 12 + date.month - 1
+
+
+def file_month(filename: str) -> Optional[int]:
+    """
+    Returns the month a pairings file was for, as year * 12 + month - 1. Uses the
+    filename when it looks like "dec24.csv", and the file's modification time otherwise.
+    """
+    match = MONTH_PATTERN.match(os.path.basename(filename))
+    if match is not None:
+        year = int(match.group(2))
+        if year < 100:
+            year += 2000
+        return year * 12 + MONTHS.index(match.group(1).lower())
+    if os.path.exists(filename):
+        return month_index(datetime.date.fromtimestamp(os.path.getmtime(filename)))
+    return None
+
+
+def latest_meetings(
+    history: PairingHistory,
+    exclude: Iterable[str] = (),
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the most recent month each pair met in, skipping files whose basename is in
+    `exclude` (compared case-insensitively).
+    Returns:
+        keys: np.ndarray[int64], the pair keys.
+        months: np.ndarray[int64], the latest month of each pair.
+    """
+    file_months = np.array(
+        [file_month(filename) for filename in history.filenames], dtype=float
+    )
+    file_months = np.nan_to_num(file_months, nan=-1).astype(np.int64)
+    mask = history.file_mask(exclude)
+    keys = history.occurrence_keys[mask]
+    months = file_months[history.occurrence_files[mask]]
+    keys, months = keys[months >= 0], months[months >= 0]
+    if len(keys) == 0:
+        return keys, months
+
+    order = np.argsort(keys, kind="stable")
+    keys, months = keys[order], months[order]
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return keys[starts], np.maximum.reduceat(months, starts)
+
+
+def key_positions(ids: List[int], keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Maps pair keys onto positions in `ids` in one vectorized pass.
+    Returns:
+        rows: np.ndarray, position of the smaller ID of each kept pair.
+        cols: np.ndarray, position of the larger ID of each kept pair.
+        kept: np.ndarray[bool], which keys had both people in `ids`.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    if len(ids) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(len(keys), dtype=bool)
+    ids_arr = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(ids_arr)
+    sorted_ids = ids_arr[order]
+    a, b = np.divmod(keys, KEY_STRIDE)
+    pos_a = np.minimum(np.searchsorted(sorted_ids, a), len(ids) - 1)
+    pos_b = np.minimum(np.searchsorted(sorted_ids, b), len(ids) - 1)
+    kept = (sorted_ids[pos_a] == a) & (sorted_ids[pos_b] == b)
+    return order[pos_a[kept]], order[pos_b[kept]], kept
+
+
+def constraint_positions(
+    ids: List[int],
+    constraints: Optional[Iterable[Tuple[int, int]]],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Maps ID pairs onto positions in `ids`, dropping the pairs that involve anyone else.
+    Returns:
+        rows: np.ndarray, position of the smaller ID of each kept pair.
+        cols: np.ndarray, position of the larger ID of each kept pair.
+    """
+    pairs = np.array(list(constraints or ()), dtype=np.int64).reshape(-1, 2)
+    rows, cols, kept = key_positions(ids, pair_keys(pairs[:, 0], pairs[:, 1]))
+    if not kept.all():
+        logger.debug(
+            f"Skipped {int((~kept).sum())} constraints because one or more persons in the pair is not a participant"
+        )
+    distinct = rows != cols
+    return rows[distinct], cols[distinct]
+
+
+@dataclass
+class SparseWeights:
+    """
+    Edge weights of n participants where most pairs weigh `default`, stored as just the
+    pairs that don't. Pairs are positions in the de-duplicated ids with rows < cols, in
+    sorted order, and a weight of 0 means no edge. Memory grows with the listed pairs,
+    e.g. the pairing history, instead of n^2.
+    """
+
+    n: int
+    rows: np.ndarray
+    cols: np.ndarray
+    values: np.ndarray
+    default: int = WEIGHT_SCALE
+
+    @classmethod
+    def from_pairs(
+        cls,
+        n: int,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        values: np.ndarray,
+        default: int = WEIGHT_SCALE,
+    ) -> "SparseWeights":
+        """
+        Lists the given pairs, in either order. A pair listed twice keeps its last
+        weight, and pairs that weigh the default anyway aren't kept.
+        """
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        values = np.asarray(values, dtype=np.int64)
+        if len(values) > MAX_LISTED_PAIRS:
+            raise ValueError(
+                f"{len(values)} pairs have their own weight, more than the {MAX_LISTED_PAIRS} that fit in memory"
+            )
+        stride = max(n, 1)
+        keys = np.minimum(rows, cols) * stride + np.maximum(rows, cols)
+        # np.unique keeps the first occurrence, so search the reversed keys for the last
+        keys, first = np.unique(keys[::-1], return_index=True)
+        values = values[::-1][first]
+        kept = (values != default) & (keys // stride != keys % stride)
+        keys, values = keys[kept], values[kept]
+        return cls(n, keys // stride, keys % stride, values, default)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def lookup(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        Returns the weights of the given position pairs, in either order.
+        """
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        weights = np.full(len(rows), self.default, dtype=np.int64)
+        if len(self.values):
+            keys = np.minimum(rows, cols) * self.n + np.maximum(rows, cols)
+            listed = self.rows * self.n + self.cols
+            found = np.minimum(np.searchsorted(listed, keys), len(listed) - 1)
+            hit = listed[found] == keys
+            weights[hit] = self.values[found[hit]]
+        weights[rows == cols] = 0
+        return weights
+
+    def forbidden(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the pairs with no edge, as (rows, cols).
+        """
+        zero = self.values == 0
+        return self.rows[zero], self.cols[zero]
+
+    def dense(self) -> np.ndarray:
+        """
+        Builds the full n x n matrix, for the solvers that need one.
+        """
+        weights = np.full((self.n, self.n), self.default, dtype=np.int64)
+        weights[self.rows, self.cols] = self.values
+        weights[self.cols, self.rows] = self.values
+        np.fill_diagonal(weights, 0)
+        return weights
+
+    def fingerprint(self) -> bytes:
+        header = np.array([self.n, self.default], dtype=np.int64)
+        return b"".join(array.tobytes() for array in (header, self.rows, self.cols, self.values))
+
+
+def recency_weights(
+    ids: List[int],
+    hard_keys: np.ndarray,
+    soft_keys: np.ndarray,
+    soft_months: np.ndarray,
+    current_month: int,
+    half_life: float,
+) -> SparseWeights:
+    """
+    Builds the edge weights of the participants in `ids`. A pair that never met weighs
+    WEIGHT_SCALE, a pair that met recently weighs less, recovering half of the gap
+    every `half_life` months. Hard constraints weigh 0, i.e. no edge. Only the pairs
+    that met or are constrained are listed.
+    """
+    # a pair under a hard constraint stays at 0 even if it met before
+    soft = ~np.isin(soft_keys, hard_keys)
+    soft_keys, soft_months = soft_keys[soft], soft_months[soft]
+    rows, cols, kept = key_positions(ids, soft_keys)
+    age = np.maximum(current_month - soft_months[kept], 0)
+    # keep at least 1 so that a repeat is still preferred over leaving someone out
+    decayed = np.maximum(np.rint(WEIGHT_SCALE * (1 - 0.5 ** (age / half_life))), 1)
+    hard_rows, hard_cols, _ = key_positions(ids, hard_keys)
+    return SparseWeights.from_pairs(
+        len(ids),
+        np.concatenate([rows, hard_rows]),
+        np.concatenate([cols, hard_cols]),
+        np.concatenate([decayed, np.zeros(len(hard_rows))]),
+    )
+
+
+def fresh_weights(ids: List[int], hard_keys: np.ndarray) -> SparseWeights:
+    """
+    Builds the edge weights where every allowed pair weighs WEIGHT_SCALE, and the pairs
+    in hard_keys weigh 0, i.e. no edge.
+    """
+    rows, cols, _ = key_positions(ids, hard_keys)
+    return SparseWeights.from_pairs(len(ids), rows, cols, np.zeros(len(rows)))
@@ -0,0 +1,45 @@
+import numpy as np
+
+from history_index import PairingHistory, pair_key, pair_keys, split_key
+
+
+def history(tmp_path, files):
+    filenames = list(files)
+    keys = [pair_key(a, b) for pairs in files.values() for a, b in pairs]
+    occurrence_files = [i for i, pairs in enumerate(files.values()) for _ in pairs]
+    return PairingHistory.from_occurrences(
+        str(tmp_path),
+        filenames,
+        np.array(keys, dtype=np.int64),
+        np.array(occurrence_files, dtype=np.int64),
+        {},
+    )
+
+
+def test_pair_keys_are_symmetric():
+    assert pair_key(3, 7) == pair_key(7, 3)
+    assert split_key(pair_key(7, 3)) == (3, 7)
+    assert pair_keys(np.array([7, 1]), np.array([3, 2])).tolist() == [pair_key(3, 7), pair_key(1, 2)]
+
+
+def test_repeats_across_history_and_new_pairings(tmp_path):
+    h = history(tmp_path, {"nov24.csv": [(0, 1), (2, 3)], "dec24.csv": [(1, 0), (4, 5)]})
+    extra = {"jan25.csv": pair_keys(np.array([4, 6]), np.array([5, 7]))}
+    repeats = h.repeats(extra)
+    nov, dec = (str(tmp_path / name) for name in ("nov24.csv", "dec24.csv"))
+    assert repeats == {pair_key(0, 1): [nov, dec], pair_key(4, 5): [dec, "jan25.csv"]}
+
+
+def test_repeats_ignore_excluded_files(tmp_path):
+    h = history(tmp_path, {"nov24.csv": [(0, 1)], "JAN25.csv": [(0, 1), (2, 3)]})
+    # re-generating jan25 shouldn't count its old version, whatever the case
+    extra = {"jan25.csv": np.array([pair_key(2, 3)], dtype=np.int64)}
+    assert h.repeats(extra, exclude=["jan25.csv"]) == {}
+    assert h.repeats({"jan25.csv": np.array([pair_key(1, 0)], dtype=np.int64)}, exclude=["jan25.csv"]) == {
+        pair_key(0, 1): [str(tmp_path / "nov24.csv"), "jan25.csv"]
+    }
+
+
+def test_no_repeats(tmp_path):
+    h = history(tmp_path, {"nov24.csv": [(0, 1), (2, 3)]})
+    assert h.repeats({"dec24.csv": np.array([pair_key(0, 2), pair_key(1, 3)], dtype=np.int64)}) == {}
@@ -0,0 +1,72 @@
+import id_registry
+from id_registry import IdRegistry
+
+
+def registry(tmp_path):
+    return IdRegistry(str(tmp_path / "ids.csv"))
+
+
+def test_round_trip_across_reopen(tmp_path):
+    r = registry(tmp_path)
+    ids = r.register(["Ana", "Ben", "Ana", "Cy, Jr."])
+    assert ids == {"Ana": 0, "Ben": 1, "Cy, Jr.": 2}
+    assert r.register(["Di", "Ben"]) == {"Di": 3, "Ben": 1}
+    r.close()
+
+    r = registry(tmp_path)
+    assert len(r) == 4
+    assert [r.lookup(name) for name in ("Ana", "Ben", "Cy, Jr.", "Di", "Eve")] == [0, 1, 2, 3, None]
+    assert r.reverse() == ["Ana", "Ben", "Cy, Jr.", "Di"]
+    assert r.register(["Eve"]) == {"Eve": 4}
+    r.close()
+
+
+def test_merged_name_is_an_alias(tmp_path):
+    r = registry(tmp_path)
+    r.register(["Katie Nelson", "Ben"])
+    r.register(["katie nelson"])
+    [duplicate] = r.pending_duplicates()
+    assert (duplicate.name, duplicate.existing) == ("katie nelson", "Katie Nelson")
+    assert r.merge(duplicate) == 0
+    assert r.pending_duplicates() == []
+    r.close()
+
+    r = registry(tmp_path)
+    assert r.lookup("katie nelson") == 0
+    assert r.name_of(0) == "Katie Nelson"
+    assert r.aliases == 1
+    assert r.pending_duplicates() == []
+    r.close()
+
+
+def test_rows_added_by_hand_are_indexed_and_checked(tmp_path):
+    r = registry(tmp_path)
+    r.register(["Katie Nelson"])
+    r.close()
+    with open(tmp_path / "ids.csv", "a", newline="") as f:
+        f.write("Ben,1\r\nKatie  Nelson,2")
+
+    r = registry(tmp_path)
+    assert r.lookup("Ben") == 1
+    assert r.lookup("Katie  Nelson") == 2
+    assert [d.name for d in r.pending_duplicates()] == ["Katie  Nelson"]
+    # the missing final line break doesn't glue the next row onto the last one
+    assert r.register(["Cy"]) == {"Cy": 3}
+    r.close()
+    assert registry(tmp_path).reverse() == ["Katie Nelson", "Ben", "Katie  Nelson", "Cy"]
+
+
+def test_delta_is_merged_into_the_table(tmp_path, monkeypatch):
+    monkeypatch.setattr(id_registry, "MIN_DELTA_RECORDS", 4)
+    names = [f"Person {i:03d}" for i in range(40)]
+    r = registry(tmp_path)
+    for name in names:
+        r.register([name])
+    assert len(r.delta) <= 5
+    r.close()
+
+    r = registry(tmp_path)
+    assert len(r.hashes) > 30
+    assert [r.lookup(name) for name in names] == list(range(40))
+    assert r.names_of([0, 39]) == ["Person 000", "Person 039"]
+    r.close()
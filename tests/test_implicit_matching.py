@@ -0,0 +1,103 @@
+import itertools
+import random
+from typing import List, Sequence, Set, Tuple
+
+import networkx as nx
+import pytest
+
+from implicit_matching import ComplementMatcher
+
+
+def complement_of(n: int, edges: Sequence[Tuple[int, int]]) -> List[Set[int]]:
+    """
+    The forbidden sets that leave exactly `edges` allowed.
+    """
+    allowed = {frozenset(edge) for edge in edges}
+    forbidden: List[Set[int]] = [set() for _ in range(n)]
+    for u, v in itertools.combinations(range(n), 2):
+        if frozenset((u, v)) not in allowed:
+            forbidden[u].add(v)
+            forbidden[v].add(u)
+    return forbidden
+
+
+def assert_valid(matcher: ComplementMatcher, pairs: List[Tuple[int, int]]) -> None:
+    matched = [v for pair in pairs for v in pair]
+    assert len(matched) == len(set(matched))
+    assert all(matcher.allowed(u, v) for u, v in pairs)
+
+
+CYCLE_6 = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 0)]
+CYCLE_5 = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 0)]
+# two triangles joined by the edge 2-3: the only perfect matching uses that edge
+TRIANGLES = [(0, 1), (1, 2), (2, 0), (3, 4), (4, 5), (5, 3), (2, 3)]
+PETERSEN = [(i, (i + 1) % 5) for i in range(5)] + [(i, i + 5) for i in range(5)] + [
+    (5 + i, 5 + (i + 2) % 5) for i in range(5)
+]
+
+
+@pytest.mark.parametrize(
+    "n, edges, max_pairs",
+    [
+        (6, CYCLE_6, 3),
+        (5, CYCLE_5, 2),
+        (6, TRIANGLES, 3),
+        (10, PETERSEN, 5),
+        # a star pairs its center only
+        (5, [(0, 1), (0, 2), (0, 3), (0, 4)], 1),
+    ],
+)
+def test_maximum_matching_on_small_graphs(n, edges, max_pairs):
+    for seed in range(20):
+        matcher = ComplementMatcher(n, complement_of(n, edges))
+        pairs = matcher.solve(random.Random(seed))
+        assert len(pairs) == max_pairs
+        assert_valid(matcher, pairs)
+
+
+def test_augmenting_path_through_a_blossom():
+    # the triangle 4-0-2 with the stem 0-1: from 4, the only augmenting path is
+    # 4-2=0-1, which the alternating BFS can't see because it labels 0 and 2 at once
+    n = 5
+    matcher = ComplementMatcher(n, complement_of(n, [(0, 1), (0, 2), (0, 4), (2, 4)]))
+    assert matcher.seed([(0, 2)]) == 1
+    assert matcher._find_path_simple(4)[0] == -1
+    assert matcher.augment(4)
+    assert sorted(matcher.pairs()) == [(0, 1), (2, 4)]
+
+
+def test_maximum_matching_matches_networkx_on_random_graphs():
+    rng = random.Random(0)
+    for _ in range(200):
+        n = rng.randint(2, 12)
+        edges = [edge for edge in itertools.combinations(range(n), 2) if rng.random() < 0.3]
+        graph = nx.Graph()
+        graph.add_nodes_from(range(n))
+        graph.add_edges_from(edges)
+        expected = len(nx.max_weight_matching(graph, maxcardinality=True))
+        matcher = ComplementMatcher(n, complement_of(n, edges))
+        pairs = matcher.solve(rng)
+        assert len(pairs) == expected
+        assert_valid(matcher, pairs)
+
+
+def test_decomposition_of_a_star():
+    # any leaf may be left out, and the center is the bottleneck they all need
+    n = 5
+    matcher = ComplementMatcher(n, complement_of(n, [(0, 1), (0, 2), (0, 3), (0, 4)]))
+    matcher.solve(random.Random(0))
+    d, a = matcher.decomposition()
+    assert d == [1, 2, 3, 4]
+    assert a == [0]
+
+
+def test_decomposition_of_an_odd_cycle_with_a_pendant():
+    # the triangle 0-1-2 plus the pendant pair 3-4: any triangle vertex may be left out,
+    # and nobody outside it is a bottleneck
+    n = 5
+    matcher = ComplementMatcher(n, complement_of(n, [(0, 1), (1, 2), (2, 0), (3, 4)]))
+    matcher.solve(random.Random(0))
+    d, a = matcher.decomposition()
+    assert d == [0, 1, 2]
+    assert a == []
+    assert matcher.components(d) == {0: 0, 1: 0, 2: 0}
@@ -0,0 +1,93 @@
+import itertools
+
+import numpy as np
+
+from feasibility import analyze_feasibility
+from groups import group_sizes, partition
+from history_index import pair_key
+from matching import matchmake, repair, schedule
+
+
+def met(groups):
+    return {frozenset(pair) for group in groups for pair in itertools.combinations(group, 2)}
+
+
+def test_odd_roster_gets_one_trio():
+    ids = list(range(10, 17))
+    constraints = [(10, 11), (12, 13), (14, 15)]
+    for seed in range(10):
+        groups = matchmake(ids, constraints, seed=seed)
+        assert sorted(len(group) for group in groups) == [2, 2, 3]
+        assert sorted(v for group in groups for v in group) == ids
+        assert not met(groups) & {frozenset(pair) for pair in constraints}
+
+
+def test_schedule_never_repeats_and_gives_odd_rosters_a_trio():
+    ids = list(range(9))
+    months = schedule(ids, [(0, 1)], 3, seed=1)
+    assert len(months) == 3
+    seen = {frozenset((0, 1))}
+    for groups in months:
+        assert sorted(len(group) for group in groups) == [2, 2, 2, 3]
+        assert sorted(v for group in groups for v in group) == ids
+        assert not met(groups) & seen
+        seen |= met(groups)
+
+
+def test_repair_keeps_the_pairs_still_on_the_roster():
+    pairs = [(0, 1), (2, 3), (4, 5)]
+    # 5 dropped out and 6 joined, who can't meet 0
+    repaired = repair(pairs, [0, 1, 2, 3, 4, 6], constraints=[(0, 6)], seed=0)
+    assert {frozenset(pair) for pair in repaired} == {frozenset((0, 1)), frozenset((2, 3)), frozenset((4, 6))}
+
+
+def test_repair_re_pairs_along_an_augmenting_path():
+    # 6 can only meet 0, so 0's partner moves to 5's old partner 4
+    pairs = [(0, 1), (2, 3), (4, 5)]
+    constraints = [(6, v) for v in (1, 2, 3, 4)]
+    repaired = repair(pairs, [0, 1, 2, 3, 4, 6], constraints, seed=0)
+    assert {frozenset(pair) for pair in repaired} == {frozenset((0, 6)), frozenset((1, 4)), frozenset((2, 3))}
+
+
+def test_feasibility_relaxes_the_oldest_pairing():
+    # 0 already met everyone: 1 in month 3, 2 in month 1 and 3 in month 2
+    soft = [(0, 1, 3), (0, 2, 1), (0, 3, 2)]
+    report = analyze_feasibility(
+        [0, 1, 2, 3],
+        [(a, b) for a, b, _ in soft],
+        soft_keys=np.array([pair_key(a, b) for a, b, _ in soft], dtype=np.int64),
+        soft_months=np.array([month for _, _, month in soft], dtype=np.int64),
+        hard_keys=np.zeros(0, dtype=np.int64),
+        seed=0,
+    )
+    assert not report.feasible
+    assert report.max_pairs == 1
+    assert report.left_out == 2
+    assert report.bottleneck == []
+    assert report.could_be_unpaired == [0, 1, 2, 3]
+    assert report.relaxations == [(0, 2, 1)]
+
+
+def test_feasible_roster_needs_no_relaxations():
+    report = analyze_feasibility(
+        [0, 1, 2, 3, 4],
+        [(0, 1)],
+        soft_keys=np.zeros(0, dtype=np.int64),
+        soft_months=np.zeros(0, dtype=np.int64),
+        hard_keys=np.zeros(0, dtype=np.int64),
+    )
+    assert report.feasible
+    assert report.max_pairs == 2
+
+
+def test_partition_into_groups_avoids_conflicts():
+    assert group_sizes(7, 2) == [2, 2, 3]
+    assert group_sizes(10, 4) == [5, 5]
+    # 0, 1 and 2 conflict with each other, so each needs a different group of 3
+    conflicts = np.zeros((9, 9))
+    for a, b in itertools.combinations(range(3), 2):
+        conflicts[a, b] = conflicts[b, a] = 1
+    groups = partition(conflicts, 3, seed=0)
+    assert sorted(len(group) for group in groups) == [3, 3, 3]
+    assert sorted(v for group in groups for v in group) == list(range(9))
+    assert all(len(set(group) & {0, 1, 2}) == 1 for group in groups)